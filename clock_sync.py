@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Clock offset estimation between the DepthAI device, the Pi and its clients.
+
+Timestamps on the wire come from getTimestamp() on DepthAI messages. To turn
+them into something a receiver can compare against its own clock, the
+streamer keeps three continuously filtered mappings:
+
+    device -> wire        getTimestampDevice() vs getTimestamp() on frames
+                          (the raw device clock, for drift diagnostics)
+    wire   -> monotonic   dai.Clock.now() bracketed by time.monotonic()
+    monotonic -> wall     time.time() bracketed by time.monotonic()
+
+Each mapping is a linear fit (offset + drift) over a sliding window, fitted
+on the samples with the tightest brackets so scheduling hiccups are rejected.
+Residuals of all samples against the fit are reported as offset jitter.
+
+Clients run an NTP-like exchange against the streamer's timestamp UDP port
+(see TimeSyncClient in oak_receiver.py) to map wire timestamps into their
+own clock and measure send-to-receive latency.
+"""
+import struct
+import time
+from collections import deque
+
+import numpy as np
+
+# UDP time sync exchange on the RGB timestamp port
+TIME_SYNC_REQUEST_MAGIC = 0x5453594E  # "TSYN"
+TIME_SYNC_RESPONSE_MAGIC = 0x54535952  # "TSYR"
+
+# Request:  [4B magic][4B sequence][8B client_t0]
+# Response: [4B magic][4B sequence][8B client_t0][8B pi_receive][8B pi_transmit]
+#           [8B wire_at_transmit][8B drift_ppm][8B wall_minus_monotonic][4B jitter_us]
+# pi_* are Pi monotonic seconds, wire_at_transmit is the wire clock at pi_transmit.
+TIME_SYNC_REQUEST = struct.Struct('>IId')
+TIME_SYNC_RESPONSE = struct.Struct('>IIddddddf')
+
+
+class ClockOffsetFilter:
+    """
+    Sliding-window linear fit of target = source + offset + drift * (source - ref).
+
+    uncertainty is the width of the bracket the sample was taken in (0 if
+    unknown); only the tightest keep_fraction of samples are fitted.
+
+    add() sits on the capture path (once per stereo frame), so the window is
+    refitted every refit_interval samples rather than on every one; between
+    refits map() extrapolates the last fit, which drift keeps accurate over a
+    few hundred milliseconds. stats() refits first if samples are pending.
+    """
+
+    def __init__(self, window=128, keep_fraction=0.5, min_fit_span=1.0, refit_interval=16):
+        self.keep_fraction = keep_fraction
+        self.min_fit_span = min_fit_span
+        self.refit_interval = refit_interval
+        self._samples = deque(maxlen=window)
+        self._pending = 0
+        self.ref = 0.0
+        self.offset = None
+        self.drift = 0.0
+        self.jitter_std = 0.0
+        self.jitter_p95 = 0.0
+        self.samples_seen = 0
+
+    def add(self, source, target, uncertainty=0.0):
+        self._samples.append((source, target - source, uncertainty))
+        self.samples_seen += 1
+        self._pending += 1
+        if self.offset is None or self._pending >= self.refit_interval:
+            self._fit()
+
+    def _fit(self):
+        self._pending = 0
+        data = np.array(self._samples)
+        src, off, unc = data[:, 0], data[:, 1], data[:, 2]
+        self.ref = float(src[-1])
+
+        if len(src) >= 4:
+            kth = int(self.keep_fraction * (len(unc) - 1))
+            keep = unc <= np.partition(unc, kth)[kth]
+            fit_src, fit_off = src[keep] - self.ref, off[keep]
+        else:
+            fit_src, fit_off = src - self.ref, off
+
+        if len(fit_src) >= 2 and fit_src.max() - fit_src.min() >= self.min_fit_span:
+            # Closed-form least squares line (np.polyfit's SVD costs ~10x more)
+            x_mean = fit_src.mean()
+            y_mean = fit_off.mean()
+            dx = fit_src - x_mean
+            self.drift = float(np.dot(dx, fit_off - y_mean) / np.dot(dx, dx))
+            self.offset = float(y_mean - self.drift * x_mean)
+        else:
+            self.drift, self.offset = 0.0, float(np.median(fit_off))
+
+        residuals = off - (self.offset + self.drift * (src - self.ref))
+        self.jitter_std = float(np.std(residuals))
+        self.jitter_p95 = float(np.percentile(np.abs(residuals), 95))
+
+    def map(self, source):
+        if self.offset is None:
+            return source
+        return source + self.offset + self.drift * (source - self.ref)
+
+    def inverse(self, target):
+        if self.offset is None:
+            return target
+        # target = source * (1 + drift) + offset - drift * ref
+        return (target - self.offset + self.drift * self.ref) / (1.0 + self.drift)
+
+    def stats(self):
+        if self._pending:
+            self._fit()
+        return {
+            'offset_s': self.offset if self.offset is not None else 0.0,
+            'drift_ppm': self.drift * 1e6,
+            'jitter_std_us': self.jitter_std * 1e6,
+            'jitter_p95_us': self.jitter_p95 * 1e6,
+            'samples': self.samples_seen,
+        }
+
+
+class ClockSync:
+    """Device / wire / Pi monotonic / Pi wall clock mappings for the streamer."""
+
+    def __init__(self, wire_clock=None):
+        # wire_clock() returns the current wire-clock time in seconds
+        # (dai.Clock.now().total_seconds() on the Pi). Without it the wire
+        # clock is assumed to be the Pi monotonic clock.
+        self.wire_clock = wire_clock
+        self.device_to_wire = ClockOffsetFilter()
+        self.wire_to_monotonic = ClockOffsetFilter()
+        self.monotonic_to_wall = ClockOffsetFilter(window=32)
+
+    def observe_frame(self, frame):
+        """Record a (device, wire) timestamp pair from a DepthAI message."""
+        if hasattr(frame, 'getTimestampDevice'):
+            self.device_to_wire.add(frame.getTimestampDevice().total_seconds(),
+                                    frame.getTimestamp().total_seconds())
+
+    def sample_host_clocks(self):
+        """Bracket the wire and wall clocks with Pi monotonic reads."""
+        if self.wire_clock:
+            before = time.monotonic()
+            wire = self.wire_clock()
+            after = time.monotonic()
+            self.wire_to_monotonic.add(wire, 0.5 * (before + after), after - before)
+
+        before = time.monotonic()
+        wall = time.time()
+        after = time.monotonic()
+        self.monotonic_to_wall.add(0.5 * (before + after), wall, after - before)
+
+    def wire_to_mono(self, wire_ts):
+        return self.wire_to_monotonic.map(wire_ts)
+
+    def mono_to_wire(self, mono_ts):
+        return self.wire_to_monotonic.inverse(mono_ts)
+
+    def wire_to_wall(self, wire_ts):
+        return self.monotonic_to_wall.map(self.wire_to_mono(wire_ts))
+
+    def build_time_sync_response(self, request, receive_mono):
+        """Answer a TSYN request; returns None if the packet is not one."""
+        if len(request) != TIME_SYNC_REQUEST.size:
+            return None
+        magic, sequence, client_t0 = TIME_SYNC_REQUEST.unpack(request)
+        if magic != TIME_SYNC_REQUEST_MAGIC:
+            return None
+        transmit_mono = time.monotonic()
+        wall_offset = self.monotonic_to_wall.offset if self.monotonic_to_wall.offset is not None else 0.0
+        return TIME_SYNC_RESPONSE.pack(
+            TIME_SYNC_RESPONSE_MAGIC, sequence, client_t0,
+            receive_mono, transmit_mono,
+            self.mono_to_wire(transmit_mono),
+            self.wire_to_monotonic.drift * 1e6,
+            wall_offset,
+            self.wire_to_monotonic.jitter_std * 1e6,
+        )
+
+    def stats(self):
+        return {
+            'device_to_wire': self.device_to_wire.stats(),
+            'wire_to_monotonic': self.wire_to_monotonic.stats(),
+            'monotonic_to_wall': self.monotonic_to_wall.stats(),
+        }
+
+
+class LatencyTracker:
+    """Per-stage latency accumulator, reset every stats interval."""
+
+    def __init__(self):
+        self._stages = {}
+
+    def record(self, stage, seconds):
+        entry = self._stages.get(stage)
+        if entry is None:
+            self._stages[stage] = [seconds, seconds, 1]
+        else:
+            entry[0] += seconds
+            entry[1] = max(entry[1], seconds)
+            entry[2] += 1
+
+    def snapshot(self):
+        """Return {stage: (mean_ms, max_ms, count)} and start a new interval."""
+        result = {stage: (total / count * 1000, peak * 1000, count)
+                  for stage, (total, peak, count) in self._stages.items()}
+        self._stages = {}
+        return result
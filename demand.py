@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Demand-driven scheduling of the DepthAI stream producers.
+
+The pipeline graph stays built (DepthAI cannot change a running graph), but
+producers are paused and resumed with CameraControl start/stop streaming:
+
+    rgb     ColorCamera CAM_A (+ H.264 encoder)  needed by RGB clients
+    stereo  MonoCamera CAM_B + CAM_C             needed by Left, Right and
+                                                 Depth clients (StereoDepth
+                                                 runs on the mono frames)
+
+A producer starts when the first client of any of its streams connects and
+stops once none of its streams has had a client for `linger` seconds, so a
+client reconnecting does not bounce the cameras. Activation latency is the
+time from the start command to the first frame captured after it.
+"""
+import time
+from collections import deque
+
+PRODUCER_STREAMS = {
+    'rgb': ('RGB',),
+    'stereo': ('Left', 'Right', 'Depth'),
+}
+
+
+class DemandScheduler:
+    """Tracks per-stream demand and starts/stops producers through callbacks."""
+
+    def __init__(self, controls, linger=2.0, producer_streams=PRODUCER_STREAMS):
+        # controls: {producer: (start_fn, stop_fn)}
+        self.controls = controls
+        self.linger = linger
+        self.producer_streams = producer_streams
+        self.state = {name: 'idle' for name in producer_streams}
+        self._activation_started = {}
+        self._last_demand = {name: 0.0 for name in producer_streams}
+        self.events = deque(maxlen=50)
+        self.stats = {name: {'activations': 0, 'deactivations': 0, 'last_activation_ms': None,
+                             'total_activation_ms': 0.0, 'measured': 0}
+                      for name in producer_streams}
+
+    def update(self, demand, forced=(), now=None):
+        """
+        demand: {stream: client count}; forced: producers that must run
+        regardless of clients (e.g. stereo for IMU preintegration).
+        """
+        if now is None:
+            now = time.monotonic()
+        for name, streams in self.producer_streams.items():
+            wanted = name in forced or any(demand.get(stream, 0) > 0 for stream in streams)
+            if wanted:
+                self._last_demand[name] = now
+                if self.state[name] == 'idle':
+                    self._transition(name, 'starting', now,
+                                     "clients on " + ", ".join(s for s in streams if demand.get(s, 0) > 0)
+                                     if name not in forced else "forced")
+            elif self.state[name] != 'idle' and now - self._last_demand[name] >= self.linger:
+                self._transition(name, 'idle', now, f"no clients for {self.linger:.1f}s")
+
+    def frame_arrived(self, name, capture_time, now=None):
+        """
+        A frame from this producer was dequeued. capture_time is its sensor
+        time on the Pi monotonic clock; frames captured before the start
+        command (stale queue contents) do not count as activation.
+        """
+        if self.state.get(name) != 'starting':
+            return
+        started = self._activation_started[name]
+        if capture_time < started:
+            return
+        if now is None:
+            now = time.monotonic()
+        latency_ms = (now - started) * 1000
+        stats = self.stats[name]
+        stats['last_activation_ms'] = latency_ms
+        stats['total_activation_ms'] += latency_ms
+        stats['measured'] += 1
+        self.state[name] = 'active'
+        self.events.append((time.time(), name, 'active', f"first frame after {latency_ms:.0f} ms"))
+
+    def _transition(self, name, new_state, now, reason):
+        start_fn, stop_fn = self.controls[name]
+        if new_state == 'starting':
+            self._activation_started[name] = now
+            self.stats[name]['activations'] += 1
+            start_fn()
+        else:
+            self.stats[name]['deactivations'] += 1
+            stop_fn()
+        self.state[name] = new_state
+        self.events.append((time.time(), name, new_state, reason))
+        print(f"Demand: {name} -> {new_state} ({reason})")
+
+    def is_active(self, name):
+        return self.state[name] != 'idle'
+
+    def summary(self):
+        parts = []
+        for name, state in self.state.items():
+            stats = self.stats[name]
+            part = f"{name} {state}"
+            if stats['measured']:
+                part += (f" (activation last {stats['last_activation_ms']:.0f} ms, "
+                         f"mean {stats['total_activation_ms'] / stats['measured']:.0f} ms, "
+                         f"{stats['activations']} starts/{stats['deactivations']} stops)")
+            parts.append(part)
+        return " | ".join(parts)
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+H.264 GOP cache so late-joining RGB clients can decode immediately.
+
+The encoder emits one Annex B access unit per packet. GopCache keeps the
+latest SPS/PPS and every packet since the last IDR, so a client that
+connects mid-GOP can be sent that burst (IDR first) before live packets
+instead of receiving undecodable P-frames until the next keyframe:
+
+    IDR packet      resets the cache; SPS/PPS are prepended if the encoder
+                    did not repeat them in the packet
+    other packets   appended while the GOP fits in max_bytes; past that the
+                    cache is dropped until the next IDR (a GOP with a hole
+                    in it is no better than none), and new clients wait for
+                    that IDR instead
+
+Each entry keeps the packet's sequence number, timestamp and sensor->dequeue
+latency so the burst can be replayed on the timestamp protocol unchanged.
+"""
+
+NAL_SLICE = 1
+NAL_IDR = 5
+NAL_SPS = 7
+NAL_PPS = 8
+
+_START_CODE = b'\x00\x00\x01'
+
+
+def scan_nal_units(packet):
+    """
+    [(nal_type, start, end)] for the NAL units of an Annex B packet, where
+    start..end covers the NAL including its start code. Stops after the
+    first slice: parameter sets always precede the picture data, and
+    scanning the slice payload would only cost time.
+    """
+    units = []
+    pos = packet.find(_START_CODE)
+    while pos >= 0 and pos + 3 < len(packet):
+        start = pos - 1 if pos > 0 and packet[pos - 1] == 0 else pos  # 4-byte start code
+        nal_type = packet[pos + 3] & 0x1F
+        if NAL_SLICE <= nal_type <= NAL_IDR:
+            units.append((nal_type, start, len(packet)))
+            break
+        next_pos = packet.find(_START_CODE, pos + 3)
+        end = len(packet) if next_pos < 0 else (next_pos - 1 if packet[next_pos - 1] == 0 else next_pos)
+        units.append((nal_type, start, end))
+        pos = next_pos
+    return units
+
+
+class GopCache:
+    """Latest SPS/PPS plus the current GOP, bounded by bytes."""
+
+    def __init__(self, max_bytes=8 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.entries = []  # (sequence, timestamp, sensor_to_dequeue_us, packet bytes)
+        self.size = 0
+        self.valid = False  # entries start at an IDR and have no gaps
+        self.sps = None
+        self.pps = None
+        self.stats = {'gops': 0, 'overflows': 0, 'max_gop_bytes': 0, 'max_gop_frames': 0}
+
+    def add(self, data, sequence, timestamp, sensor_to_dequeue_us=0):
+        """Cache one encoder packet; returns True if it is an IDR."""
+        # Copied: the device buffer (or ring slot) is reused after this call
+        packet = bytes(memoryview(data).cast('B'))
+        units = scan_nal_units(packet)
+        is_idr = False
+        has_parameter_sets = False
+        for nal_type, start, end in units:
+            if nal_type == NAL_SPS:
+                self.sps = packet[start:end]
+                has_parameter_sets = True
+            elif nal_type == NAL_PPS:
+                self.pps = packet[start:end]
+            elif nal_type == NAL_IDR:
+                is_idr = True
+
+        if is_idr:
+            if not has_parameter_sets and self.sps and self.pps:
+                packet = self.sps + self.pps + packet
+            self.entries = [(sequence, timestamp, sensor_to_dequeue_us, packet)]
+            self.size = len(packet)
+            self.valid = self.size <= self.max_bytes
+            if self.valid:
+                self.stats['gops'] += 1
+            else:
+                self.stats['overflows'] += 1
+                self.invalidate()
+        elif self.valid:
+            if self.size + len(packet) > self.max_bytes:
+                self.stats['overflows'] += 1
+                self.invalidate()
+            else:
+                self.entries.append((sequence, timestamp, sensor_to_dequeue_us, packet))
+                self.size += len(packet)
+        if self.valid:
+            self.stats['max_gop_bytes'] = max(self.stats['max_gop_bytes'], self.size)
+            self.stats['max_gop_frames'] = max(self.stats['max_gop_frames'], len(self.entries))
+        return is_idr
+
+    def invalidate(self):
+        """Forget the current GOP (e.g. a packet was lost); caching resumes at the next IDR."""
+        self.entries = []
+        self.size = 0
+        self.valid = False
+
+    def burst(self):
+        """Packets a new client needs before live data, IDR first; [] if none is decodable yet."""
+        return list(self.entries) if self.valid else []
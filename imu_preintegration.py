@@ -0,0 +1,471 @@
+#!/usr/bin/env python3
+"""
+On-device IMU preintegration between stereo frames.
+
+Every SLAM client consuming the raw 200Hz IMU stream ends up integrating the
+same gyro/accel samples between camera frames. This module does that work once
+on the Pi: samples are buffered as they are drained from the DepthAI IMU
+queue, and each time a stereo frame timestamp is fully covered by IMU data the
+interval between the previous frame and this one is integrated into the
+standard preintegrated deltas (on-manifold formulation, Forster et al.):
+
+    dR  - relative rotation (body frame at start of interval)
+    dv  - velocity delta (gravity NOT removed, raw specific force)
+    dp  - position delta (gravity NOT removed)
+    cov - 9x9 covariance of [dtheta, dv, dp] from the sensor noise densities
+
+Samples are treated as zero-order hold: each sample is valid from its own
+timestamp until the next one, and the frame boundaries split samples where
+needed, so consecutive intervals tile time exactly.
+
+The per-sample work (exponential maps, rotation chaining, velocity/position
+sums, noise Jacobians) is vectorized over the whole interval. Rotation
+chaining uses a log-depth prefix product so it stays a handful of batched
+matmuls regardless of how many packets arrived in a batch.
+
+Run this file directly to validate the vectorized integrator against a
+sample-by-sample reference and a densely integrated synthetic trajectory, and
+the propagated covariance against a Monte-Carlo estimate.
+"""
+import time
+from collections import deque
+
+import numpy as np
+
+_I3 = np.eye(3)
+
+
+def skew(v):
+    """Batched skew-symmetric matrices: (N, 3) -> (N, 3, 3)."""
+    v = np.asarray(v, dtype=np.float64)
+    K = np.zeros(v.shape[:-1] + (3, 3))
+    K[..., 0, 1] = -v[..., 2]
+    K[..., 0, 2] = v[..., 1]
+    K[..., 1, 0] = v[..., 2]
+    K[..., 1, 2] = -v[..., 0]
+    K[..., 2, 0] = -v[..., 1]
+    K[..., 2, 1] = v[..., 0]
+    return K
+
+
+def so3_exp(phi):
+    """Batched SO(3) exponential map (Rodrigues): (N, 3) -> (N, 3, 3)."""
+    theta = np.linalg.norm(phi, axis=-1)
+    small = theta < 1e-8
+    safe = np.where(small, 1.0, theta)
+    # Taylor expansions near zero keep the coefficients finite
+    a = np.where(small, 1.0 - theta ** 2 / 6.0, np.sin(safe) / safe)
+    b = np.where(small, 0.5 - theta ** 2 / 24.0, (1.0 - np.cos(safe)) / safe ** 2)
+    K = skew(phi)
+    return _I3 + a[..., None, None] * K + b[..., None, None] * (K @ K)
+
+
+def so3_right_jacobian(phi):
+    """Batched SO(3) right Jacobian: (N, 3) -> (N, 3, 3)."""
+    theta = np.linalg.norm(phi, axis=-1)
+    small = theta < 1e-8
+    safe = np.where(small, 1.0, theta)
+    c = np.where(small, 0.5 - theta ** 2 / 24.0, (1.0 - np.cos(safe)) / safe ** 2)
+    d = np.where(small, 1.0 / 6.0 - theta ** 2 / 120.0, (safe - np.sin(safe)) / safe ** 3)
+    K = skew(phi)
+    return _I3 - c[..., None, None] * K + d[..., None, None] * (K @ K)
+
+
+def cumulative_matmul(mats):
+    """
+    Inclusive prefix product of a stack of matrices.
+
+    out[k] = mats[0] @ mats[1] @ ... @ mats[k], computed with a Hillis-Steele
+    scan so it needs ceil(log2(N)) batched matmuls instead of N small ones.
+    """
+    out = np.array(mats, dtype=np.float64, copy=True)
+    offset = 1
+    while offset < len(out):
+        out[offset:] = out[:-offset] @ out[offset:]
+        offset *= 2
+    return out
+
+
+def rotation_to_quaternion(R):
+    """Rotation matrix -> unit quaternion (x, y, z, w), same order as the IMUB packet."""
+    trace = R[0, 0] + R[1, 1] + R[2, 2]
+    if trace > 0.0:
+        s = 2.0 * np.sqrt(trace + 1.0)
+        w = 0.25 * s
+        x = (R[2, 1] - R[1, 2]) / s
+        y = (R[0, 2] - R[2, 0]) / s
+        z = (R[1, 0] - R[0, 1]) / s
+    elif R[0, 0] > R[1, 1] and R[0, 0] > R[2, 2]:
+        s = 2.0 * np.sqrt(1.0 + R[0, 0] - R[1, 1] - R[2, 2])
+        w = (R[2, 1] - R[1, 2]) / s
+        x = 0.25 * s
+        y = (R[0, 1] + R[1, 0]) / s
+        z = (R[0, 2] + R[2, 0]) / s
+    elif R[1, 1] > R[2, 2]:
+        s = 2.0 * np.sqrt(1.0 + R[1, 1] - R[0, 0] - R[2, 2])
+        w = (R[0, 2] - R[2, 0]) / s
+        x = (R[0, 1] + R[1, 0]) / s
+        y = 0.25 * s
+        z = (R[1, 2] + R[2, 1]) / s
+    else:
+        s = 2.0 * np.sqrt(1.0 + R[2, 2] - R[0, 0] - R[1, 1])
+        w = (R[1, 0] - R[0, 1]) / s
+        x = (R[0, 2] + R[2, 0]) / s
+        y = (R[1, 2] + R[2, 1]) / s
+        z = 0.25 * s
+    q = np.array([x, y, z, w])
+    if w < 0.0:
+        q = -q
+    return q / np.linalg.norm(q)
+
+
+def preintegrate(acc, gyro, dt, gyro_noise_density, accel_noise_density):
+    """
+    Vectorized preintegration of piecewise-constant IMU segments.
+
+    acc, gyro: (N, 3) bias-corrected measurements held over each segment
+    dt: (N,) segment durations in seconds (all > 0)
+
+    Returns (dR, dv, dp, cov) with cov ordered [dtheta, dv, dp].
+    """
+    n = len(dt)
+    dt_col = dt[:, None]
+
+    # Rotation: per-segment increments chained with a prefix product
+    phi = gyro * dt_col
+    dR_step = so3_exp(phi)
+    R_cum = cumulative_matmul(dR_step)  # R_cum[k] = dR from start to end of segment k
+    R_prev = np.concatenate([_I3[None], R_cum[:-1]])  # rotation at the start of segment k
+
+    # Velocity/position: rotated specific force summed along the interval
+    acc_rot = np.einsum('nij,nj->ni', R_prev, acc)
+    v_cum = np.cumsum(acc_rot * dt_col, axis=0)
+    v_prev = np.concatenate([np.zeros((1, 3)), v_cum[:-1]])
+    dp = np.sum(v_prev * dt_col + 0.5 * acc_rot * dt_col ** 2, axis=0)
+
+    # Noise propagation: build every transition/input Jacobian at once, then
+    # fold them (9x9, a few segments per frame interval)
+    dt3 = dt[:, None, None]
+    R_acc_skew = R_prev @ skew(acc)
+    A = np.zeros((n, 9, 9))
+    A[:, 0:3, 0:3] = np.transpose(dR_step, (0, 2, 1))
+    A[:, 3:6, 0:3] = -R_acc_skew * dt3
+    A[:, 3:6, 3:6] = _I3
+    A[:, 6:9, 0:3] = -0.5 * R_acc_skew * dt3 ** 2
+    A[:, 6:9, 3:6] = _I3 * dt3
+    A[:, 6:9, 6:9] = _I3
+
+    B_g = np.zeros((n, 9, 3))
+    B_g[:, 0:3, :] = so3_right_jacobian(phi) * dt3
+    B_a = np.zeros((n, 9, 3))
+    B_a[:, 3:6, :] = R_prev * dt3
+    B_a[:, 6:9, :] = 0.5 * R_prev * dt3 ** 2
+
+    # Continuous noise density -> discrete variance over each segment
+    q_g = (gyro_noise_density ** 2 / dt)[:, None, None]
+    q_a = (accel_noise_density ** 2 / dt)[:, None, None]
+    Q = q_g * (B_g @ np.transpose(B_g, (0, 2, 1))) + q_a * (B_a @ np.transpose(B_a, (0, 2, 1)))
+
+    cov = np.zeros((9, 9))
+    for k in range(n):
+        cov = A[k] @ cov @ A[k].T + Q[k]
+
+    return R_cum[-1], v_cum[-1], dp, cov
+
+
+class ImuPreintegrator:
+    """
+    Buffers IMU samples and stereo frame timestamps, and produces one
+    preintegration record per inter-frame interval once IMU data covers it.
+
+    Timestamps are DepthAI device time in seconds (same clock as stereo and IMU).
+    """
+
+    # Default noise densities (continuous-time), roughly BMI270/BNO085 class
+    DEFAULT_GYRO_NOISE_DENSITY = 1.7e-4   # rad/s/sqrt(Hz)
+    DEFAULT_ACCEL_NOISE_DENSITY = 2.0e-3  # m/s^2/sqrt(Hz)
+
+    def __init__(self, gyro_noise_density=DEFAULT_GYRO_NOISE_DENSITY,
+                 accel_noise_density=DEFAULT_ACCEL_NOISE_DENSITY,
+                 gyro_bias=(0.0, 0.0, 0.0), accel_bias=(0.0, 0.0, 0.0),
+                 max_buffer_seconds=2.0, max_pending_frames=8):
+        self.gyro_noise_density = gyro_noise_density
+        self.accel_noise_density = accel_noise_density
+        self.gyro_bias = np.asarray(gyro_bias, dtype=np.float64)
+        self.accel_bias = np.asarray(accel_bias, dtype=np.float64)
+        self.max_buffer_seconds = max_buffer_seconds
+
+        self._t = np.zeros(0)
+        self._acc = np.zeros((0, 3))
+        self._gyro = np.zeros((0, 3))
+
+        self._pending_frames = deque(maxlen=max_pending_frames)
+        self._last_frame_time = None
+        self.stats = {'records': 0, 'frames_dropped': 0, 'last_integration_us': 0}
+
+    def add_samples(self, timestamps, acc, gyro):
+        """Append samples given as arrays: timestamps (N,), acc (N, 3), gyro (N, 3)."""
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        if len(timestamps) == 0:
+            return
+        # Drop anything older than what we already hold (re-ordered or duplicate)
+        if len(self._t):
+            keep = timestamps > self._t[-1]
+            timestamps = timestamps[keep]
+            acc = np.asarray(acc, dtype=np.float64)[keep]
+            gyro = np.asarray(gyro, dtype=np.float64)[keep]
+        self._t = np.concatenate([self._t, timestamps])
+        self._acc = np.concatenate([self._acc, np.asarray(acc, dtype=np.float64).reshape(-1, 3)])
+        self._gyro = np.concatenate([self._gyro, np.asarray(gyro, dtype=np.float64).reshape(-1, 3)])
+
+        # Bound memory if frames stop arriving
+        if len(self._t) and self._t[-1] - self._t[0] > self.max_buffer_seconds:
+            start = np.searchsorted(self._t, self._t[-1] - self.max_buffer_seconds)
+            self._trim(start)
+
+    def add_packets(self, imu_packets):
+        """Append a batch of DepthAI IMUPacket objects (imuData.packets)."""
+        count = len(imu_packets)
+        if count == 0:
+            return
+        # Same timestamp source as send_imu_data (accelerometer device time)
+        timestamps = np.fromiter(
+            (p.acceleroMeter.timestamp.get().total_seconds() for p in imu_packets),
+            dtype=np.float64, count=count)
+        acc = np.array([(p.acceleroMeter.x, p.acceleroMeter.y, p.acceleroMeter.z) for p in imu_packets],
+                       dtype=np.float64)
+        gyro = np.array([(p.gyroscope.x, p.gyroscope.y, p.gyroscope.z) for p in imu_packets],
+                        dtype=np.float64)
+        self.add_samples(timestamps, acc, gyro)
+
+    def add_frame(self, timestamp):
+        """Register a stereo frame device timestamp (seconds)."""
+        if self._last_frame_time is None:
+            self._last_frame_time = timestamp
+            return
+        last = self._pending_frames[-1] if self._pending_frames else self._last_frame_time
+        if timestamp <= last:
+            return
+        if len(self._pending_frames) == self._pending_frames.maxlen:
+            # IMU stalled: the oldest interval merges into the next one
+            self._pending_frames.popleft()
+            self.stats['frames_dropped'] += 1
+        self._pending_frames.append(timestamp)
+
+    def pop_ready(self):
+        """Integrate and return records for every pending frame covered by IMU data."""
+        records = []
+        while self._pending_frames and len(self._t) and self._t[-1] >= self._pending_frames[0]:
+            t1 = self._pending_frames.popleft()
+            record = self._integrate_interval(self._last_frame_time, t1)
+            self._last_frame_time = t1
+            if record is not None:
+                records.append(record)
+        return records
+
+    def _integrate_interval(self, t0, t1):
+        start = time.perf_counter()
+        ts = self._t
+        if len(ts) == 0 or ts[0] > t1:
+            return None
+
+        # Breakpoints: interval ends plus every sample strictly inside it
+        inner = ts[(ts > t0) & (ts < t1)]
+        bounds = np.concatenate([[t0], inner, [t1]])
+        dt = np.diff(bounds)
+        # Zero-order hold: each segment uses the latest sample at or before its start
+        idx = np.clip(np.searchsorted(ts, bounds[:-1], side='right') - 1, 0, len(ts) - 1)
+        valid = dt > 0
+        idx = idx[valid]
+        dt = dt[valid]
+        if len(dt) == 0:
+            return None
+
+        dR, dv, dp, cov = preintegrate(self._acc[idx] - self.accel_bias,
+                                       self._gyro[idx] - self.gyro_bias,
+                                       dt, self.gyro_noise_density, self.accel_noise_density)
+
+        # Keep the last sample at or before t1: it holds into the next interval
+        self._trim(max(np.searchsorted(ts, t1, side='right') - 1, 0))
+
+        self.stats['records'] += 1
+        self.stats['last_integration_us'] = int((time.perf_counter() - start) * 1000000)
+        return {
+            't_start': t0,
+            't_end': t1,
+            'num_samples': len(inner) + 1,
+            'delta_R': dR,
+            'delta_v': dv,
+            'delta_p': dp,
+            'covariance': cov,
+        }
+
+    def _trim(self, start):
+        if start > 0:
+            self._t = self._t[start:]
+            self._acc = self._acc[start:]
+            self._gyro = self._gyro[start:]
+
+
+def reference_preintegrate(acc, gyro, dt):
+    """Sample-by-sample preintegration (no covariance), used for validation."""
+    R = np.eye(3)
+    v = np.zeros(3)
+    p = np.zeros(3)
+    for k in range(len(dt)):
+        a = R @ acc[k]
+        p = p + v * dt[k] + 0.5 * a * dt[k] ** 2
+        v = v + a * dt[k]
+        R = R @ so3_exp(gyro[k][None] * dt[k])[0]
+    return R, v, p
+
+
+def so3_log(R):
+    """Batched SO(3) logarithm: (N, 3, 3) -> (N, 3). Rotations are assumed well below pi."""
+    cos_theta = np.clip((np.trace(R, axis1=-2, axis2=-1) - 1.0) * 0.5, -1.0, 1.0)
+    theta = np.arccos(cos_theta)
+    small = theta < 1e-8
+    scale = np.where(small, 0.5 + theta ** 2 / 12.0, theta / (2.0 * np.sin(np.where(small, 1.0, theta))))
+    w = np.stack([R[..., 2, 1] - R[..., 1, 2], R[..., 0, 2] - R[..., 2, 0], R[..., 1, 0] - R[..., 0, 1]], axis=-1)
+    return scale[..., None] * w
+
+
+def monte_carlo_covariance(acc, gyro, dt, gyro_noise_density, accel_noise_density, trials=4000, rng=None):
+    """
+    Empirical covariance of [dtheta, dv, dp] for one interval.
+
+    Every trial adds discrete white noise (density^2 / dt per segment, the
+    same discretization preintegrate() assumes) to the measurements and
+    integrates sample by sample, all trials at once. dtheta is the right
+    perturbation Log(dR_nominal^T dR_noisy), matching the propagated covariance.
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    n = len(dt)
+    sigma_g = gyro_noise_density / np.sqrt(dt)
+    sigma_a = accel_noise_density / np.sqrt(dt)
+    noisy_gyro = gyro[None] + rng.standard_normal((trials, n, 3)) * sigma_g[None, :, None]
+    noisy_acc = acc[None] + rng.standard_normal((trials, n, 3)) * sigma_a[None, :, None]
+
+    R = np.broadcast_to(_I3, (trials, 3, 3)).copy()
+    v = np.zeros((trials, 3))
+    p = np.zeros((trials, 3))
+    for k in range(n):
+        a = np.einsum('mij,mj->mi', R, noisy_acc[:, k])
+        p = p + v * dt[k] + 0.5 * a * dt[k] ** 2
+        v = v + a * dt[k]
+        R = R @ so3_exp(noisy_gyro[:, k] * dt[k])
+
+    R_nom, v_nom, p_nom = reference_preintegrate(acc, gyro, dt)
+    err = np.concatenate([so3_log(np.transpose(R_nom) @ R), v - v_nom, p - p_nom], axis=1)
+    return np.cov(err, rowvar=False)
+
+
+def _synthetic_signals(t):
+    """Smooth synthetic body rates (rad/s) and specific force (m/s^2)."""
+    t = np.asarray(t, dtype=np.float64)
+    gyro = np.stack([0.9 * np.sin(1.3 * t), 0.6 * np.cos(0.7 * t), 1.2 * np.sin(0.4 * t + 0.3)], axis=-1)
+    acc = np.stack([1.5 * np.sin(t), 0.8 * np.cos(2.0 * t), 9.81 + 0.5 * np.sin(3.0 * t)], axis=-1)
+    return acc, gyro
+
+
+def validate(duration=10.0, imu_rate=200.0, frame_rate=30.0, dense_rate=20000.0, seed=0,
+             covariance_intervals=5, covariance_trials=4000):
+    """
+    Compare vectorized output with the reference loop and a dense ground truth,
+    and the propagated covariance of a few intervals with a Monte-Carlo estimate.
+    """
+    rng = np.random.default_rng(seed)
+
+    # IMU samples with a little timestamp jitter, frames on their own clock
+    imu_t = np.arange(0.0, duration, 1.0 / imu_rate)
+    imu_t[1:] += rng.uniform(-0.1, 0.1, len(imu_t) - 1) / imu_rate
+    imu_acc, imu_gyro = _synthetic_signals(imu_t)
+    frame_t = np.arange(0.01, duration - 0.05, 1.0 / frame_rate)
+
+    preint = ImuPreintegrator()
+    records = []
+    batch = 10  # mimic imuData.packets batches (setMaxBatchReports)
+    frame_idx = 0
+    for i in range(0, len(imu_t), batch):
+        while frame_idx < len(frame_t) and frame_t[frame_idx] <= imu_t[min(i + batch, len(imu_t)) - 1]:
+            preint.add_frame(frame_t[frame_idx])
+            frame_idx += 1
+        preint.add_samples(imu_t[i:i + batch], imu_acc[i:i + batch], imu_gyro[i:i + batch])
+        records.extend(preint.pop_ready())
+
+    ref_err = {'rot': 0.0, 'vel': 0.0, 'pos': 0.0}
+    truth_err = {'rot': 0.0, 'vel': 0.0, 'pos': 0.0}
+    for rec in records:
+        t0, t1 = rec['t_start'], rec['t_end']
+
+        # Reference: same zero-order-hold segments, integrated one by one
+        inner = imu_t[(imu_t > t0) & (imu_t < t1)]
+        bounds = np.concatenate([[t0], inner, [t1]])
+        idx = np.searchsorted(imu_t, bounds[:-1], side='right') - 1
+        R, v, p = reference_preintegrate(imu_acc[idx], imu_gyro[idx], np.diff(bounds))
+        ref_err['rot'] = max(ref_err['rot'], np.linalg.norm(R.T @ rec['delta_R'] - np.eye(3)))
+        ref_err['vel'] = max(ref_err['vel'], np.linalg.norm(v - rec['delta_v']))
+        ref_err['pos'] = max(ref_err['pos'], np.linalg.norm(p - rec['delta_p']))
+
+        # Ground truth: continuous signals integrated at dense_rate
+        dense_t = np.arange(t0, t1, 1.0 / dense_rate)
+        dense_dt = np.diff(np.append(dense_t, t1))
+        dense_acc, dense_gyro = _synthetic_signals(dense_t + 0.5 * dense_dt)
+        R, v, p = reference_preintegrate(dense_acc, dense_gyro, dense_dt)
+        truth_err['rot'] = max(truth_err['rot'], np.linalg.norm(R.T @ rec['delta_R'] - np.eye(3)))
+        truth_err['vel'] = max(truth_err['vel'], np.linalg.norm(v - rec['delta_v']))
+        truth_err['pos'] = max(truth_err['pos'], np.linalg.norm(p - rec['delta_p']))
+
+    # Covariance: propagated 9x9 vs Monte-Carlo over intervals spread across the run.
+    # With N trials the sample variances carry ~sqrt(2/N) relative noise (~2% at 4000).
+    cov_err = {'diag_rel': 0.0, 'frobenius_rel': 0.0}
+    for rec in records[::max(1, len(records) // covariance_intervals)][:covariance_intervals]:
+        t0, t1 = rec['t_start'], rec['t_end']
+        inner = imu_t[(imu_t > t0) & (imu_t < t1)]
+        bounds = np.concatenate([[t0], inner, [t1]])
+        idx = np.searchsorted(imu_t, bounds[:-1], side='right') - 1
+        empirical = monte_carlo_covariance(imu_acc[idx], imu_gyro[idx], np.diff(bounds),
+                                           preint.gyro_noise_density, preint.accel_noise_density,
+                                           trials=covariance_trials, rng=rng)
+        propagated = rec['covariance']
+        diag = np.diag(propagated)
+        cov_err['diag_rel'] = max(cov_err['diag_rel'], np.max(np.abs(np.diag(empirical) - diag) / diag))
+        cov_err['frobenius_rel'] = max(cov_err['frobenius_rel'],
+                                       np.linalg.norm(empirical - propagated) / np.linalg.norm(propagated))
+
+    # Timing of the vectorized path alone on a typical interval
+    seg = min(len(imu_t), int(imu_rate / frame_rate) + 2)
+    seg_dt = np.full(seg, 1.0 / imu_rate)
+    iterations = 2000
+    start = time.perf_counter()
+    for _ in range(iterations):
+        preintegrate(imu_acc[:seg], imu_gyro[:seg], seg_dt,
+                     ImuPreintegrator.DEFAULT_GYRO_NOISE_DENSITY, ImuPreintegrator.DEFAULT_ACCEL_NOISE_DENSITY)
+    per_interval_us = (time.perf_counter() - start) / iterations * 1000000
+
+    return {
+        'records': len(records),
+        'expected_records': len(frame_t) - 1,
+        'reference_error': ref_err,
+        'ground_truth_error': truth_err,
+        'covariance_error': cov_err,
+        'covariance_trials': covariance_trials,
+        'per_interval_us': per_interval_us,
+    }
+
+
+if __name__ == "__main__":
+    result = validate()
+    print(f"Records: {result['records']} (expected {result['expected_records']})")
+    print("Max error vs sample-by-sample reference: "
+          f"rot {result['reference_error']['rot']:.2e} | "
+          f"vel {result['reference_error']['vel']:.2e} m/s | "
+          f"pos {result['reference_error']['pos']:.2e} m")
+    print("Max error vs dense ground truth: "
+          f"rot {result['ground_truth_error']['rot']:.2e} | "
+          f"vel {result['ground_truth_error']['vel']:.2e} m/s | "
+          f"pos {result['ground_truth_error']['pos']:.2e} m")
+    print(f"Covariance vs Monte-Carlo ({result['covariance_trials']} trials): "
+          f"max diagonal error {result['covariance_error']['diag_rel'] * 100:.1f}% | "
+          f"Frobenius {result['covariance_error']['frobenius_rel'] * 100:.1f}%")
+    print(f"Vectorized preintegration: {result['per_interval_us']:.1f} us per frame interval")
@@ -0,0 +1,478 @@
+#!/usr/bin/env python3
+"""
+Multi-process mode for QuadOakStreamerWithIMU.
+
+In the default mode one Python process does everything: draining the DepthAI
+queues, building payloads, zlib and every sendall, so the GIL keeps the
+streamer on a single core. With --multiprocess the work is split:
+
+    capture process   runs the DepthAI pipeline, drains every queue and
+                      writes frames into one shared-memory ring per stream
+                      (plus IMU, RGB UDP timestamps and clock sync, which
+                      are light and stay here)
+    sender processes  one per sender group (default: rgb, stereo, depth),
+                      each owning the TCP servers of its streams, copying
+                      each frame out of its ring slot once and doing the
+                      payload work (depth compression) and sendall from
+                      that copy
+
+Each process can be pinned to its own cores with --cpu-affinity.
+
+Profile commands arriving on the capture process's profile port are relayed
+to every sender over a control pipe (SenderControl), so stage timers and
+captures cover the senders' zlib and sendall work too.
+
+Run this file directly to compare the per-stream fps the real streamer
+sustains (simulated device) in single-process and multi-process mode.
+"""
+import argparse
+import multiprocessing
+import os
+import threading
+import time
+
+import numpy as np
+
+from shm_ring import SharedFrameRing, RingReader, local_ring_name
+
+STREAM_NAMES = ('RGB', 'Left', 'Right', 'Depth')
+
+DEFAULT_SENDER_GROUPS = {
+    'rgb': ['RGB'],
+    'stereo': ['Left', 'Right'],
+    'depth': ['Depth'],
+}
+
+RING_SLOTS = 8
+RGB_SLOT_CAPACITY = 2 * 1024 * 1024  # H.264 packets, IDR frames included
+
+
+def parse_assignments(entries):
+    """['rgb=RGB', 'stereo=Left,Right'] -> {'rgb': ['RGB'], 'stereo': ['Left', 'Right']}"""
+    result = {}
+    for entry in entries or []:
+        name, sep, values = entry.partition('=')
+        if not sep or not values:
+            raise ValueError(f"Expected name=value[,value...], got '{entry}'")
+        result[name.strip()] = [v.strip() for v in values.split(',') if v.strip()]
+    return result
+
+
+def parse_sender_groups(entries):
+    groups = parse_assignments(entries) if entries else dict(DEFAULT_SENDER_GROUPS)
+    seen = [name for streams in groups.values() for name in streams]
+    unknown = set(seen) - set(STREAM_NAMES)
+    if unknown:
+        raise ValueError(f"Unknown streams in sender groups: {', '.join(sorted(unknown))}")
+    if len(seen) != len(set(seen)):
+        raise ValueError("A stream can only belong to one sender group")
+    missing = set(STREAM_NAMES) - set(seen)
+    if missing:
+        raise ValueError(f"Streams without a sender group: {', '.join(sorted(missing))}")
+    return groups
+
+
+def parse_cpu_affinity(entries):
+    """['capture=0', 'depth=2,3'] -> {'capture': [0], 'depth': [2, 3]}"""
+    return {name: [int(cpu) for cpu in cpus] for name, cpus in parse_assignments(entries).items()}
+
+
+def pin_to_cpus(name, cpus):
+    if not cpus:
+        return
+    if not hasattr(os, 'sched_setaffinity'):
+        print(f"[{name}] CPU affinity not supported on this platform")
+        return
+    try:
+        os.sched_setaffinity(0, cpus)
+        print(f"[{name}] pinned to CPUs {sorted(cpus)}")
+    except OSError as e:
+        print(f"[{name}] could not pin to CPUs {cpus}: {e}")
+
+
+class StreamRings:
+    """
+    Capture-side shared-memory rings, one per stream, under the well-known
+    local_ring_name()s of rgb_port. A tag makes the names private to one
+    streamer instead (rings only its own senders attach to).
+    """
+
+    def __init__(self, rgb_port, mono_width, mono_height, depth_width, depth_height, slot_count=RING_SLOTS,
+                 replace=False, tag=None):
+        capacities = {
+            'RGB': RGB_SLOT_CAPACITY,
+            'Left': mono_width * mono_height,
+            'Right': mono_width * mono_height,
+            'Depth': depth_width * depth_height * 2,
+        }
+        self.rings = {}
+        try:
+            for name, capacity in capacities.items():
+                ring_name = local_ring_name(rgb_port, name) + (f"_{tag}" if tag else "")
+                self.rings[name] = SharedFrameRing.create(ring_name, slot_count, capacity, replace)
+        except Exception:
+            self.close()
+            raise
+        self.names = {name: ring.name for name, ring in self.rings.items()}
+        self.stats = {name: 0 for name in self.rings}
+
+    def write_packet(self, stream, data, timestamp, sequence):
+        self.rings[stream].write(data, timestamp, sequence=sequence)
+        self.stats[stream] += 1
+
+    def has_readers(self, stream):
+        """Whether a same-host reader is attached to the stream's ring (see RingReader heartbeat)."""
+        return self.rings[stream].has_readers()
+
+    def write_frame(self, stream, frame, timestamp):
+        frame = np.ascontiguousarray(frame)
+        height, width = frame.shape
+        self.rings[stream].write(frame, timestamp, width=width, height=height, itemsize=frame.dtype.itemsize)
+        self.stats[stream] += 1
+
+    def close(self):
+        for ring in self.rings.values():
+            try:
+                ring.close()
+            except Exception as e:
+                print(f"Error closing ring {ring.name}: {e}")
+        self.rings = {}
+
+
+class SenderControl:
+    """
+    Capture-side ends of the sender control pipes.
+
+    Requests are (id, command) and replies (id, response); a sender that
+    misses the timeout (e.g. stuck in a sendall) answers late, and that stale
+    reply is discarded on the next request instead of being mistaken for it.
+    """
+
+    def __init__(self):
+        self.pipes = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def connect(self, group_name, context):
+        """Create the pipe for a sender group; returns the sender's end."""
+        parent, child = context.Pipe()
+        self.pipes[group_name] = parent
+        return child
+
+    def request(self, commands, timeout=2.0):
+        """Send {group: command} and return {group: response or None if it did not answer}."""
+        with self._lock:
+            self._next_id += 1
+            request_id = self._next_id
+            for group_name, command in commands.items():
+                try:
+                    self.pipes[group_name].send((request_id, command))
+                except (OSError, KeyError):
+                    pass
+            deadline = time.monotonic() + timeout
+            responses = {}
+            for group_name in commands:
+                responses[group_name] = None
+                pipe = self.pipes.get(group_name)
+                try:
+                    while pipe is not None and pipe.poll(max(0.0, deadline - time.monotonic())):
+                        reply_id, response = pipe.recv()
+                        if reply_id == request_id:
+                            responses[group_name] = response
+                            break
+                except (OSError, EOFError):
+                    pass
+            return responses
+
+    def broadcast(self, command, timeout=2.0):
+        return self.request({group_name: command for group_name in self.pipes}, timeout)
+
+    def close(self):
+        for pipe in self.pipes.values():
+            pipe.close()
+        self.pipes = {}
+
+
+def handle_sender_command(streamer, command):
+    """Sender side of a relayed profile command (same actions as the profile port)."""
+    if command.get('action') == 'capture' and command.get('path'):
+        # The capture process picks the part file it will merge afterwards
+        path = streamer.capture_profiler.start(command.get('seconds', 10), command.get('format', 'collapsed'),
+                                               command['path'])
+        return {"success": True, "message": f"Profile capture started, writing {path}"}
+    return streamer.handle_profile_command(command)
+
+
+def start_sender_processes(groups, ring_names, streamer_kwargs, use_rgb_timestamp_protocol, cpu_affinity, stop_event,
+                           client_counts=None, rgb_ts_registrations=None, control=None, rgb_ts_socket=None,
+                           gop_idle_timeout=2.0):
+    """
+    Start one sender process per group; returns the Process objects.
+
+    client_counts, if given, is a shared array indexed like STREAM_NAMES that
+    senders keep updated with their number of connected clients.
+    rgb_ts_registrations, if given, is the shared [IPv4, port, time, first live seq] * N array
+    of RGB timestamp registrations, so the RGB sender can resend the
+    timestamps of a GOP burst to the joining client.
+    control, if given, is a SenderControl that gets one pipe per group for
+    relaying profile commands.
+    rgb_ts_socket, if given, is the capture process's bound RGB timestamp
+    socket; the forked RGB sender sends burst timestamps through it, so they
+    come from the same port as the live ones.
+    gop_idle_timeout is how long the RGB ring may stay idle (camera stopped
+    by demand) before the sender drops its cached GOP.
+    """
+    # fork: children inherit the already-imported modules instead of
+    # re-importing depthai, and start before the capture side spawns threads
+    context = multiprocessing.get_context('fork')
+    processes = []
+    for group_name, streams in groups.items():
+        control_pipe = control.connect(group_name, context) if control is not None else None
+        process = context.Process(
+            target=run_sender_group,
+            args=(group_name, streams, {name: ring_names[name] for name in streams}, streamer_kwargs,
+                  use_rgb_timestamp_protocol, cpu_affinity.get(group_name), stop_event, client_counts,
+                  rgb_ts_registrations, control_pipe, rgb_ts_socket, gop_idle_timeout),
+            name=f"sender-{group_name}",
+            daemon=True,
+        )
+        process.start()
+        processes.append(process)
+    return processes
+
+
+def run_sender_group(group_name, streams, ring_names, streamer_kwargs, use_rgb_timestamp_protocol, cpus,
+                     stop_event, client_counts=None, rgb_ts_registrations=None, control_pipe=None,
+                     rgb_ts_socket=None, gop_idle_timeout=2.0, stats_interval=2.0):
+    """Sender process main: serve the TCP clients of `streams` from their rings."""
+    from quad_streamer_with_imu import QuadOakStreamerWithIMU
+
+    pin_to_cpus(group_name, cpus)
+    streamer = QuadOakStreamerWithIMU(**streamer_kwargs)
+    streamer.use_rgb_timestamp_protocol = use_rgb_timestamp_protocol
+    streamer.running = True
+    streamer.capture_profiler.stack_prefix = f"sender-{group_name}"
+    if 'RGB' in streams and rgb_ts_registrations is not None:
+        # GOP bursts resend their UDP timestamps from here through the inherited socket (send
+        # only: the capture process receives on it and sends the live timestamps)
+        streamer.rgb_ts_socket = rgb_ts_socket
+        streamer.rgb_ts_shared_registrations = rgb_ts_registrations
+
+    endpoints = {
+        'RGB': (streamer.start_rgb_server, streamer.rgb_clients, streamer.rgb_stats),
+        'Left': (streamer.start_left_server, streamer.left_clients, streamer.left_stats),
+        'Right': (streamer.start_right_server, streamer.right_clients, streamer.right_stats),
+        'Depth': (streamer.start_depth_server, streamer.depth_clients, streamer.depth_stats),
+    }
+    rings = {}
+    readers = {}
+    buffers = {}
+    try:
+        for name in streams:
+            # Forked from the capture process: shares its resource tracker
+            rings[name] = SharedFrameRing.attach(ring_names[name], untrack=False)
+            readers[name] = RingReader(rings[name])
+            # A client that stalls in sendall can outlast a lap of the ring, so
+            # frames are sent from a private, seqlock-validated copy of the slot
+            buffers[name] = bytearray(rings[name].slot_capacity)
+            endpoints[name][0]()
+
+        frame_counts = {name: 0 for name in streams}
+        rgb_lost = 0
+        rgb_last_packet = time.monotonic()
+        last_stats_time = time.time()
+        while not stop_event.is_set():
+            # Profile commands relayed by the capture process; pstats captures run in this thread
+            if control_pipe is not None and control_pipe.poll():
+                request_id, command = control_pipe.recv()
+                try:
+                    response = handle_sender_command(streamer, command)
+                except Exception as e:
+                    response = {"success": False, "message": f"Error: {str(e)}"}
+                control_pipe.send((request_id, response))
+            streamer.capture_profiler.poll()
+
+            idle = True
+            for name, reader in readers.items():
+                _, clients, stats = endpoints[name]
+                if client_counts is not None:
+                    client_counts[STREAM_NAMES.index(name)] = streamer.client_count(name)
+                # The RGB GOP cache follows the stream even without clients
+                if not clients and not (name == 'RGB' and streamer.gop_cache):
+                    # Nobody listening: stay at the head of the ring
+                    reader.next_seq = reader.ring.write_seq
+                    continue
+                frame = reader.poll_copy(buffers[name])
+                if frame is None:
+                    continue
+                idle = False
+                if name == 'RGB':
+                    rgb_last_packet = time.monotonic()
+                    lost = reader.stats['dropped'] + reader.stats['torn']
+                    if streamer.gop_cache and lost != rgb_lost:
+                        # A lost packet leaves a hole in the GOP; wait for the next IDR
+                        streamer.gop_cache.invalidate()
+                        rgb_lost = lost
+                    # Capture process sent the UDP timestamp with this same sequence
+                    streamer.send_rgb_packet(frame.getData(), frame.sequence, frame.timestamp, send_timestamp=False)
+                elif name == 'Depth':
+                    streamer.broadcast_depth_frame(frame, clients, stats)
+                else:
+                    streamer.broadcast_stereo_frame(frame, clients, name, stats)
+                frame_counts[name] += 1
+                del frame
+
+            # RGB stopped (demand): a client joining later must not get the GOP from before the pause
+            if streamer.gop_cache and streamer.gop_cache.valid and \
+                    time.monotonic() - rgb_last_packet > gop_idle_timeout:
+                streamer.gop_cache.invalidate()
+
+            current_time = time.time()
+            if current_time - last_stats_time >= stats_interval:
+                elapsed = current_time - last_stats_time
+                print(f"[{group_name}] " + " | ".join(
+                    f"{name}: {frame_counts[name] / elapsed:.1f} fps ({len(endpoints[name][1])} clients, "
+                    f"dropped {readers[name].stats['dropped']}, torn {readers[name].stats['torn']})"
+                    for name in streams))
+                frame_counts = {name: 0 for name in streams}
+                last_stats_time = current_time
+
+            if idle:
+                time.sleep(0.001)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        readers.clear()
+        streamer.shutdown()
+        for ring in rings.values():
+            try:
+                ring.close()
+            except Exception:
+                pass
+
+
+def stop_sender_processes(processes, stop_event, timeout=3.0):
+    stop_event.set()
+    deadline = time.time() + timeout
+    for process in processes:
+        process.join(max(0.0, deadline - time.time()))
+        if process.is_alive():
+            process.terminate()
+            process.join(1.0)
+
+
+# Sender group layouts by process count, for the scaling benchmark
+SCALING_LAYOUTS = {
+    1: {'all': ['RGB', 'Left', 'Right', 'Depth']},
+    2: {'rgb': ['RGB'], 'frames': ['Left', 'Right', 'Depth']},
+    3: DEFAULT_SENDER_GROUPS,
+    4: {'rgb': ['RGB'], 'left': ['Left'], 'right': ['Right'], 'depth': ['Depth']},
+}
+
+
+def benchmark(fps=90, duration=5.0, modes=('single', 1, 2, 3, 4), base_port=15100, warmup=2.0):
+    """
+    Per-stream and aggregate throughput of the real streamer, single-process
+    vs --multiprocess with 1..4 sender processes (SCALING_LAYOUTS).
+
+    Each mode ('single', or a sender process count) starts
+    quad_streamer_with_imu.py --simulate at `fps` (above what the Pi
+    sustains, so the streamer is the bottleneck) with one client on every
+    TCP stream. Clients only receive ([4B size][payload] framing for all
+    four streams), so they cost little next to the streamer. Frames the
+    streamer cannot keep up with are dropped by the non-blocking simulated
+    queues, so the delivered fps per stream is what each mode sustains.
+    """
+    import subprocess
+    import sys
+    from oak_receiver import LengthPrefixedReceiver
+
+    streamer_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'quad_streamer_with_imu.py')
+    port_args = ['--rgb-port', base_port, '--left-port', base_port + 1, '--right-port', base_port + 2,
+                 '--depth-port', base_port + 3, '--imu-port', base_port + 4, '--rgb-timestamp-port', base_port + 5,
+                 '--profile-port', base_port + 6]
+    ports = {'RGB': base_port, 'Left': base_port + 1, 'Right': base_port + 2, 'Depth': base_port + 3}
+
+    results = []
+    for mode in modes:
+        command = [sys.executable, streamer_path, '--simulate', '--fps', str(fps)] + [str(a) for a in port_args]
+        if mode != 'single':
+            command += ['--multiprocess', '--sender-groups'] + [
+                f"{group}={','.join(streams)}" for group, streams in SCALING_LAYOUTS[mode].items()]
+        streamer = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        received = {name: 0 for name in STREAM_NAMES}
+        done = threading.Event()
+
+        def sink(name):
+            receiver = LengthPrefixedReceiver('127.0.0.1', ports[name])
+            for _ in range(200):
+                try:
+                    receiver.connect()
+                    break
+                except OSError:
+                    time.sleep(0.05)
+            else:
+                return
+            try:
+                while not done.is_set():
+                    receiver.read()
+                    received[name] += 1
+            except (ConnectionError, OSError):
+                pass
+            finally:
+                receiver.close()
+
+        sinks = [threading.Thread(target=sink, args=(name,), daemon=True) for name in STREAM_NAMES]
+        for thread in sinks:
+            thread.start()
+        time.sleep(warmup)  # servers up, clients connected, pipeline at steady state
+
+        baseline = dict(received)
+        start = time.perf_counter()
+        time.sleep(duration)
+        elapsed = time.perf_counter() - start
+        counts = {name: received[name] - baseline[name] for name in STREAM_NAMES}
+        alive = streamer.poll() is None
+
+        done.set()
+        streamer.terminate()
+        try:
+            streamer.wait(10.0)
+        except subprocess.TimeoutExpired:
+            streamer.kill()
+            streamer.wait()
+        for thread in sinks:
+            thread.join(1.0)
+
+        if not alive:
+            print(f"Streamer exited early in {mode} mode (code {streamer.returncode})")
+        results.append({
+            'mode': mode,
+            'label': 'single' if mode == 'single' else f"{mode} sender{'s' if mode > 1 else ''}",
+            'fps': {name: counts[name] / elapsed for name in STREAM_NAMES},
+            'total_fps': sum(counts.values()) / elapsed,
+        })
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Multi-process streamer benchmark')
+    parser.add_argument('--fps', type=int, default=90,
+                        help='Simulated capture rate, set above what the streamer sustains (default: 90)')
+    parser.add_argument('--duration', type=float, default=5.0, help='Seconds per mode (default: 5)')
+    parser.add_argument('--base-port', type=int, default=15100, help='First of 7 ports to use (default: 15100)')
+    parser.add_argument('--processes', type=int, nargs='+', default=sorted(SCALING_LAYOUTS),
+                        choices=sorted(SCALING_LAYOUTS), help='Sender process counts to run (default: 1 2 3 4)')
+    args = parser.parse_args()
+
+    print(f"Simulated capture at {args.fps} fps, {os.cpu_count()} CPU(s), one client per stream")
+    for count in args.processes:
+        print(f"  {count} sender{'s' if count > 1 else ''}: " +
+              " ".join(f"{group}={','.join(streams)}" for group, streams in SCALING_LAYOUTS[count].items()))
+    results = benchmark(fps=args.fps, duration=args.duration, modes=['single'] + args.processes,
+                        base_port=args.base_port)
+    base = results[0]['total_fps'] or 1.0
+    for r in results:
+        print(f"{r['label']:>12}: " + " | ".join(f"{name} {r['fps'][name]:5.1f} fps" for name in STREAM_NAMES) +
+              f" | total {r['total_fps']:6.1f} fps (x{r['total_fps'] / base:.2f})")
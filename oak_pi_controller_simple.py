@@ -8,107 +8,297 @@ import time
 import socket
 import json
 import threading
+import argparse
+
+# Each device gets a block of ports: 5000-5006 for the first, 5010-5016 for the second, ...
+BASE_PORT = 5000
+PORT_BLOCK_SIZE = 10
+PORT_OFFSETS = {
+    'rgb_port': 0,
+    'left_port': 1,
+    'right_port': 2,
+    'depth_port': 3,
+    'imu_port': 4,
+    'rgb_timestamp_port': 5,
+    'profile_port': 6,
+}
 
 class SimpleOakController:
-    def __init__(self):
-        self.streamer_process = None
+    def __init__(self, simulated_devices=0):
+        # One streamer per device, keyed by MxID (None = whichever device DepthAI opens first)
+        self.streamers = {}
+        self.port_blocks = {}  # device_id -> port block index, kept across restarts
+        self.streamers_lock = threading.RLock()
         self.streamer_script = '/home/ivyspec/ivy_streamer/quad_streamer_with_imu.py'
         self.venv_activate = '/home/ivyspec/ivy_streamer/venv/bin/activate'
         self.log_file = '/tmp/streamer.log'
         self.control_port = 9999
+        self.simulated_devices = simulated_devices  # >0: streamers run with --simulate
         self.running = True
 
         self.start_server()
 
-    def is_streamer_running(self):
-        if self.streamer_process is None:
+    @staticmethod
+    def device_key(device_id):
+        return device_id if device_id else 'default'
+
+    def log_file_for(self, device_id):
+        if device_id is None:
+            return self.log_file
+        return f'/tmp/streamer_{device_id}.log'
+
+    def allocate_ports(self, device_id):
+        """Port block for a device; the same device keeps its block across restarts."""
+        with self.streamers_lock:
+            if device_id not in self.port_blocks:
+                used = set(self.port_blocks.values())
+                block = 0
+                while block in used:
+                    block += 1
+                self.port_blocks[device_id] = block
+            base = BASE_PORT + self.port_blocks[device_id] * PORT_BLOCK_SIZE
+            return {name: base + offset for name, offset in PORT_OFFSETS.items()}
+
+    def is_streamer_running(self, device_id=None):
+        entry = self.streamers.get(device_id)
+        if entry is None:
             return False
 
-        if self.streamer_process.poll() is not None:
-            self.streamer_process = None
+        process = entry['process']
+        if process.poll() is not None:
+            self.streamers.pop(device_id, None)
             return False
 
         try:
-            process = psutil.Process(self.streamer_process.pid)
-            return process.is_running() and process.status() != psutil.STATUS_ZOMBIE
+            ps_process = psutil.Process(process.pid)
+            return ps_process.is_running() and ps_process.status() != psutil.STATUS_ZOMBIE
         except (psutil.NoSuchProcess, psutil.AccessDenied):
-            self.streamer_process = None
+            self.streamers.pop(device_id, None)
             return False
 
-    def start_streamer(self, use_rgb_timestamp_protocol=False, config=None):
-        if self.is_streamer_running():
-            return {"success": False, "message": f"Streamer already running (PID: {self.streamer_process.pid})"}
-
-        if not os.path.exists(self.streamer_script):
-            return {"success": False, "message": f"Streamer script not found: {self.streamer_script}"}
-
-        # Kill any orphaned streamer processes that we lost track of
+    def device_owner(self, resolved_id):
+        """Name ('default' or MxID) of the running streamer that has opened device resolved_id, or None."""
+        for device_id, entry in list(self.streamers.items()):
+            if entry.get('resolved_device_id') == resolved_id and self.is_streamer_running(device_id):
+                return self.device_key(device_id)
+        return None
+
+    def resolve_default_device(self):
+        """
+        MxID the default streamer should open: the first enumerated device no
+        streamer of ours holds. Returns (device_id, None) or (None, error message).
+        """
+        listing = self.list_devices()
+        if not listing['success']:
+            return None, listing['message']
+        for device in listing['devices']:
+            if device['state'] != 'IN_USE' and self.device_owner(device['device_id']) is None:
+                return device['device_id'], None
+        return None, "No free device for the default streamer"
+
+    def tracked_pids(self):
+        """PIDs of every streamer we started, including the python process under the bash wrapper."""
+        pids = set()
+        for entry in list(self.streamers.values()):
+            pids.add(entry['process'].pid)
+            try:
+                pids.update(child.pid for child in psutil.Process(entry['process'].pid).children(recursive=True))
+            except psutil.NoSuchProcess:
+                pass
+        return pids
+
+    def kill_orphaned_streamers(self, device_id, ports):
+        """
+        Kill streamer processes we lost track of that would clash with this
+        device: same --device-id, or bound to one of its ports. Streamers for
+        other devices are left alone.
+        """
+        script_name = os.path.basename(self.streamer_script)
+        ours = self.tracked_pids() | {os.getpid()} | {p.pid for p in psutil.Process().parents()}
+        orphans = []
+        for process in psutil.process_iter(['pid', 'cmdline']):
+            if process.info['pid'] in ours:
+                continue
+            # Covers both the bash wrapper (script and options after the wrapper string) and python itself
+            tokens = ' '.join(process.info['cmdline'] or []).split()
+            if not any(os.path.basename(token) == script_name for token in tokens):
+                continue
+            args = {tokens[i]: tokens[i + 1] for i in range(len(tokens) - 1) if tokens[i].startswith('--')}
+            if '--list-devices' in tokens:
+                continue
+            same_device = args.get('--device-id') == device_id
+            same_ports = args.get('--rgb-port', str(BASE_PORT)) == str(ports['rgb_port'])
+            if same_device or same_ports:
+                orphans.append(process)
+
+        for process in orphans:
+            try:
+                process.terminate()
+            except psutil.NoSuchProcess:
+                pass
+        if orphans:
+            gone, alive = psutil.wait_procs(orphans, timeout=3)
+            for process in alive:
+                try:
+                    process.kill()
+                except psutil.NoSuchProcess:
+                    pass
+            print(f"Killed {len(orphans)} orphaned streamer process(es) for {self.device_key(device_id)}")
+
+    def streamer_command(self, args, log_file=None):
+        """
+        argv running the streamer script with args inside the venv. bash only
+        sources the venv (and redirects to log_file); args reach python as
+        separate arguments and are never parsed by the shell.
+        """
+        wrapper = 'source "$1" && log="$2" && shift 2 && '
+        wrapper += 'python3 "$@" > "$log" 2>&1' if log_file else 'python3 "$@"'
+        return (['/bin/bash', '-c', wrapper, 'streamer', self.venv_activate, log_file or '', self.streamer_script]
+                + [str(arg) for arg in args])
+
+    def list_devices(self):
+        """Enumerate devices by MxID (via the streamer, which owns the DepthAI install)."""
+        args = ['--list-devices']
+        if self.simulated_devices:
+            args += ['--simulate-devices', self.simulated_devices]
         try:
-            subprocess.run(['pkill', '-f', 'quad_streamer_with_imu.py'], timeout=2)
-            time.sleep(1)  # Give it time to die
-        except:
-            pass
+            result = subprocess.run(self.streamer_command(args), capture_output=True, text=True,
+                                    timeout=15, cwd=os.path.dirname(self.streamer_script))
+            lines = result.stdout.strip().splitlines()
+            devices = json.loads(lines[-1]) if lines else []
+        except Exception as e:
+            return {"success": False, "message": f"Device enumeration failed: {str(e)}", "devices": []}
+
+        # Devices held by our own streamers are no longer listed as available
+        listed = {device['device_id'] for device in devices}
+        for entry in list(self.streamers.values()):
+            resolved_id = entry.get('resolved_device_id')
+            if resolved_id and resolved_id not in listed:
+                devices.append({'device_id': resolved_id, 'name': '', 'state': 'IN_USE'})
+                listed.add(resolved_id)
+        for device in devices:
+            owner = self.device_owner(device['device_id'])
+            device['running'] = owner is not None
+            if owner is not None:
+                device['streamer'] = owner
+            if device['device_id'] in self.port_blocks:
+                device['ports'] = self.allocate_ports(device['device_id'])
+        return {"success": True, "message": f"{len(devices)} device(s)", "devices": devices}
+
+    def start_streamer(self, use_rgb_timestamp_protocol=False, config=None, device_id=None):
+        name = self.device_key(device_id)
+        with self.streamers_lock:
+            if self.is_streamer_running(device_id):
+                return {"success": False,
+                        "message": f"Streamer for {name} already running (PID: {self.streamers[device_id]['process'].pid})"}
+
+            if not os.path.exists(self.streamer_script):
+                return {"success": False, "message": f"Streamer script not found: {self.streamer_script}"}
+
+            if device_id is not None:
+                listing = self.list_devices()
+                if not listing['success']:
+                    return {"success": False, "message": f"Cannot check device {device_id}: {listing['message']}"}
+                if device_id not in {device['device_id'] for device in listing['devices']}:
+                    return {"success": False, "message": f"Unknown device: {device_id}"}
+
+            # The default streamer is pinned to a concrete MxID too, so it and an
+            # explicit streamer can never open the same camera
+            resolved_id = device_id
+            if resolved_id is None:
+                resolved_id, error = self.resolve_default_device()
+                if resolved_id is None:
+                    return {"success": False, "message": f"Cannot start default streamer: {error}"}
+            owner = self.device_owner(resolved_id)
+            if owner is not None:
+                return {"success": False,
+                        "message": f"Device {resolved_id} is already used by the {owner} streamer"}
+
+            # Explicit ports in the config override the device's port block
+            config = dict(config or {})
+            ports = self.allocate_ports(device_id)
+            ports.update({key: config[key] for key in PORT_OFFSETS if key in config})
+
+            # Kill any orphaned streamer processes for this device that we lost track of
+            try:
+                self.kill_orphaned_streamers(resolved_id, ports)
+            except Exception as e:
+                print(f"Orphan cleanup failed: {e}")
 
-        try:
-            if os.path.exists(self.log_file):
-                os.remove(self.log_file)
-
-            cmd = f'source {self.venv_activate} && python3 {self.streamer_script}'
-            if use_rgb_timestamp_protocol:
-                cmd += ' --use-rgb-timestamp-protocol'
-
-            # Add config parameters if provided
-            if config:
-                if 'rgb_port' in config:
-                    cmd += f' --rgb-port {config["rgb_port"]}'
-                if 'left_port' in config:
-                    cmd += f' --left-port {config["left_port"]}'
-                if 'right_port' in config:
-                    cmd += f' --right-port {config["right_port"]}'
-                if 'depth_port' in config:
-                    cmd += f' --depth-port {config["depth_port"]}'
-                if 'imu_port' in config:
-                    cmd += f' --imu-port {config["imu_port"]}'
-                if 'rgb_timestamp_port' in config:
-                    cmd += f' --rgb-timestamp-port {config["rgb_timestamp_port"]}'
+            log_file = self.log_file_for(device_id)
+            try:
+                if os.path.exists(log_file):
+                    os.remove(log_file)
+
+                # Values from the control request go in as separate arguments, never through the shell
+                args = ['--device-id', resolved_id]
+                if self.simulated_devices:
+                    args.append('--simulate')
+                if use_rgb_timestamp_protocol:
+                    args.append('--use-rgb-timestamp-protocol')
+
+                args += ['--rgb-port', ports["rgb_port"]]
+                args += ['--left-port', ports["left_port"]]
+                args += ['--right-port', ports["right_port"]]
+                args += ['--depth-port', ports["depth_port"]]
+                args += ['--imu-port', ports["imu_port"]]
+                args += ['--rgb-timestamp-port', ports["rgb_timestamp_port"]]
+                args += ['--profile-port', ports["profile_port"]]
+
+                # Add config parameters if provided
                 if 'fps' in config:
-                    cmd += f' --fps {config["fps"]}'
+                    args += ['--fps', config["fps"]]
                 if 'rgb_width' in config and 'rgb_height' in config:
-                    cmd += f' --rgb-resolution {config["rgb_width"]}x{config["rgb_height"]}'
+                    args += ['--rgb-resolution', f'{config["rgb_width"]}x{config["rgb_height"]}']
                 if 'mono_width' in config and 'mono_height' in config:
-                    cmd += f' --mono-resolution {config["mono_width"]}x{config["mono_height"]}'
-
-            cmd += f' > {self.log_file} 2>&1'
-
-            self.streamer_process = subprocess.Popen(
-                cmd,
-                shell=True,
-                executable='/bin/bash',
-                cwd=os.path.dirname(self.streamer_script),
-                preexec_fn=os.setsid
-            )
-
-            time.sleep(2)
-
-            if self.is_streamer_running():
-                return {"success": True, "message": f"Streamer started (PID: {self.streamer_process.pid})"}
-            else:
-                return {"success": False, "message": "Streamer failed to start - check log file"}
+                    args += ['--mono-resolution', f'{config["mono_width"]}x{config["mono_height"]}']
+                if config.get('imu_preintegration'):
+                    args.append('--imu-preintegration')
+                if config.get('multiprocess'):
+                    args.append('--multiprocess')
+                if config.get('local_shm'):
+                    args.append('--local-shm')
+                if 'gop_cache_mb' in config:
+                    args += ['--gop-cache-mb', config["gop_cache_mb"]]
+                if config.get('on_demand'):
+                    args.append('--on-demand')
+                if 'demand_linger' in config:
+                    args += ['--demand-linger', config["demand_linger"]]
+                if config.get('cpu_affinity'):
+                    args += ['--cpu-affinity'] + list(config['cpu_affinity'])
+
+                process = subprocess.Popen(
+                    self.streamer_command(args, log_file),
+                    cwd=os.path.dirname(self.streamer_script),
+                    preexec_fn=os.setsid
+                )
+                self.streamers[device_id] = {'process': process, 'ports': ports, 'log_file': log_file,
+                                             'resolved_device_id': resolved_id}
+
+                time.sleep(2)
+
+                if self.is_streamer_running(device_id):
+                    return {"success": True, "message": f"Streamer for {name} started on {resolved_id} (PID: {process.pid})",
+                            "device_id": device_id, "resolved_device_id": resolved_id, "ports": ports}
+                else:
+                    return {"success": False, "message": f"Streamer for {name} failed to start - check {log_file}"}
 
-        except Exception as e:
-            return {"success": False, "message": f"Failed to start streamer: {str(e)}"}
+            except Exception as e:
+                return {"success": False, "message": f"Failed to start streamer: {str(e)}"}
 
-    def stop_streamer(self):
-        if not self.is_streamer_running():
-            if os.path.exists(self.log_file):
+    def stop_streamer(self, device_id=None):
+        name = self.device_key(device_id)
+        log_file = self.log_file_for(device_id)
+        if not self.is_streamer_running(device_id):
+            if os.path.exists(log_file):
                 try:
-                    os.remove(self.log_file)
+                    os.remove(log_file)
                 except:
                     pass
-            return {"success": True, "message": "Streamer was not running"}
+            return {"success": True, "message": f"Streamer for {name} was not running"}
 
         try:
-            pid = self.streamer_process.pid
+            pid = self.streamers[device_id]['process'].pid
 
             try:
                 os.killpg(os.getpgid(pid), signal.SIGTERM)
@@ -118,46 +308,101 @@ class SimpleOakController:
             timeout = 5
             start_time = time.time()
             while time.time() - start_time < timeout:
-                if not self.is_streamer_running():
+                if not self.is_streamer_running(device_id):
                     break
                 time.sleep(0.1)
 
-            if self.is_streamer_running():
+            if self.is_streamer_running(device_id):
                 try:
                     os.killpg(os.getpgid(pid), signal.SIGKILL)
                 except ProcessLookupError:
                     pass
                 time.sleep(0.5)
 
-            if os.path.exists(self.log_file):
+            if os.path.exists(log_file):
                 try:
-                    os.remove(self.log_file)
+                    os.remove(log_file)
                 except:
                     pass
 
-            self.streamer_process = None
-            return {"success": True, "message": f"Streamer stopped (PID: {pid})"}
+            self.streamers.pop(device_id, None)
+            return {"success": True, "message": f"Streamer for {name} stopped (PID: {pid})"}
 
         except Exception as e:
             return {"success": False, "message": f"Failed to stop streamer: {str(e)}"}
 
-    def get_status(self):
-        if self.is_streamer_running():
+    def start_all(self, use_rgb_timestamp_protocol=False, config=None):
+        """Start one streamer per enumerated device, each on its own port block."""
+        listing = self.list_devices()
+        if not listing['success']:
+            return listing
+        if not listing['devices']:
+            return {"success": False, "message": "No devices found"}
+        results = {}
+        for device in listing['devices']:
+            results[device['device_id']] = self.start_streamer(use_rgb_timestamp_protocol, config, device['device_id'])
+        started = sum(1 for result in results.values() if result['success'])
+        return {"success": started == len(results), "message": f"Started {started}/{len(results)} streamers",
+                "devices": results}
+
+    def stop_all(self):
+        results = {self.device_key(device_id): self.stop_streamer(device_id) for device_id in list(self.streamers)}
+        return {"success": all(result['success'] for result in results.values()),
+                "message": f"Stopped {len(results)} streamers", "devices": results}
+
+    def get_status(self, device_id=None):
+        if self.is_streamer_running(device_id):
+            pid = self.streamers[device_id]['process'].pid
             try:
-                process = psutil.Process(self.streamer_process.pid)
-                cpu = process.cpu_percent(interval=0.1)
-                mem = process.memory_info().rss / 1024 / 1024
+                # The bash wrapper is idle; count the streamer (and its sender processes) under it
+                process = psutil.Process(pid)
+                processes = [process] + process.children(recursive=True)
+                for p in processes:
+                    p.cpu_percent(None)
+                time.sleep(0.1)
+                cpu = sum(p.cpu_percent(None) for p in processes)
+                mem = sum(p.memory_info().rss for p in processes) / 1024 / 1024
                 uptime = int(time.time() - process.create_time())
 
                 return {
                     "success": True,
-                    "message": f"RUNNING|{self.streamer_process.pid}|{uptime}|{cpu:.1f}|{mem:.1f}"
+                    "message": f"RUNNING|{pid}|{uptime}|{cpu:.1f}|{mem:.1f}"
                 }
             except Exception:
-                return {"success": True, "message": f"RUNNING|{self.streamer_process.pid}|0|0|0"}
+                return {"success": True, "message": f"RUNNING|{pid}|0|0|0"}
         else:
             return {"success": True, "message": "STOPPED"}
 
+    def get_device_status(self):
+        """Status of every device we have started a streamer for."""
+        devices = {}
+        for device_id in list(self.port_blocks):
+            status = self.get_status(device_id)
+            status['ports'] = self.allocate_ports(device_id)
+            devices[self.device_key(device_id)] = status
+        running = sum(1 for status in devices.values() if status['message'] != 'STOPPED')
+        return {"success": True, "message": f"{running}/{len(devices)} streamers running", "devices": devices}
+
+    def forward_profile_command(self, action, device_id=None, **params):
+        """Send a profiling command to a running streamer and return its response."""
+        if not self.is_streamer_running(device_id):
+            return {"success": False, "message": f"Streamer for {self.device_key(device_id)} not running"}
+
+        try:
+            request = dict(params, action=action)
+            profile_port = self.streamers[device_id]['ports']['profile_port']
+            with socket.create_connection(('127.0.0.1', profile_port), timeout=5) as sock:
+                sock.sendall(json.dumps(request).encode())
+                chunks = []
+                while True:
+                    chunk = sock.recv(65536)
+                    if not chunk:
+                        break
+                    chunks.append(chunk)
+            return json.loads(b''.join(chunks).decode())
+        except Exception as e:
+            return {"success": False, "message": f"Profile command failed: {str(e)}"}
+
     def handle_client(self, client_socket):
         try:
             data = client_socket.recv(4096).decode()  # Increased buffer for config
@@ -167,10 +412,28 @@ class SimpleOakController:
             try:
                 cmd_data = json.loads(command)
                 if isinstance(cmd_data, dict) and 'command' in cmd_data:
-                    if cmd_data['command'] == 'START_WITH_CONFIG':
+                    device_id = cmd_data.get('device_id')
+                    if cmd_data['command'] in ('START_WITH_CONFIG', 'START_DEVICE'):
                         config = cmd_data.get('config', {})
                         use_rgb_ts = cmd_data.get('use_rgb_timestamp_protocol', False)
-                        response = self.start_streamer(use_rgb_timestamp_protocol=use_rgb_ts, config=config)
+                        response = self.start_streamer(use_rgb_timestamp_protocol=use_rgb_ts, config=config,
+                                                       device_id=device_id)
+                    elif cmd_data['command'] == 'STOP_DEVICE':
+                        response = self.stop_streamer(device_id)
+                    elif cmd_data['command'] == 'DEVICE_STATUS':
+                        response = self.get_status(device_id) if device_id else self.get_device_status()
+                    elif cmd_data['command'] == 'LIST_DEVICES':
+                        response = self.list_devices()
+                    elif cmd_data['command'] == 'START_ALL':
+                        response = self.start_all(cmd_data.get('use_rgb_timestamp_protocol', False),
+                                                  cmd_data.get('config', {}))
+                    elif cmd_data['command'] == 'STOP_ALL':
+                        response = self.stop_all()
+                    elif cmd_data['command'] == 'PROFILE':
+                        # {"command": "PROFILE", "action": "enable|disable|stats|capture", "seconds": N, "format": ...,
+                        #  "device_id": MxID}
+                        params = {k: v for k, v in cmd_data.items() if k in ('seconds', 'format')}
+                        response = self.forward_profile_command(cmd_data.get('action'), device_id, **params)
                     else:
                         response = {"success": False, "message": f"Unknown JSON command: {cmd_data['command']}"}
                 else:
@@ -187,6 +450,22 @@ class SimpleOakController:
                     response = self.get_status()
                 elif command == "HEARTBEAT":
                     response = self.get_status()
+                elif command == "LIST_DEVICES":
+                    response = self.list_devices()
+                elif command == "DEVICE_STATUS":
+                    response = self.get_device_status()
+                elif command == "START_ALL":
+                    response = self.start_all()
+                elif command == "STOP_ALL":
+                    response = self.stop_all()
+                elif command == "PROFILE_ON":
+                    response = self.forward_profile_command('enable')
+                elif command == "PROFILE_OFF":
+                    response = self.forward_profile_command('disable')
+                elif command == "PROFILE_STATS":
+                    response = self.forward_profile_command('stats')
+                elif command == "PROFILE_CAPTURE":
+                    response = self.forward_profile_command('capture', seconds=10, format='collapsed')
                 else:
                     response = {"success": False, "message": f"Unknown command: {command}"}
 
@@ -229,9 +508,13 @@ class SimpleOakController:
         except KeyboardInterrupt:
             print("Shutting down...")
             self.running = False
-            if self.is_streamer_running():
-                self.stop_streamer()
+            self.stop_all()
             server_thread.join(timeout=2)
 
 if __name__ == '__main__':
-    controller = SimpleOakController()
+    parser = argparse.ArgumentParser(description='OAK streamer controller')
+    parser.add_argument('--simulate-devices', type=int, default=0, metavar='N',
+                        help='Manage N simulated devices instead of real cameras (for testing)')
+    args = parser.parse_args()
+
+    controller = SimpleOakController(simulated_devices=args.simulate_devices)
@@ -0,0 +1,1026 @@
+#!/usr/bin/env python3
+"""
+Reference receiver for the QuadOakStreamerWithIMU wire formats.
+
+Streams and formats:
+    RGB (legacy)     [4B size][H.264 data]
+    RGB (ts proto)   [4B sequence][4B size][H.264 data] + UDP [>IdI seq, timestamp, sensor_to_dequeue_us]
+    Left / Right     [4B size][>IIQ width, height, timestamp_us][mono8 data]
+    Depth            [4B size][4B ZLIB magic][4B original_size][zlib([>IIIQ metadata][uint16 data])]
+    IMU (UDP)        IMUB raw samples and IMUP per-frame preintegration records
+    Time sync (UDP)  TSYN/TSYR exchange on the RGB timestamp port (TimeSyncClient)
+    Local (shm)      same-host shared-memory rings, streamer run with --local-shm
+                     (SharedMemoryReceiver)
+
+Every receiver reads with recv_into into buffers that are allocated once and
+grown only when a larger frame shows up, so steady-state decoding does not
+allocate per frame. Frames are returned as views into those buffers: they are
+valid until the next read on the same receiver, copy them if you keep them.
+
+Both a blocking API (read() / iteration) and an asyncio API (aconnect(),
+aread() / async iteration) are provided. They share the same decode logic.
+
+Run this file with --benchmark to compare decode throughput and per-frame
+allocations against a naive receiver, using a loopback streamer instance,
+and with --benchmark-local to compare the shared-memory transport against
+loopback TCP.
+"""
+import argparse
+import asyncio
+import socket
+import struct
+import time
+import zlib
+from collections import namedtuple
+
+import numpy as np
+
+from clock_sync import (TIME_SYNC_REQUEST, TIME_SYNC_REQUEST_MAGIC, TIME_SYNC_RESPONSE,
+                        TIME_SYNC_RESPONSE_MAGIC)
+from shm_ring import SharedFrameRing, RingReader, local_ring_name
+
+DEPTH_COMPRESSION_MAGIC = 0x5A4C4942  # "ZLIB"
+IMU_BINARY_MAGIC = 0x494D5542  # "IMUB"
+IMU_PREINT_MAGIC = 0x494D5550  # "IMUP"
+
+_SIZE = struct.Struct('>I')
+_RGB_SEQ_HEADER = struct.Struct('>II')
+_RGB_TS = struct.Struct('>IdI')
+_STEREO_META = struct.Struct('>IIQ')
+_DEPTH_ENVELOPE = struct.Struct('>II')
+_DEPTH_META = struct.Struct('>IIIQ')
+_IMU_SAMPLE = struct.Struct('>IIdfffffffffff')
+_IMU_PREINT = struct.Struct('>IIQQH4f3f3f45f')
+
+# Decompression output chunk: small enough to stay off the mmap allocation path
+_DEPTH_CHUNK = 128 * 1024
+_DEPTH_INPUT_CHUNK = 64 * 1024
+
+RgbFrame = namedtuple('RgbFrame', ['sequence', 'timestamp', 'data'])
+StereoFrame = namedtuple('StereoFrame', ['width', 'height', 'timestamp_us', 'image'])
+DepthFrame = namedtuple('DepthFrame', ['width', 'height', 'timestamp_us', 'depth'])
+ImuSample = namedtuple('ImuSample', ['sequence', 'timestamp', 'accel', 'gyro', 'quaternion', 'accuracy'])
+SharedFrame = namedtuple('SharedFrame', ['sequence', 'width', 'height', 'timestamp_us', 'data'])
+ImuPreintegration = namedtuple('ImuPreintegration', ['sequence', 't_start_us', 't_end_us', 'num_samples',
+                                                     'delta_q', 'delta_v', 'delta_p', 'covariance'])
+
+
+def _recv_exact_into(sock, view):
+    while view:
+        n = sock.recv_into(view)
+        if n == 0:
+            raise ConnectionError("Stream closed by streamer")
+        view = view[n:]
+
+
+async def _arecv_exact_into(loop, sock, view):
+    while view:
+        n = await loop.sock_recv_into(sock, view)
+        if n == 0:
+            raise ConnectionError("Stream closed by streamer")
+        view = view[n:]
+
+
+class _TcpStreamReceiver:
+    """
+    Common connection handling for the TCP streams.
+
+    Subclasses implement _steps(): a generator that yields memoryviews to be
+    filled completely from the socket and finally returns the decoded frame.
+    read() and aread() drive the same generator with blocking or asyncio I/O.
+    """
+
+    def __init__(self, host, port, timeout=5.0, rcvbuf=4 * 1024 * 1024):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.rcvbuf = rcvbuf
+        self.sock = None
+        self._loop = None
+        self._header = bytearray(32)
+        self._header_view = memoryview(self._header)
+        self._buf = bytearray(0)
+        self._buf_view = memoryview(self._buf)
+        self.stats = {'frames': 0, 'bytes': 0}
+
+    def _configure(self, sock):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf)
+        except OSError:
+            pass
+
+    def connect(self):
+        self.sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self.sock.settimeout(None)
+        self._configure(self.sock)
+        return self
+
+    async def aconnect(self):
+        self._loop = asyncio.get_running_loop()
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        try:
+            await asyncio.wait_for(self._loop.sock_connect(sock, (self.host, self.port)), self.timeout)
+        except Exception:
+            sock.close()
+            raise
+        self._configure(sock)
+        self.sock = sock
+        return self
+
+    def close(self):
+        if self.sock:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+            self.sock = None
+
+    def __enter__(self):
+        return self.connect()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    async def __aenter__(self):
+        return await self.aconnect()
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+    def _payload_view(self, size):
+        """View of the reusable payload buffer, grown (power of two) if needed."""
+        if size > len(self._buf):
+            self._buf = bytearray(1 << (size - 1).bit_length())
+            self._buf_view = memoryview(self._buf)
+        return self._buf_view[:size]
+
+    def _steps(self):
+        raise NotImplementedError
+
+    def read(self):
+        steps = self._steps()
+        view = next(steps)
+        while True:
+            _recv_exact_into(self.sock, view)
+            self.stats['bytes'] += len(view)
+            try:
+                view = steps.send(None)
+            except StopIteration as done:
+                self.stats['frames'] += 1
+                return done.value
+
+    async def aread(self):
+        steps = self._steps()
+        view = next(steps)
+        while True:
+            await _arecv_exact_into(self._loop, self.sock, view)
+            self.stats['bytes'] += len(view)
+            try:
+                view = steps.send(None)
+            except StopIteration as done:
+                self.stats['frames'] += 1
+                return done.value
+
+    def __iter__(self):
+        while True:
+            try:
+                yield self.read()
+            except ConnectionError:
+                return
+
+    def __aiter__(self):
+        return self._aiter()
+
+    async def _aiter(self):
+        while True:
+            try:
+                yield await self.aread()
+            except ConnectionError:
+                return
+
+
+class LengthPrefixedReceiver(_TcpStreamReceiver):
+    """Legacy [4B size][payload] stream (RGB without the timestamp protocol)."""
+
+    def __init__(self, host, port=5000, **kwargs):
+        super().__init__(host, port, **kwargs)
+
+    def _steps(self):
+        header = self._header_view[:4]
+        yield header
+        view = self._payload_view(_SIZE.unpack_from(self._header)[0])
+        yield view
+        return view
+
+
+class RgbReceiver(_TcpStreamReceiver):
+    """
+    H.264 RGB stream, legacy or sequence-numbered.
+
+    With ts_port set the streamer must run with --use-rgb-timestamp-protocol:
+    frames carry a sequence number and device timestamps arrive over UDP,
+    which are joined to frames by sequence. Frames whose timestamp has not
+    arrived (UDP loss) are returned with timestamp=None.
+    """
+
+    def __init__(self, host, port=5000, ts_port=None, max_pending_timestamps=256, **kwargs):
+        super().__init__(host, port, **kwargs)
+        self.ts_port = ts_port
+        self.ts_sock = None
+        self.max_pending_timestamps = max_pending_timestamps
+        self._timestamps = {}
+        self._ts_buf = bytearray(64)
+        self._ts_view = memoryview(self._ts_buf)
+        self._legacy_sequence = 0
+
+    def _register_timestamps(self):
+        self.ts_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.ts_sock.setblocking(False)
+        self.ts_sock.sendto(b'REGISTER_RGB_TS', (self.host, self.ts_port))
+
+    def connect(self):
+        super().connect()
+        if self.ts_port:
+            self._register_timestamps()
+        return self
+
+    async def aconnect(self):
+        await super().aconnect()
+        if self.ts_port:
+            self._register_timestamps()
+        return self
+
+    def close(self):
+        super().close()
+        if self.ts_sock:
+            self.ts_sock.close()
+            self.ts_sock = None
+
+    def _drain_timestamps(self):
+        while True:
+            try:
+                n = self.ts_sock.recv_into(self._ts_view)
+            except (BlockingIOError, InterruptedError):
+                return
+            if n == _RGB_TS.size:
+                sequence, timestamp, _ = _RGB_TS.unpack_from(self._ts_buf)
+                self._timestamps[sequence] = timestamp
+        # Bounded: drop the oldest sequences if frames never showed up
+        while len(self._timestamps) > self.max_pending_timestamps:
+            del self._timestamps[min(self._timestamps)]
+
+    def _steps(self):
+        if not self.ts_port:
+            header = self._header_view[:4]
+            yield header
+            view = self._payload_view(_SIZE.unpack_from(self._header)[0])
+            yield view
+            sequence = self._legacy_sequence
+            self._legacy_sequence += 1
+            return RgbFrame(sequence, None, view)
+
+        header = self._header_view[:_RGB_SEQ_HEADER.size]
+        yield header
+        sequence, size = _RGB_SEQ_HEADER.unpack_from(self._header)
+        view = self._payload_view(size)
+        yield view
+        # The streamer sends the UDP timestamp before the TCP frame
+        self._drain_timestamps()
+        return RgbFrame(sequence, self._timestamps.pop(sequence, None), view)
+
+
+class StereoReceiver(_TcpStreamReceiver):
+    """Raw mono8 left/right stream decoded into a reusable uint8 array."""
+
+    def __init__(self, host, port=5001, **kwargs):
+        super().__init__(host, port, **kwargs)
+        self._image = np.empty(0, dtype=np.uint8)
+
+    def _steps(self):
+        header = self._header_view[:_SIZE.size + _STEREO_META.size]
+        yield header
+        size = _SIZE.unpack_from(self._header)[0]
+        width, height, timestamp_us = _STEREO_META.unpack_from(self._header, _SIZE.size)
+        pixels = width * height
+        if size - _STEREO_META.size != pixels:
+            raise ValueError(f"Stereo payload size {size} does not match {width}x{height}")
+        if pixels > self._image.size:
+            self._image = np.empty(pixels, dtype=np.uint8)
+        yield memoryview(self._image)[:pixels]
+        return StereoFrame(width, height, timestamp_us, self._image[:pixels].reshape(height, width))
+
+
+class DepthReceiver(_TcpStreamReceiver):
+    """
+    ZLIB-compressed uint16 depth stream.
+
+    The compressed payload is read into a reusable buffer and inflated in
+    fixed-size chunks straight into a reusable uint16 array, so no full-frame
+    temporary is created per frame. Uncompressed payloads (no ZLIB magic)
+    are accepted as well.
+    """
+
+    def __init__(self, host, port=5003, **kwargs):
+        super().__init__(host, port, **kwargs)
+        self._depth = np.empty(0, dtype=np.uint16)
+
+    def _depth_bytes(self, width, height, itemsize):
+        if itemsize != 2:
+            raise ValueError(f"Unsupported depth itemsize {itemsize}")
+        pixels = width * height
+        if pixels > self._depth.size:
+            self._depth = np.empty(pixels, dtype=np.uint16)
+        return memoryview(self._depth).cast('B')[:pixels * 2]
+
+    def _inflate(self, compressed):
+        decompressor = zlib.decompressobj()
+        meta = decompressor.decompress(compressed[:_DEPTH_INPUT_CHUNK], _DEPTH_META.size)
+        width, height, itemsize, timestamp_us = _DEPTH_META.unpack(meta)
+        out = self._depth_bytes(width, height, itemsize)
+
+        pos = 0
+        data = decompressor.unconsumed_tail
+        offset = _DEPTH_INPUT_CHUNK
+        while pos < len(out):
+            if not data:
+                if offset >= len(compressed):
+                    break
+                data = compressed[offset:offset + _DEPTH_INPUT_CHUNK]
+                offset += _DEPTH_INPUT_CHUNK
+            chunk = decompressor.decompress(data, min(_DEPTH_CHUNK, len(out) - pos))
+            out[pos:pos + len(chunk)] = chunk
+            pos += len(chunk)
+            data = decompressor.unconsumed_tail
+        if pos != len(out):
+            raise ValueError(f"Depth frame truncated: {pos} of {len(out)} bytes")
+        return width, height, timestamp_us
+
+    def _steps(self):
+        header = self._header_view[:4]
+        yield header
+        view = self._payload_view(_SIZE.unpack_from(self._header)[0])
+        yield view
+
+        magic, _original_size = _DEPTH_ENVELOPE.unpack_from(view)
+        if magic == DEPTH_COMPRESSION_MAGIC:
+            width, height, timestamp_us = self._inflate(view[_DEPTH_ENVELOPE.size:])
+        else:
+            width, height, itemsize, timestamp_us = _DEPTH_META.unpack_from(view)
+            out = self._depth_bytes(width, height, itemsize)
+            out[:] = view[_DEPTH_META.size:_DEPTH_META.size + len(out)]
+        pixels = width * height
+        return DepthFrame(width, height, timestamp_us, self._depth[:pixels].reshape(height, width))
+
+
+class ImuReceiver:
+    """
+    UDP IMU stream: raw IMUB samples and, when the streamer runs with
+    --imu-preintegration, IMUP per-frame preintegration records.
+    """
+
+    def __init__(self, host, port=5004, timeout=5.0):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.sock = None
+        self._loop = None
+        self._buf = bytearray(512)
+        self._view = memoryview(self._buf)
+        self.stats = {'samples': 0, 'preintegrations': 0, 'lost': 0}
+        self._last_sequence = None
+
+    def _open(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.sendto(b'REGISTER_IMU', (self.host, self.port))
+
+    def connect(self):
+        self._open()
+        self.sock.settimeout(self.timeout)
+        return self
+
+    async def aconnect(self):
+        self._loop = asyncio.get_running_loop()
+        self._open()
+        self.sock.setblocking(False)
+        return self
+
+    def close(self):
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+
+    def __enter__(self):
+        return self.connect()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    async def __aenter__(self):
+        return await self.aconnect()
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+    def _decode(self, n):
+        if n < 4:
+            return None
+        magic = _SIZE.unpack_from(self._buf)[0]
+        if magic == IMU_BINARY_MAGIC and n >= _IMU_SAMPLE.size:
+            f = _IMU_SAMPLE.unpack_from(self._buf)
+            if self._last_sequence is not None and f[1] > self._last_sequence + 1:
+                self.stats['lost'] += f[1] - self._last_sequence - 1
+            self._last_sequence = f[1]
+            self.stats['samples'] += 1
+            return ImuSample(f[1], f[2], f[3:6], f[6:9], f[9:13], f[13])
+        if magic == IMU_PREINT_MAGIC and n >= _IMU_PREINT.size:
+            f = _IMU_PREINT.unpack_from(self._buf)
+            covariance = np.zeros((9, 9))
+            covariance[np.triu_indices(9)] = f[15:60]
+            covariance = covariance + np.triu(covariance, 1).T
+            self.stats['preintegrations'] += 1
+            return ImuPreintegration(f[1], f[2], f[3], f[4], f[5:9], f[9:12], f[12:15], covariance)
+        # IMU_ACK and anything unknown
+        return None
+
+    def read(self):
+        while True:
+            record = self._decode(self.sock.recv_into(self._view))
+            if record is not None:
+                return record
+
+    async def aread(self):
+        while True:
+            record = self._decode(await self._loop.sock_recv_into(self.sock, self._view))
+            if record is not None:
+                return record
+
+    def __iter__(self):
+        while True:
+            try:
+                yield self.read()
+            except socket.timeout:
+                return
+
+    def __aiter__(self):
+        return self._aiter()
+
+    async def _aiter(self):
+        while True:
+            yield await self.aread()
+
+
+class SharedMemoryReceiver:
+    """
+    Same-host reader of a streamer's local shared-memory ring (--local-shm).
+
+    Returns SharedFrame(sequence, width, height, timestamp_us, data) where
+    data is a view straight into shared memory, nothing is copied: a mono8
+    or uint16 array for left/right/depth, the H.264 packet bytes for rgb.
+    sequence is the RGB protocol sequence (it matches the UDP timestamps) or
+    the per-stream frame number for the other streams; timestamp_us is the
+    same timestamp the TCP headers carry.
+
+    The writer never waits for readers. A reader that falls behind skips
+    ahead (stats['dropped']), and a view stays intact only until the writer
+    laps the ring, so check still_valid() after using a frame, or copy it.
+    A streamer restart is followed by re-attaching to the new ring.
+
+    An attached reader counts as a client of its stream: the streamer only
+    writes rings that have a reader, and with --on-demand the reader wakes
+    the cameras. It announces itself while it polls (read/aread/latest).
+    """
+
+    STREAMS = ('rgb', 'left', 'right', 'depth')
+
+    def __init__(self, stream, rgb_port=5000, ring_name=None, timeout=5.0, poll_interval=0.0005, untrack=True):
+        if stream not in self.STREAMS:
+            raise ValueError(f"Unknown stream '{stream}' (expected one of {', '.join(self.STREAMS)})")
+        self.stream = stream
+        self.ring_name = ring_name or local_ring_name(rgb_port, stream)
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.untrack = untrack  # False only if the ring was created in this process
+        self.ring = None
+        self.reader = None
+        self._last = None
+        self._last_check = 0.0
+        self._lost = {'dropped': 0, 'torn': 0}  # counts of readers on rings we re-attached away from
+        self.stats = {'frames': 0, 'bytes': 0, 'dropped': 0, 'torn': 0}
+
+    def _attach(self):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                ring = SharedFrameRing.attach(self.ring_name, untrack=self.untrack)
+            except FileNotFoundError:
+                ring = None
+            if ring is not None and not ring.closed:
+                break
+            if ring is not None:
+                ring.close()
+            if time.monotonic() >= deadline:
+                raise ConnectionError(f"No shared-memory ring '{self.ring_name}' (streamer not run with --local-shm?)")
+            time.sleep(0.1)
+        self._detach()
+        self.ring = ring
+        # The heartbeat tells the streamer a local reader is attached (demand, ring writes)
+        self.reader = RingReader(ring, heartbeat=True)
+
+    def _sync_stats(self):
+        for key in self._lost:
+            self.stats[key] = self._lost[key] + self.reader.stats[key]
+
+    def _detach(self):
+        if self.reader:
+            for key in self._lost:
+                self._lost[key] += self.reader.stats[key]
+        self._last = None
+        self.reader = None
+        if self.ring:
+            self.ring.close()
+            self.ring = None
+
+    def connect(self):
+        self._attach()
+        return self
+
+    async def aconnect(self):
+        await asyncio.get_running_loop().run_in_executor(None, self._attach)
+        return self
+
+    def close(self):
+        self._detach()
+
+    def __enter__(self):
+        return self.connect()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    async def __aenter__(self):
+        return await self.aconnect()
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+    def _decode(self, frame):
+        self._last = frame
+        self.stats['frames'] += 1
+        self.stats['bytes'] += frame.data.nbytes
+        self._sync_stats()
+        if self.stream == 'rgb':
+            return SharedFrame(frame.sequence, 0, 0, int(frame.timestamp * 1000000), frame.data)
+        return SharedFrame(frame.sequence, frame.width, frame.height, int(frame.timestamp * 1000000),
+                           frame.getFrame())
+
+    def _writer_alive(self):
+        """False if our ring was unlinked or replaced without being marked closed (streamer killed)."""
+        self._last_check = time.monotonic()
+        try:
+            current = SharedFrameRing.attach(self.ring_name, untrack=self.untrack)
+        except FileNotFoundError:
+            return False
+        same = current.instance_id == self.ring.instance_id
+        current.close()
+        return same
+
+    def _poll(self):
+        """Next frame, None if nothing new; re-attaches if the streamer restarted."""
+        frame = self.reader.poll()
+        if frame is not None:
+            return self._decode(frame)
+        # While no frames arrive, check about once a second that the writer is still there
+        if self.ring.closed or (time.monotonic() - self._last_check >= 1.0 and not self._writer_alive()):
+            self._attach()
+        return None
+
+    def read(self):
+        while True:
+            frame = self._poll()
+            if frame is not None:
+                return frame
+            time.sleep(self.poll_interval)
+
+    async def aread(self):
+        while True:
+            frame = self._poll()
+            if frame is not None:
+                return frame
+            await asyncio.sleep(self.poll_interval)
+
+    def latest(self):
+        """Skip any backlog and return the newest frame (blocks until there is one)."""
+        frame = self.reader.latest()
+        return self._decode(frame) if frame is not None else self.read()
+
+    def still_valid(self):
+        """Whether the last frame read (and any view of it) has not been overwritten by the writer."""
+        if self._last is None:
+            return False
+        valid = self.reader.done(self._last)
+        self._sync_stats()
+        return valid
+
+    def __iter__(self):
+        while True:
+            try:
+                yield self.read()
+            except ConnectionError:
+                return
+
+    def __aiter__(self):
+        return self._aiter()
+
+    async def _aiter(self):
+        while True:
+            try:
+                yield await self.aread()
+            except ConnectionError:
+                return
+
+
+class TimeSyncClient:
+    """
+    NTP-like exchange with the streamer's timestamp port.
+
+    Maps wire timestamps (getTimestamp() values in every stream header) into
+    this host's clock, so receivers can measure sensor-to-receive latency.
+    The exchange with the smallest round trip out of `samples` is used.
+    """
+
+    def __init__(self, host, port=5005, clock=time.monotonic, samples=8, timeout=0.5):
+        self.host = host
+        self.port = port
+        self.clock = clock
+        self.samples = samples
+        self.timeout = timeout
+        self._sequence = 0
+        self.offset = None  # Pi monotonic minus local clock
+        self.round_trip = None
+        self.wire_ref = 0.0
+        self.mono_ref = 0.0
+        self.drift = 0.0
+        self.wall_minus_monotonic = 0.0
+        self.server_jitter_us = 0.0
+
+    def sync(self):
+        """Run one round of exchanges; returns True if any response arrived."""
+        best = None
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.settimeout(self.timeout)
+            for _ in range(self.samples):
+                self._sequence += 1
+                t0 = self.clock()
+                sock.sendto(TIME_SYNC_REQUEST.pack(TIME_SYNC_REQUEST_MAGIC, self._sequence, t0),
+                            (self.host, self.port))
+                try:
+                    while True:
+                        data = sock.recv(TIME_SYNC_RESPONSE.size + 16)
+                        t3 = self.clock()
+                        if len(data) != TIME_SYNC_RESPONSE.size:
+                            continue
+                        fields = TIME_SYNC_RESPONSE.unpack(data)
+                        if fields[0] == TIME_SYNC_RESPONSE_MAGIC and fields[1] == self._sequence:
+                            break
+                except socket.timeout:
+                    continue
+                _, _, _, t1, t2, wire_at_t2, drift_ppm, wall_offset, jitter_us = fields
+                round_trip = (t3 - t0) - (t2 - t1)
+                if best is None or round_trip < best[0]:
+                    best = (round_trip, ((t1 - t0) + (t2 - t3)) / 2.0, t2, wire_at_t2, drift_ppm,
+                            wall_offset, jitter_us)
+        if best is None:
+            return False
+        (self.round_trip, self.offset, self.mono_ref, self.wire_ref, drift_ppm,
+         self.wall_minus_monotonic, self.server_jitter_us) = best
+        self.drift = drift_ppm * 1e-6
+        return True
+
+    def wire_to_local(self, wire_ts):
+        """Wire timestamp (seconds) -> this host's clock."""
+        if self.offset is None:
+            raise RuntimeError("TimeSyncClient.sync() has not completed")
+        mono = self.mono_ref + (wire_ts - self.wire_ref) * (1.0 + self.drift)
+        return mono - self.offset
+
+    def sensor_to_receive(self, wire_ts, receive_time=None):
+        """Seconds from sensor capture to receive_time (default: now)."""
+        if receive_time is None:
+            receive_time = self.clock()
+        return receive_time - self.wire_to_local(wire_ts)
+
+
+def _naive_read(sock):
+    """Typical hand-written receiver: recv loop, join, frombuffer().copy()."""
+    def recv_n(n):
+        chunks = []
+        while n:
+            chunk = sock.recv(n)
+            if not chunk:
+                raise ConnectionError("Stream closed by streamer")
+            chunks.append(chunk)
+            n -= len(chunk)
+        return b''.join(chunks)
+    size = int.from_bytes(recv_n(4), 'big')
+    return recv_n(size)
+
+
+def _naive_decode_stereo(payload):
+    width, height, _ = _STEREO_META.unpack_from(payload)
+    return np.frombuffer(payload[_STEREO_META.size:], dtype=np.uint8).reshape(height, width).copy()
+
+
+def _naive_decode_depth(payload):
+    raw = zlib.decompress(payload[_DEPTH_ENVELOPE.size:])
+    width, height, _, _ = _DEPTH_META.unpack_from(raw)
+    return np.frombuffer(raw[_DEPTH_META.size:], dtype=np.uint16).reshape(height, width).copy()
+
+
+class _SyntheticFrame:
+    """Stand-in for a DepthAI ImgFrame (getFrame / getTimestamp)."""
+
+    def __init__(self, frame, timestamp):
+        from datetime import timedelta
+        self._frame = frame
+        self._timestamp = timedelta(seconds=timestamp)
+
+    def getFrame(self):
+        return self._frame
+
+    def getTimestamp(self):
+        return self._timestamp
+
+
+class _WireCapture:
+    """Fake client socket recording what a broadcast_* call puts on the wire."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def sendall(self, data):
+        self.chunks.append(bytes(data))
+
+
+def benchmark(frames=200, width=1280, height=720, base_port=15000):
+    """
+    Decode throughput and per-frame allocations, this library vs a naive
+    receiver, against a loopback QuadOakStreamerWithIMU instance.
+
+    Throughput runs the streamer's real broadcast functions on synthetic
+    stereo/depth frames. Allocations are measured with tracemalloc while the
+    server side replays pre-captured wire bytes, so only receiver-side
+    allocations are counted.
+    """
+    import threading
+    import tracemalloc
+    from quad_streamer_with_imu import QuadOakStreamerWithIMU
+
+    streamer = QuadOakStreamerWithIMU(host='127.0.0.1', left_port=base_port + 1, depth_port=base_port + 3)
+    streamer.running = True
+    streamer.start_left_server()
+    streamer.start_depth_server()
+
+    rng = np.random.default_rng(0)
+    mono = rng.integers(0, 256, (height, width), dtype=np.uint8)
+    yy, xx = np.mgrid[0:height, 0:width]
+    depth = (500 + 3 * xx + 2 * yy + rng.integers(0, 8, (height, width))).astype(np.uint16)
+    stereo_frame = _SyntheticFrame(mono, 1.0)
+    depth_frame = _SyntheticFrame(depth, 1.0)
+
+    streams = {
+        'stereo': (streamer.left_port, streamer.left_clients,
+                   lambda clients: streamer.broadcast_stereo_frame(stereo_frame, clients, "Left", streamer.left_stats),
+                   StereoReceiver, _naive_decode_stereo),
+        'depth': (streamer.depth_port, streamer.depth_clients,
+                  lambda clients: streamer.broadcast_depth_frame(depth_frame, clients, streamer.depth_stats),
+                  DepthReceiver, _naive_decode_depth),
+    }
+
+    def run_case(send, read_frame, count):
+        sender = threading.Thread(target=lambda: [send() for _ in range(count)], daemon=True)
+        sender.start()
+        start = time.perf_counter()
+        cpu_start = time.thread_time()
+        total = sum(read_frame() for _ in range(count))
+        cpu = time.thread_time() - cpu_start
+        wall = time.perf_counter() - start
+        sender.join()
+        return total, wall, cpu
+
+    results = []
+    try:
+        for name, (port, clients, broadcast, receiver_cls, naive_decode) in streams.items():
+            capture = _WireCapture()
+            broadcast([capture])
+            wire = b''.join(capture.chunks)
+
+            for method in ('oak_receiver', 'naive'):
+                receiver = receiver_cls('127.0.0.1', port)
+                receiver.connect()
+                while not clients:
+                    time.sleep(0.01)
+                server_side = clients[0]
+
+                if method == 'oak_receiver':
+                    def read_frame():
+                        before = receiver.stats['bytes']
+                        receiver.read()
+                        return receiver.stats['bytes'] - before
+                else:
+                    def read_frame():
+                        payload = _naive_read(receiver.sock)
+                        naive_decode(payload)
+                        return len(payload) + 4
+
+                # Warm up buffers so steady state is measured
+                run_case(lambda: broadcast(clients), read_frame, 3)
+                total, wall, cpu = run_case(lambda: broadcast(clients), read_frame, frames)
+
+                replay_count = max(frames // 10, 5)
+                tracemalloc.start()
+                base = tracemalloc.get_traced_memory()[0]
+                replay = threading.Thread(target=lambda: [server_side.sendall(wire) for _ in range(replay_count)],
+                                          daemon=True)
+                replay.start()
+                for _ in range(replay_count):
+                    tracemalloc.reset_peak()
+                    read_frame()
+                peak = tracemalloc.get_traced_memory()[1] - base
+                replay.join()
+                tracemalloc.stop()
+
+                results.append({
+                    'stream': name,
+                    'receiver': method,
+                    'wire_mb_s': total / wall / 1e6,
+                    'decode_cpu_us': cpu / frames * 1e6,
+                    'peak_alloc_bytes': peak,
+                })
+                receiver.close()
+                clients.clear()
+    finally:
+        streamer.running = False
+        streamer.shutdown()
+    return results
+
+
+def benchmark_local(frames=300, width=1280, height=720, base_port=15200):
+    """
+    Same-host transport: shared-memory rings vs loopback TCP.
+
+    For stereo (mono8) and depth (uint16) frames, a writer thread publishes
+    synthetic frames the way the streamer does (broadcast_* over TCP, or a
+    StreamRings write) and a reader thread consumes them (StereoReceiver /
+    DepthReceiver, or SharedMemoryReceiver). The shared-memory writer is
+    held back when it gets close to lapping the reader, so every frame is
+    delivered in both cases. Reports frame throughput and the CPU time
+    each side spends per frame.
+    """
+    import threading
+    from multiprocess_streamer import RING_SLOTS, StreamRings
+    from quad_streamer_with_imu import QuadOakStreamerWithIMU
+
+    rng = np.random.default_rng(0)
+    mono = rng.integers(0, 256, (height, width), dtype=np.uint8)
+    yy, xx = np.mgrid[0:height, 0:width]
+    depth = (500 + 3 * xx + 2 * yy + rng.integers(0, 8, (height, width))).astype(np.uint16)
+
+    def run_case(write, read, count):
+        cpu = {}
+
+        def writer():
+            start = time.thread_time()
+            for i in range(count):
+                write(i)
+            cpu['writer'] = time.thread_time() - start
+
+        thread = threading.Thread(target=writer, daemon=True)
+        start = time.perf_counter()
+        thread.start()
+        reader_start = time.thread_time()
+        for _ in range(count):
+            read()
+        cpu['reader'] = time.thread_time() - reader_start
+        wall = time.perf_counter() - start
+        thread.join()
+        return wall, cpu
+
+    results = []
+    streamer = QuadOakStreamerWithIMU(host='127.0.0.1', rgb_port=base_port, left_port=base_port + 1,
+                                      depth_port=base_port + 3)
+    streamer.running = True
+    streamer.start_left_server()
+    streamer.start_depth_server()
+    rings = StreamRings(base_port, width, height, width, height, replace=True)
+    try:
+        cases = {
+            'stereo': (mono, streamer.left_port, streamer.left_clients, StereoReceiver,
+                       lambda frame, clients: streamer.broadcast_stereo_frame(frame, clients, "Left",
+                                                                              streamer.left_stats),
+                       'Left'),
+            'depth': (depth, streamer.depth_port, streamer.depth_clients, DepthReceiver,
+                      lambda frame, clients: streamer.broadcast_depth_frame(frame, clients, streamer.depth_stats),
+                      'Depth'),
+        }
+        for name, (image, port, clients, receiver_cls, broadcast, ring_stream) in cases.items():
+            frame_obj = _SyntheticFrame(image, 1.0)
+
+            receiver = receiver_cls('127.0.0.1', port).connect()
+            while not clients:
+                time.sleep(0.01)
+            run_case(lambda i: broadcast(frame_obj, clients), receiver.read, 3)
+            wall, cpu = run_case(lambda i: broadcast(frame_obj, clients), receiver.read, frames)
+            results.append({'stream': name, 'transport': 'tcp', 'fps': frames / wall,
+                            'mb_s': frames * image.nbytes / wall / 1e6,
+                            'writer_cpu_us': cpu['writer'] / frames * 1e6,
+                            'reader_cpu_us': cpu['reader'] / frames * 1e6})
+            receiver.close()
+            clients.clear()
+
+            local = SharedMemoryReceiver(ring_stream.lower(), rgb_port=base_port, untrack=False).connect()
+
+            def write_ring(i):
+                # Benchmark only: keep the writer from lapping the reader
+                while local.reader is not None and rings.rings[ring_stream].write_seq - local.reader.next_seq >= RING_SLOTS - 2:
+                    time.sleep(0)
+                rings.write_frame(ring_stream, image, 1.0 + i / 30)
+
+            wall, cpu = run_case(write_ring, local.read, frames)
+            results.append({'stream': name, 'transport': 'shm', 'fps': frames / wall,
+                            'mb_s': frames * image.nbytes / wall / 1e6,
+                            'writer_cpu_us': cpu['writer'] / frames * 1e6,
+                            'reader_cpu_us': cpu['reader'] / frames * 1e6,
+                            'dropped': local.stats['dropped']})
+            local.close()
+    finally:
+        streamer.running = False
+        streamer.shutdown()
+        rings.close()
+    return results
+
+
+def _print_stream(receiver, label):
+    start = time.time()
+    for frame in receiver:
+        elapsed = time.time() - start
+        if elapsed >= 2.0:
+            print(f"{label}: {receiver.stats['frames'] / elapsed:.1f} fps, "
+                  f"{receiver.stats['bytes'] / elapsed / 1e6:.1f} MB/s, last {type(frame).__name__}")
+            receiver.stats['frames'] = 0
+            receiver.stats['bytes'] = 0
+            start = time.time()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Reference receiver for the OAK quad streamer')
+    parser.add_argument('--host', default='127.0.0.1', help='Streamer host (default: 127.0.0.1)')
+    parser.add_argument('--stream', choices=['rgb', 'left', 'right', 'depth', 'imu'], default='left',
+                        help='Stream to receive (default: left)')
+    parser.add_argument('--rgb-timestamp-port', type=int, default=None,
+                        help='Join RGB frames with UDP timestamps from this port')
+    parser.add_argument('--benchmark', action='store_true',
+                        help='Benchmark decode against a naive receiver on a loopback streamer')
+    parser.add_argument('--benchmark-local', action='store_true',
+                        help='Benchmark the shared-memory transport against loopback TCP')
+    parser.add_argument('--frames', type=int, default=200, help='Frames per benchmark case (default: 200)')
+    parser.add_argument('--rgb-port', type=int, default=5000,
+                        help='With --stream and --local-shm: RGB port of the streamer, which names its rings')
+    parser.add_argument('--local-shm', action='store_true',
+                        help='Read from the shared-memory rings of a streamer on this host instead of TCP')
+    args = parser.parse_args()
+
+    if args.benchmark:
+        for r in benchmark(frames=args.frames):
+            print(f"{r['stream']:>6} {r['receiver']:>12}: {r['wire_mb_s']:8.1f} MB/s wire | "
+                  f"{r['decode_cpu_us']:8.1f} us CPU/frame | "
+                  f"{r['peak_alloc_bytes'] / 1024:8.1f} KiB peak alloc/frame")
+    elif args.benchmark_local:
+        for r in benchmark_local(frames=args.frames):
+            print(f"{r['stream']:>6} {r['transport']:>4}: {r['fps']:8.1f} fps {r['mb_s']:8.1f} MB/s | "
+                  f"writer {r['writer_cpu_us']:8.1f} us CPU/frame | reader {r['reader_cpu_us']:8.1f} us CPU/frame")
+    elif args.local_shm:
+        if args.stream == 'imu':
+            parser.error("--local-shm carries the camera streams only")
+        with SharedMemoryReceiver(args.stream, rgb_port=args.rgb_port) as receiver:
+            try:
+                _print_stream(receiver, f"{args.stream} (shm)")
+            except KeyboardInterrupt:
+                pass
+    elif args.stream == 'imu':
+        with ImuReceiver(args.host) as imu:
+            for record in imu:
+                print(record)
+    else:
+        receivers = {
+            'rgb': lambda: RgbReceiver(args.host, ts_port=args.rgb_timestamp_port),
+            'left': lambda: StereoReceiver(args.host, 5001),
+            'right': lambda: StereoReceiver(args.host, 5002),
+            'depth': lambda: DepthReceiver(args.host),
+        }
+        with receivers[args.stream]() as receiver:
+            try:
+                _print_stream(receiver, args.stream)
+            except KeyboardInterrupt:
+                pass
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+Runtime profiling hooks for the streamer.
+
+StageProfiler   scoped timers around each stage of the streaming loop and
+                the broadcast functions. Disabled by default; a disabled
+                stage() is one attribute check and a shared no-op context,
+                so the hooks can stay in the hot path permanently.
+CaptureProfiler on-demand capture for N seconds, either sampled collapsed
+                stacks (all threads, flamegraph.pl / speedscope input) or a
+                cProfile pstats file of the streaming loop thread.
+
+Both are driven at runtime through the streamer's local profile port, which
+SimpleOakController forwards PROFILE commands to. In multi-process mode the
+capture process relays commands to every sender process and merges their
+results (merge_capture_files for captures).
+"""
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import time
+
+
+class _NullScope:
+    __slots__ = ()
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SCOPE = _NullScope()
+
+
+class _StageScope:
+    __slots__ = ('totals', 'name', 'start')
+
+    def __init__(self, totals, name):
+        self.totals = totals
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter_ns() - self.start
+        entry = self.totals.get(self.name)
+        if entry is None:
+            self.totals[self.name] = [1, elapsed, elapsed]
+        else:
+            entry[0] += 1
+            entry[1] += elapsed
+            if elapsed > entry[2]:
+                entry[2] = elapsed
+        return False
+
+
+class StageProfiler:
+    """Aggregating scoped timers: with profiler.stage('depth.compress'): ..."""
+
+    def __init__(self):
+        self.enabled = False
+        self._totals = {}
+        self._interval_start = time.perf_counter()
+
+    def stage(self, name):
+        if not self.enabled:
+            return _NULL_SCOPE
+        return _StageScope(self._totals, name)
+
+    def enable(self):
+        if not self.enabled:
+            self.reset()
+            self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        self._totals = {}
+        self._interval_start = time.perf_counter()
+
+    def snapshot(self, frame_period, reset=True):
+        """
+        Per-stage stats since the last reset:
+            count, mean_ms, max_ms, total_ms
+            load_pct    share of wall time spent in the stage
+            budget_pct  mean time per call as a share of the frame period
+        """
+        elapsed = max(time.perf_counter() - self._interval_start, 1e-9)
+        result = {}
+        for name, (count, total_ns, max_ns) in sorted(self._totals.items()):
+            mean_s = total_ns / count / 1e9
+            result[name] = {
+                'count': count,
+                'mean_ms': mean_s * 1000,
+                'max_ms': max_ns / 1e6,
+                'total_ms': total_ns / 1e6,
+                'load_pct': total_ns / 1e9 / elapsed * 100,
+                'budget_pct': mean_s / frame_period * 100 if frame_period else 0.0,
+            }
+        if reset:
+            self.reset()
+        return result
+
+
+class CaptureProfiler:
+    """
+    On-demand profile capture for a fixed duration.
+
+    'collapsed' samples every thread's stack from a background thread.
+    'pstats' runs cProfile in the streaming loop thread, which must call
+    poll() once per iteration so the profiler is enabled/disabled there.
+
+    stack_prefix, if set, becomes the root frame of every collapsed stack
+    (the process name), so captures from several processes can be merged.
+    """
+
+    FORMATS = ('collapsed', 'pstats')
+
+    def __init__(self, output_dir='/tmp', sample_interval=0.005, stack_prefix=None):
+        self.output_dir = output_dir
+        self.sample_interval = sample_interval
+        self.stack_prefix = stack_prefix
+        self.active = None  # {'format', 'deadline', 'path'}
+        self.last_result = None
+        self._lock = threading.Lock()
+        self._cprofile = None
+
+    def start(self, seconds, fmt='collapsed', path=None):
+        if fmt not in self.FORMATS:
+            raise ValueError(f"Unknown profile format '{fmt}' (expected one of {', '.join(self.FORMATS)})")
+        seconds = float(seconds)
+        if seconds <= 0:
+            raise ValueError("Profile duration must be positive")
+        with self._lock:
+            if self.active:
+                raise RuntimeError(f"Profile capture already running ({self.active['path']})")
+            if path is None:
+                suffix = 'collapsed' if fmt == 'collapsed' else 'pstats'
+                path = os.path.join(self.output_dir, f"streamer_profile_{time.strftime('%Y%m%d_%H%M%S')}.{suffix}")
+            self.active = {'format': fmt, 'deadline': time.monotonic() + seconds, 'path': path}
+        if fmt == 'collapsed':
+            threading.Thread(target=self._sample_stacks, args=(path, seconds), daemon=True).start()
+        return path
+
+    def poll(self):
+        """Called from the streaming loop thread: drives 'pstats' captures."""
+        active = self.active
+        if not active or active['format'] != 'pstats':
+            return
+        if self._cprofile is None:
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+        elif time.monotonic() >= active['deadline']:
+            self._cprofile.disable()
+            self._cprofile.dump_stats(active['path'])
+            self._cprofile = None
+            self._finish(active['path'])
+
+    def _sample_stacks(self, path, seconds):
+        own_ident = threading.get_ident()
+        names = {}
+        counts = {}
+        samples = 0
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                if ident not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                stack.append(names.get(ident, str(ident)))
+                if self.stack_prefix:
+                    stack.append(self.stack_prefix)
+                key = ';'.join(reversed(stack))
+                counts[key] = counts.get(key, 0) + 1
+            samples += 1
+            time.sleep(self.sample_interval)
+
+        with open(path, 'w') as f:
+            for key, count in sorted(counts.items()):
+                f.write(f"{key} {count}\n")
+        self._finish(path, samples)
+
+    def _finish(self, path, samples=None):
+        with self._lock:
+            self.last_result = {'path': path, 'format': self.active['format'] if self.active else None,
+                                'samples': samples, 'finished': time.time()}
+            self.active = None
+
+    def status(self):
+        active = self.active
+        return {
+            'active': None if not active else {
+                'format': active['format'],
+                'path': active['path'],
+                'remaining_s': max(0.0, active['deadline'] - time.monotonic()),
+            },
+            'last_result': self.last_result,
+        }
+
+
+def merge_capture_files(path, parts, fmt):
+    """
+    Merge per-process capture files into path (which may already hold one)
+    and delete the parts. Collapsed stacks are summed line by line; pstats
+    files are combined with pstats.Stats.add.
+    """
+    sources = [part for part in parts if os.path.exists(part)]
+    if fmt == 'collapsed':
+        counts = {}
+        for source in ([path] if os.path.exists(path) else []) + sources:
+            with open(source) as f:
+                for line in f:
+                    key, _, count = line.rstrip('\n').rpartition(' ')
+                    if key:
+                        counts[key] = counts.get(key, 0) + int(count)
+        with open(path, 'w') as f:
+            for key, count in sorted(counts.items()):
+                f.write(f"{key} {count}\n")
+    else:
+        files = ([path] if os.path.exists(path) else []) + sources
+        if files:
+            stats = pstats.Stats(files[0])
+            for source in files[1:]:
+                stats.add(source)
+            stats.dump_stats(path)
+    for part in sources:
+        os.remove(part)
+    return len(sources)
@@ -4,12 +4,20 @@ import socket
 import threading
 import time
 import argparse
+import signal
 import sys
 import json
 import cv2
 import numpy as np
 import struct
 import zlib
+from imu_preintegration import ImuPreintegrator, rotation_to_quaternion
+from clock_sync import ClockSync, LatencyTracker
+import multiprocess_streamer
+from profiling import StageProfiler, CaptureProfiler, merge_capture_files
+from demand import DemandScheduler
+from gop_cache import GopCache
+from simulated_device import SimulatedPipeline, list_simulated_devices
 
 class QuadOakStreamerWithIMU:
     # Compression magic number for depth stream (matches PC receiver)
@@ -18,29 +26,98 @@ class QuadOakStreamerWithIMU:
     # IMU protocol magic number for binary format detection
     IMU_BINARY_MAGIC = 0x494D5542  # "IMUB" in hex (IMU Binary)
 
+    # IMU preintegration record magic number (sent on the IMU UDP socket)
+    IMU_PREINT_MAGIC = 0x494D5550  # "IMUP" in hex (IMU Preintegrated)
+
+    # Color sensor runs at THE_1080_P; RGB output sizes are ISP-scaled from it
+    RGB_SENSOR_SIZE = (1920, 1080)
+    # ISP scaler limits (numerator/denominator after reduction)
+    ISP_MAX_NUMERATOR = 16
+    ISP_MAX_DENOMINATOR = 63
+    # OV9282 mono sensor modes: (width, height) -> SensorResolution
+    MONO_RESOLUTIONS = {(640, 400): 'THE_400_P', (1280, 720): 'THE_720_P', (1280, 800): 'THE_800_P'}
+
+    # RGB timestamp registrations remembered per client host (shared with sender processes)
+    RGB_TS_REGISTRATION_SLOTS = 8
+    # How long a late-joining RGB client may wait for its own timestamp registration
+    # (receivers register right after the TCP connect) before its GOP burst is sent
+    RGB_TS_REGISTRATION_GRACE = 0.5
+
+    # Profiler stage names per stream, built once instead of formatted on every frame
+    SENDALL_STAGES = {name: f"{name.lower()}.sendall" for name in ('RGB', 'Left', 'Right', 'Depth')}
+    GET_FRAME_STAGES = {name: f"{name.lower()}.getFrame" for name in ('RGB', 'Left', 'Right', 'Depth')}
+
     def __init__(self, host="0.0.0.0", rgb_port=5000, left_port=5001, right_port=5002, depth_port=5003, imu_port=5004,
-                 rgb_width=1280, rgb_height=720, mono_width=1280, mono_height=720, fps=30, rgb_ts_port=5005):
+                 rgb_width=1280, rgb_height=720, mono_width=1280, mono_height=720, fps=30, rgb_ts_port=5005,
+                 profile_port=5006, device_id=None, simulate=False, gop_cache_bytes=8 * 1024 * 1024):
         self.host = host
+        # Device selection: MxID of the OAK to open (None = first available)
+        self.device_id = device_id
+        self.simulate = simulate
         self.rgb_port = rgb_port
         self.left_port = left_port
         self.right_port = right_port
         self.depth_port = depth_port
         self.imu_port = imu_port
         self.rgb_ts_port = rgb_ts_port
+        self.profile_port = profile_port
         self.rgb_width = rgb_width
         self.rgb_height = rgb_height
         self.mono_width = mono_width
         self.mono_height = mono_height
+        # Validated up front so an unsupported size fails before any server or device is opened
+        self.rgb_isp_scale = self.rgb_isp_scale_for(rgb_width, rgb_height)
+        self.mono_resolution = self.mono_resolution_for(mono_width, mono_height)
         self.fps = fps
         self.running = False
         self.use_rgb_timestamp_protocol = False
         self.rgb_sequence = 0
         self.rgb_ts_socket = None
-        self.rgb_ts_client_address = None
+        self.rgb_ts_client_address = None  # latest registration: receives the live timestamps
+        # Per client IP: [address, registration time, first live sequence sent there + 1 (0 = none yet)],
+        # so GOP bursts resend only the timestamps the joining client has not had
+        self.rgb_ts_registrations = {}
+        self.rgb_ts_shared_registrations = None  # same, as a shared [IPv4, port, time, seq + 1] * N array in MP mode
+        self.rgb_ts_live_registration = None  # key (IP or table slot) of the registration getting live timestamps
+
+        # Late-joining RGB clients get the current GOP (from the last IDR) first
+        self.gop_cache_bytes = gop_cache_bytes
+        self.gop_cache = GopCache(gop_cache_bytes) if gop_cache_bytes else None
+        self.rgb_pending_clients = []  # (socket, connect time, peer IP) waiting for a decodable burst
+        self.rgb_join_stats = {'joins': 0, 'burst_frames': 0, 'last_ttfd_ms': 0.0, 'total_ttfd_ms': 0.0}
 
         # IMU packet sequence counter for loss detection
         self.imu_sequence = 0
 
+        # Per-frame IMU preintegration (aligned to left stereo frame timestamps)
+        self.use_imu_preintegration = False
+        self.imu_preintegrator = None
+        self.imu_preint_sequence = 0
+
+        # Multi-process mode: capture here, TCP senders in their own processes
+        self.use_multiprocess = False
+        self.sender_groups = dict(multiprocess_streamer.DEFAULT_SENDER_GROUPS)
+        self.cpu_affinity = {}
+        self.stream_rings = None
+        self.sender_processes = []
+        self.sender_stop_event = None
+        self.sender_control = None  # relays profile commands to the sender processes
+
+        # Same-host transport: well-known shared-memory rings (shm_ring.local_ring_name) that
+        # local readers map directly, next to the TCP servers
+        self.use_local_shm = False
+        self.local_rings = None
+
+        # Demand-driven mode: cameras only stream while their streams have clients
+        self.use_demand_driven = False
+        self.demand_linger = 2.0
+        self.demand = None
+        self.camera_control_queues = []
+        self.client_counts = None  # shared with sender processes in multi-process mode
+
+        # Clock offset estimation (wire/device clock -> Pi monotonic -> Pi wall)
+        self.clock_sync = ClockSync(wire_clock=self._wire_clock_now())
+
         # Separate client lists for each stream
         self.rgb_clients = []
         self.left_clients = []
@@ -62,7 +139,155 @@ class QuadOakStreamerWithIMU:
         self.left_stats = {'frames_sent': 0, 'frames_dropped': 0, 'last_fps': 0}
         self.right_stats = {'frames_sent': 0, 'frames_dropped': 0, 'last_fps': 0}
         self.depth_stats = {'frames_sent': 0, 'frames_dropped': 0, 'last_fps': 0}
-        self.imu_stats = {'packets_sent': 0, 'last_rate': 0}
+        self.imu_stats = {'packets_sent': 0, 'last_rate': 0, 'preint_sent': 0}
+
+        # Runtime profiling (toggled over the local profile port)
+        self.profiler = StageProfiler()
+        self.capture_profiler = CaptureProfiler()
+        self.capture_merge = None  # multi-process capture: merge of the senders' part files
+        self.profile_server_socket = None
+
+        # Per-stage latency (sensor -> dequeue, dequeue -> send), per stream
+        self.latency_stats = {name: LatencyTracker() for name in ('RGB', 'Left', 'Right', 'Depth')}
+
+    def streamer_kwargs(self):
+        """Constructor arguments reproducing this streamer's network/stream config."""
+        return {
+            'host': self.host, 'rgb_port': self.rgb_port, 'left_port': self.left_port,
+            'right_port': self.right_port, 'depth_port': self.depth_port, 'imu_port': self.imu_port,
+            'rgb_width': self.rgb_width, 'rgb_height': self.rgb_height,
+            'mono_width': self.mono_width, 'mono_height': self.mono_height,
+            'fps': self.fps, 'rgb_ts_port': self.rgb_ts_port, 'profile_port': self.profile_port,
+            'device_id': self.device_id, 'simulate': self.simulate, 'gop_cache_bytes': self.gop_cache_bytes,
+        }
+
+    def start_sender_processes(self):
+        """Create the shared-memory rings and fork one sender process per group."""
+        # The senders bind the stream ports only after the rings exist; fail before replacing
+        # the well-known rings of another streamer that is still serving these ports
+        self.check_ports_free()
+        # With the local transport these rings double as the well-known local rings
+        self.stream_rings = multiprocess_streamer.StreamRings(
+            self.rgb_port, self.mono_width, self.mono_height, self.mono_width, self.mono_height,
+            replace=self.use_local_shm, tag=None if self.use_local_shm else f"{id(self) & 0xFFFF:x}")
+        context = multiprocess_streamer.multiprocessing.get_context('fork')
+        self.sender_stop_event = context.Event()
+        self.client_counts = context.Array('i', len(multiprocess_streamer.STREAM_NAMES), lock=False)
+        self.rgb_ts_shared_registrations = context.Array('d', 4 * self.RGB_TS_REGISTRATION_SLOTS, lock=False)
+        self.sender_control = multiprocess_streamer.SenderControl()
+        self.capture_profiler.stack_prefix = 'capture'
+        # Bound before the fork so the RGB sender's burst timestamps leave from the timestamp port too
+        self.bind_rgb_timestamp_socket()
+        self.sender_processes = multiprocess_streamer.start_sender_processes(
+            self.sender_groups, self.stream_rings.names, self.streamer_kwargs(),
+            self.use_rgb_timestamp_protocol, self.cpu_affinity, self.sender_stop_event, self.client_counts,
+            self.rgb_ts_shared_registrations, self.sender_control, self.rgb_ts_socket, self.demand_linger)
+        print(f"Started {len(self.sender_processes)} sender processes: "
+              + ", ".join(f"{name} ({'/'.join(streams)})" for name, streams in self.sender_groups.items()))
+        multiprocess_streamer.pin_to_cpus('capture', self.cpu_affinity.get('capture'))
+
+    def check_ports_free(self):
+        """Raise OSError if a stream port is already bound (e.g. by another streamer)."""
+        for port in (self.rgb_port, self.left_port, self.right_port, self.depth_port):
+            probe = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            probe.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            try:
+                probe.bind((self.host, port))
+            except OSError as e:
+                raise OSError(e.errno, f"Port {port} is already in use (another streamer running?)") from e
+            finally:
+                probe.close()
+
+    def has_local_reader(self, stream_name):
+        """Whether a same-host reader is attached to the stream's local shared-memory ring."""
+        rings = self.local_rings or (self.stream_rings if self.use_local_shm else None)
+        return rings is not None and rings.has_readers(stream_name)
+
+    def client_count(self, stream_name):
+        if self.client_counts is not None:
+            return self.client_counts[multiprocess_streamer.STREAM_NAMES.index(stream_name)]
+        if stream_name == 'RGB':
+            return len(self.rgb_clients) + len(self.rgb_pending_clients)
+        return len({'Left': self.left_clients,
+                    'Right': self.right_clients, 'Depth': self.depth_clients}[stream_name])
+
+    @classmethod
+    def rgb_isp_scale_for(cls, width, height):
+        """
+        ISP scale (numerator, denominator) for an RGB output size: the smallest
+        supported scale of the 1080P sensor image that covers width x height.
+        setVideoSize then center-crops the rest, so sizes that are not 16:9 lose
+        some FOV on one axis instead of being stretched. Raises ValueError if
+        the size cannot be produced.
+        """
+        sensor_width, sensor_height = cls.RGB_SENSOR_SIZE
+        if width <= 0 or height <= 0 or width % 2 or height % 2:
+            raise ValueError(f"RGB resolution {width}x{height} must be positive and even")
+        if width > sensor_width or height > sensor_height:
+            raise ValueError(f"RGB resolution {width}x{height} exceeds the {sensor_width}x{sensor_height} sensor mode")
+        best = None
+        for denominator in range(1, cls.ISP_MAX_DENOMINATOR + 1):
+            for numerator in range(1, min(denominator, cls.ISP_MAX_NUMERATOR) + 1):
+                # Exact ISP output sizes only, so the crop is what we computed
+                if (sensor_width * numerator) % denominator or (sensor_height * numerator) % denominator:
+                    continue
+                if sensor_width * numerator // denominator < width or sensor_height * numerator // denominator < height:
+                    continue
+                if best is None or numerator * best[1] < best[0] * denominator:
+                    best = (numerator, denominator)
+        if best is None:
+            raise ValueError(f"RGB resolution {width}x{height} cannot be produced by the ISP scaler")
+        return best
+
+    @classmethod
+    def mono_resolution_for(cls, width, height):
+        """SensorResolution name for a mono/depth size; raises ValueError for sizes the sensor has no mode for."""
+        name = cls.MONO_RESOLUTIONS.get((width, height))
+        if name is None:
+            supported = ', '.join(f"{w}x{h}" for w, h in cls.MONO_RESOLUTIONS)
+            raise ValueError(f"Unsupported mono resolution {width}x{height} (supported: {supported})")
+        return name
+
+    @staticmethod
+    def list_available_devices():
+        """Connected OAK devices as [{'device_id', 'name', 'state'}], device_id being the MxID."""
+        devices = []
+        for info in dai.Device.getAllAvailableDevices():
+            get_id = getattr(info, 'getDeviceId', None) or getattr(info, 'getMxId')
+            devices.append({
+                'device_id': get_id(),
+                'name': getattr(info, 'name', ''),
+                'state': str(getattr(info, 'state', '')).split('.')[-1],
+            })
+        return devices
+
+    def open_device(self):
+        """Open the configured device by MxID, so several streamers can share a host."""
+        print(f"Opening OAK device {self.device_id}")
+        return dai.Device(dai.DeviceInfo(self.device_id))
+
+    @staticmethod
+    def _set_streaming(control_queues, output_queues, start):
+        """Start/stop camera streaming; on start, drop frames left over from before the pause."""
+        if start:
+            for queue in output_queues:
+                queue.tryGetAll()
+        for queue in control_queues:
+            # Simulated control queues bring their own CameraControl stand-in
+            ctrl = queue.control_type() if hasattr(queue, 'control_type') else dai.CameraControl()
+            if start:
+                ctrl.setStartStreaming()
+            else:
+                ctrl.setStopStreaming()
+            queue.send(ctrl)
+
+    @staticmethod
+    def _wire_clock_now():
+        # getTimestamp() values are on the dai.Clock (host steady clock) timebase
+        clock = getattr(dai, 'Clock', None)
+        if clock is None or not hasattr(clock, 'now'):
+            return None
+        return lambda: clock.now().total_seconds()
 
     def start_rgb_server(self):
         self.rgb_server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -120,10 +345,14 @@ class QuadOakStreamerWithIMU:
                 if self.running:
                     print(f"Error in IMU listener: {e}")
 
+    def bind_rgb_timestamp_socket(self):
+        if self.rgb_ts_socket is None:
+            self.rgb_ts_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.rgb_ts_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.rgb_ts_socket.bind((self.host, self.rgb_ts_port))
+
     def start_rgb_timestamp_server(self):
-        self.rgb_ts_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.rgb_ts_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.rgb_ts_socket.bind((self.host, self.rgb_ts_port))
+        self.bind_rgb_timestamp_socket()
         print(f"RGB Timestamp UDP server listening on {self.host}:{self.rgb_ts_port}")
         threading.Thread(target=self.listen_for_rgb_ts_client, daemon=True).start()
 
@@ -132,8 +361,13 @@ class QuadOakStreamerWithIMU:
             try:
                 self.rgb_ts_socket.settimeout(1.0)
                 data, addr = self.rgb_ts_socket.recvfrom(1024)
-                if data == b'REGISTER_RGB_TS':
+                receive_mono = time.monotonic()
+                response = self.clock_sync.build_time_sync_response(data, receive_mono)
+                if response is not None:
+                    self.rgb_ts_socket.sendto(response, addr)
+                elif data == b'REGISTER_RGB_TS':
                     self.rgb_ts_client_address = addr
+                    self.record_rgb_ts_registration(addr)
                     print(f"RGB Timestamp client registered from {addr}")
                     self.rgb_ts_socket.sendto(b'RGB_TS_ACK', addr)
             except socket.timeout:
@@ -142,24 +376,229 @@ class QuadOakStreamerWithIMU:
                 if self.running:
                     print(f"Error in RGB TS listener: {e}")
 
-    def send_rgb_timestamp(self, sequence, timestamp):
-        if self.rgb_ts_client_address and self.rgb_ts_socket:
+    def start_profile_server(self):
+        # Local only: SimpleOakController forwards PROFILE commands here
+        self.profile_server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.profile_server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.profile_server_socket.bind(('127.0.0.1', self.profile_port))
+        self.profile_server_socket.listen(5)
+        print(f"Profile control server listening on 127.0.0.1:{self.profile_port}")
+        threading.Thread(target=self.accept_profile_commands, daemon=True).start()
+
+    def accept_profile_commands(self):
+        while self.running:
+            try:
+                self.profile_server_socket.settimeout(1.0)
+                client_socket, addr = self.profile_server_socket.accept()
+            except socket.timeout:
+                continue
+            except Exception as e:
+                if self.running:
+                    print(f"Error accepting profile command: {e}")
+                continue
+            try:
+                client_socket.settimeout(5.0)
+                command = json.loads(client_socket.recv(4096).decode())
+                response = self.handle_profile_command(command)
+            except Exception as e:
+                response = {"success": False, "message": f"Error: {str(e)}"}
+            try:
+                client_socket.sendall(json.dumps(response).encode())
+            except Exception:
+                pass
+            finally:
+                client_socket.close()
+
+    def handle_profile_command(self, command):
+        """
+        Profile commands (JSON, 'action' key):
+        - enable / disable: stage timers on or off
+        - stats: stage timings since last reset with per-frame budget, plus capture status
+        - capture: sampling profile for 'seconds' (default 10) in 'format'
+          ('collapsed' stacks or 'pstats'), written to /tmp
+
+        In multi-process mode every command also goes to the sender processes:
+        their stages are reported as '<group>/<stage>' next to the capture
+        process's own, and their captures are merged into the capture file.
+        """
+        if self.sender_control:
+            return self.handle_multiprocess_profile_command(command)
+        return self.handle_local_profile_command(command)
+
+    def handle_local_profile_command(self, command):
+        action = command.get('action')
+        if action == 'enable':
+            self.profiler.enable()
+            return {"success": True, "message": "Stage profiling enabled"}
+        if action == 'disable':
+            self.profiler.disable()
+            return {"success": True, "message": "Stage profiling disabled"}
+        if action == 'stats':
+            return {"success": True, "message": "Profile stats",
+                    "data": {"enabled": self.profiler.enabled,
+                             "frame_period_ms": 1000.0 / self.fps,
+                             "stages": self.profiler.snapshot(1.0 / self.fps, reset=False),
+                             "capture": self.capture_profiler.status()}}
+        if action == 'capture':
+            path = self.capture_profiler.start(command.get('seconds', 10), command.get('format', 'collapsed'))
+            return {"success": True, "message": f"Profile capture started, writing {path}"}
+        return {"success": False, "message": f"Unknown profile action: {action}"}
+
+    def handle_multiprocess_profile_command(self, command):
+        action = command.get('action')
+        groups = list(self.sender_control.pipes)
+        if action == 'capture':
+            seconds = command.get('seconds', 10)
+            fmt = command.get('format', 'collapsed')
+            path = self.capture_profiler.start(seconds, fmt)
+            parts = {group: f"{path}.{group}" for group in groups}
+            replies = self.sender_control.request(
+                {group: {'action': 'capture', 'seconds': seconds, 'format': fmt, 'path': parts[group]}
+                 for group in groups})
+            started = [group for group in groups if replies[group] and replies[group].get('success')]
+            self.capture_merge = {'path': path, 'processes': ['capture'] + started, 'merged': False}
+            threading.Thread(target=self.merge_profile_capture, args=(path, parts, fmt, float(seconds)),
+                             daemon=True).start()
+            return {"success": True, "message": f"Profile capture started in capture + {len(started)}/{len(groups)} "
+                                                f"sender processes, merging into {path}"}
+
+        response = self.handle_local_profile_command(command)
+        replies = self.sender_control.broadcast(command)
+        missing = [group for group in groups if replies[group] is None]
+        if action in ('enable', 'disable'):
+            failed = missing + [group for group in groups if replies[group] and not replies[group].get('success')]
+            response['success'] = response['success'] and not failed
+            response['message'] += f" (capture + {len(groups) - len(failed)}/{len(groups)} sender processes)"
+        elif action == 'stats' and response['success']:
+            data = response['data']
+            data['senders'] = {}
+            for group in groups:
+                reply = replies[group]
+                if not reply or not reply.get('success'):
+                    data['senders'][group] = None
+                    continue
+                data['senders'][group] = {'enabled': reply['data']['enabled'], 'capture': reply['data']['capture']}
+                for stage, stage_stats in reply['data']['stages'].items():
+                    data['stages'][f"{group}/{stage}"] = stage_stats
+            data['capture_merge'] = self.capture_merge
+        if missing:
+            response['message'] += f"; no answer from {', '.join(missing)}"
+        return response
+
+    def merge_profile_capture(self, path, parts, fmt, seconds):
+        """Wait for the capture and sender part files, then merge them into path."""
+        deadline = time.monotonic() + seconds + 10.0
+        pending = set(parts)
+        while time.monotonic() < deadline and self.running:
+            local_done = self.capture_profiler.active is None or self.capture_profiler.active['path'] != path
+            if pending:
+                replies = self.sender_control.broadcast({'action': 'stats'}) if self.sender_control else {}
+                for group in list(pending):
+                    reply = replies.get(group)
+                    last = reply and reply.get('success') and reply['data']['capture']['last_result']
+                    if last and last['path'] == parts[group]:
+                        pending.discard(group)
+            if local_done and not pending:
+                break
+            time.sleep(0.5)
+        merged = merge_capture_files(path, list(parts.values()), fmt)
+        self.capture_merge = dict(self.capture_merge or {}, merged=True, sender_files=merged,
+                                  missing=sorted(pending))
+        print(f"Profile capture merged into {path} (capture + {merged} sender processes)")
+
+    def clock_sync_loop(self):
+        while self.running:
             try:
-                binary_data = struct.pack('>IdI', sequence, timestamp, 0)
-                self.rgb_ts_socket.sendto(binary_data, self.rgb_ts_client_address)
+                self.clock_sync.sample_host_clocks()
+            except Exception as e:
+                print(f"Error sampling clocks: {e}")
+            time.sleep(0.1)
+
+    def record_latency(self, stream_name, frame_timestamp, dequeue_time, sent):
+        """Record sensor->dequeue and, if the frame was sent, dequeue->send (Pi monotonic)."""
+        tracker = self.latency_stats[stream_name]
+        tracker.record('sensor_to_dequeue', dequeue_time - self.clock_sync.wire_to_mono(frame_timestamp))
+        if sent:
+            tracker.record('dequeue_to_send', time.monotonic() - dequeue_time)
+
+    def record_rgb_ts_registration(self, addr):
+        now = time.monotonic()
+        table = self.rgb_ts_shared_registrations
+        if table is None:
+            self.rgb_ts_registrations[addr[0]] = [addr, now, 0]
+            self.rgb_ts_live_registration = addr[0]
+            return
+        ip = struct.unpack('>I', socket.inet_aton(addr[0]))[0]
+        slots = range(0, len(table), 4)
+        # Reuse the host's slot, else the oldest one
+        slot = next((i for i in slots if table[i + 2] and table[i] == ip), None)
+        if slot is None:
+            slot = min(slots, key=lambda i: table[i + 2])
+        table[slot + 2] = 0.0  # invalid while rewritten
+        table[slot] = ip
+        table[slot + 1] = addr[1]
+        table[slot + 3] = 0
+        table[slot + 2] = now
+        self.rgb_ts_live_registration = slot
+
+    def note_live_rgb_timestamp(self, sequence):
+        """Remember the first live timestamp sequence the current registration received."""
+        key = self.rgb_ts_live_registration
+        if key is None:
+            return
+        table = self.rgb_ts_shared_registrations
+        if table is None:
+            registration = self.rgb_ts_registrations.get(key)
+            if registration and not registration[2]:
+                registration[2] = sequence + 1
+        elif not table[key + 3]:
+            table[key + 3] = sequence + 1
+
+    def rgb_ts_registration_for(self, ip):
+        """
+        (address, registration time, first live sequence or None) of the latest
+        timestamp registration from ip, or None.
+        """
+        table = self.rgb_ts_shared_registrations
+        if table is None:
+            registration = self.rgb_ts_registrations.get(ip)
+            if registration is None:
+                return None
+            address, registered, first_live = registration
+            return address, registered, first_live - 1 if first_live else None
+        packed = struct.unpack('>I', socket.inet_aton(ip))[0]
+        for i in range(0, len(table), 4):
+            registered = table[i + 2]
+            if registered and table[i] == packed:
+                first_live = int(table[i + 3])
+                return (ip, int(table[i + 1])), registered, first_live - 1 if first_live else None
+        return None
+
+    def send_rgb_timestamp(self, sequence, timestamp, sensor_to_dequeue_us=0, address=None):
+        # Third field (formerly reserved, 0) carries sensor->dequeue latency in microseconds
+        live = address is None
+        address = address or self.rgb_ts_client_address
+        if address and self.rgb_ts_socket:
+            try:
+                binary_data = struct.pack('>IdI', sequence, timestamp, max(0, min(sensor_to_dequeue_us, 0xFFFFFFFF)))
+                self.rgb_ts_socket.sendto(binary_data, address)
+                if live:
+                    self.note_live_rgb_timestamp(sequence)
             except Exception as e:
                 print(f"Error sending RGB timestamp: {e}")
 
     def broadcast_frame_with_sequence(self, data, clients, stream_name, stats, sequence):
         disconnected = []
-        for client in clients:
-            try:
-                header = struct.pack('>II', sequence, len(data))
-                client.sendall(header + data)
-                stats['frames_sent'] += 1
-            except (socket.error, BrokenPipeError):
-                disconnected.append(client)
-                stats['frames_dropped'] += 1
+        with self.profiler.stage(self.SENDALL_STAGES[stream_name]):
+            for client in clients:
+                try:
+                    # data may be a numpy array (getData()), which does not concatenate with bytes
+                    client.sendall(struct.pack('>II', sequence, len(data)))
+                    client.sendall(data)
+                    stats['frames_sent'] += 1
+                except (socket.error, BrokenPipeError):
+                    disconnected.append(client)
+                    stats['frames_dropped'] += 1
         for client in disconnected:
             clients.remove(client)
             try:
@@ -167,6 +606,87 @@ class QuadOakStreamerWithIMU:
             except:
                 pass
 
+    def send_rgb_packet(self, data, sequence, timestamp, sensor_to_dequeue_us=0, send_timestamp=True):
+        """Cache one H.264 packet, send it to live clients and admit clients that joined since the last one."""
+        if self.gop_cache:
+            with self.profiler.stage('rgb.gop_cache'):
+                self.gop_cache.add(data, sequence, timestamp, sensor_to_dequeue_us)
+        # Pending clients get live timestamps too: from their registration on, the
+        # burst only has to fill in what came before
+        if self.use_rgb_timestamp_protocol and send_timestamp and (self.rgb_clients or self.rgb_pending_clients):
+            self.send_rgb_timestamp(sequence, timestamp, sensor_to_dequeue_us)
+        if self.rgb_clients:
+            if self.use_rgb_timestamp_protocol:
+                # New protocol: send timestamp via UDP, frame with sequence via TCP
+                self.broadcast_frame_with_sequence(data, self.rgb_clients, "RGB", self.rgb_stats, sequence)
+            else:
+                # Legacy protocol: just send frame
+                self.broadcast_frame(data, self.rgb_clients, "RGB", self.rgb_stats)
+        if self.rgb_pending_clients:
+            self.admit_rgb_clients()
+
+    def admit_rgb_clients(self):
+        """
+        Send pending RGB clients the cached GOP (SPS/PPS + IDR onwards, ending
+        with the packet just broadcast) and move them to the live list. With
+        no decodable GOP cached they keep waiting for the next IDR.
+
+        With the timestamp protocol the burst's UDP timestamps go only to the
+        address the joining client registered from (matched by its IP), never
+        to the live address, so existing clients get no duplicates. The
+        receiver registers right after its TCP connect, so the registration
+        is often recorded before the accept thread stamps connect_time; one
+        from up to RGB_TS_REGISTRATION_GRACE before the connect counts. A
+        client whose registration has not arrived yet waits up to
+        RGB_TS_REGISTRATION_GRACE for it.
+        """
+        burst = self.gop_cache.burst()
+        if not burst:
+            return
+        stats = self.rgb_join_stats
+        now = time.monotonic()
+        waiting = []
+        with self.profiler.stage('rgb.gop_burst'):
+            # Clients accepted meanwhile are appended behind these and handled next time
+            for _ in range(len(self.rgb_pending_clients)):
+                client, connect_time, peer_ip = self.rgb_pending_clients.pop(0)
+                if self.use_rgb_timestamp_protocol:
+                    registration = self.rgb_ts_registration_for(peer_ip)
+                    if (registration is None or registration[1] < connect_time - self.RGB_TS_REGISTRATION_GRACE) \
+                            and now - connect_time < self.RGB_TS_REGISTRATION_GRACE:
+                        waiting.append((client, connect_time, peer_ip))
+                        continue
+                    if registration is not None:
+                        # The new client missed these UDP timestamps; resend them for the burst
+                        # sequences it did not already get live since registering
+                        address, _, first_live = registration
+                        for sequence, timestamp, sensor_to_dequeue_us, _ in burst:
+                            if first_live is None or sequence < first_live:
+                                self.send_rgb_timestamp(sequence, timestamp, sensor_to_dequeue_us, address)
+                try:
+                    for sequence, _, _, packet in burst:
+                        if self.use_rgb_timestamp_protocol:
+                            client.sendall(struct.pack('>II', sequence, len(packet)) + packet)
+                        else:
+                            client.sendall(len(packet).to_bytes(4, byteorder='big') + packet)
+                except (socket.error, BrokenPipeError):
+                    print("RGB client disconnected during GOP burst")
+                    try:
+                        client.close()
+                    except:
+                        pass
+                    continue
+                ttfd_ms = (time.monotonic() - connect_time) * 1000
+                stats['joins'] += 1
+                stats['burst_frames'] += len(burst)
+                stats['last_ttfd_ms'] = ttfd_ms
+                stats['total_ttfd_ms'] += ttfd_ms
+                print(f"RGB client joined with {len(burst)}-frame GOP burst "
+                      f"({sum(len(entry[3]) for entry in burst) / 1024:.0f} KB), "
+                      f"first decodable frame after {ttfd_ms:.0f} ms")
+                self.rgb_clients.append(client)
+        self.rgb_pending_clients.extend(waiting)
+
     def accept_rgb_clients(self):
         while self.running:
             try:
@@ -175,7 +695,11 @@ class QuadOakStreamerWithIMU:
                 print(f"RGB client connected from {addr}")
                 client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
                 client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 65536)
-                self.rgb_clients.append(client_socket)
+                if self.gop_cache:
+                    # Joins the live stream once the streaming loop has sent it a decodable burst
+                    self.rgb_pending_clients.append((client_socket, time.monotonic(), addr[0]))
+                else:
+                    self.rgb_clients.append(client_socket)
             except socket.timeout:
                 continue
             except Exception as e:
@@ -229,15 +753,16 @@ class QuadOakStreamerWithIMU:
 
     def broadcast_frame(self, data, clients, stream_name, stats):
         disconnected = []
-        for client in clients:
-            try:
-                frame_size_bytes = len(data).to_bytes(4, byteorder='big')
-                client.sendall(frame_size_bytes)
-                client.sendall(data)
-                stats['frames_sent'] += 1
-            except (socket.error, BrokenPipeError):
-                disconnected.append(client)
-                stats['frames_dropped'] += 1
+        with self.profiler.stage(self.SENDALL_STAGES[stream_name]):
+            for client in clients:
+                try:
+                    frame_size_bytes = len(data).to_bytes(4, byteorder='big')
+                    client.sendall(frame_size_bytes)
+                    client.sendall(data)
+                    stats['frames_sent'] += 1
+                except (socket.error, BrokenPipeError):
+                    disconnected.append(client)
+                    stats['frames_dropped'] += 1
         for client in disconnected:
             print(f"{stream_name} client disconnected")
             clients.remove(client)
@@ -259,8 +784,9 @@ class QuadOakStreamerWithIMU:
         """
         disconnected = []
 
-        # Get raw 16-bit depth data for SLAM
-        depth_raw = depth_frame_obj.getFrame().astype(np.uint16)
+        # Get raw 16-bit depth data for SLAM (no copy if already contiguous uint16)
+        with self.profiler.stage('depth.getFrame'):
+            depth_raw = np.ascontiguousarray(depth_frame_obj.getFrame(), dtype=np.uint16)
 
         # Get hardware timestamp from DepthAI device (same clock as IMU)
         device_timestamp = depth_frame_obj.getTimestamp().total_seconds()
@@ -269,33 +795,34 @@ class QuadOakStreamerWithIMU:
         height, width = depth_raw.shape
         metadata = struct.pack('>IIIQ', width, height, depth_raw.dtype.itemsize, int(device_timestamp * 1000000))
 
-        # Combine metadata + raw depth for compression
-        uncompressed_data = metadata + depth_raw.tobytes()
-        original_size = len(uncompressed_data)
-
-        # Compress using zlib (lossless, fast, ~4-9x reduction)
-        compressed_data = zlib.compress(uncompressed_data, level=1)  # level 1 = fast compression
+        # Compress metadata + raw depth as one zlib stream, straight from the
+        # frame buffer (lossless, fast, ~4-9x reduction, level 1 = fast compression)
+        original_size = len(metadata) + depth_raw.nbytes
+        with self.profiler.stage('depth.compress'):
+            compressor = zlib.compressobj(level=1)
+            compressed_data = b''.join((compressor.compress(metadata), compressor.compress(depth_raw),
+                                        compressor.flush()))
 
-        # Create compressed payload: [MAGIC][original_size][compressed_data]
-        payload = struct.pack('>I', self.DEPTH_COMPRESSION_MAGIC) + struct.pack('>I', original_size) + compressed_data
+        # Frame size header + [MAGIC][original_size], followed by compressed_data
+        envelope = struct.pack('>III', 8 + len(compressed_data), self.DEPTH_COMPRESSION_MAGIC, original_size)
 
         # Send to all connected clients
-        for client in clients:
-            try:
-                # Send frame size header
-                frame_size_bytes = len(payload).to_bytes(4, byteorder='big')
-                client.sendall(frame_size_bytes)
+        with self.profiler.stage('depth.sendall'):
+            for client in clients:
+                try:
+                    # Send frame size header and compression envelope
+                    client.sendall(envelope)
 
-                # Send compressed payload
-                client.sendall(payload)
-                stats['frames_sent'] += 1
-            except (socket.error, BrokenPipeError):
-                disconnected.append(client)
-                stats['frames_dropped'] += 1
+                    # Send compressed payload
+                    client.sendall(compressed_data)
+                    stats['frames_sent'] += 1
+                except (socket.error, BrokenPipeError):
+                    disconnected.append(client)
+                    stats['frames_dropped'] += 1
 
         # Clean up disconnected clients
         for client in disconnected:
-            print(f"Depth client disconnected")
+            print("Depth client disconnected")
             clients.remove(client)
             try:
                 client.close()
@@ -321,7 +848,8 @@ class QuadOakStreamerWithIMU:
 
         try:
             # Get raw mono8 frame data (same API as depth frames)
-            frame_raw = frame_obj.getFrame()  # Returns numpy array (H, W) uint8
+            with self.profiler.stage(self.GET_FRAME_STAGES[stream_name]):
+                frame_raw = np.ascontiguousarray(frame_obj.getFrame())  # numpy array (H, W) uint8
 
             # Get hardware timestamp from DepthAI device (same clock as IMU/Depth)
             device_timestamp = frame_obj.getTimestamp().total_seconds()
@@ -331,8 +859,8 @@ class QuadOakStreamerWithIMU:
             height, width = frame_raw.shape
             metadata = struct.pack('>IIQ', width, height, timestamp_us)
 
-            # Create payload: metadata + raw frame data
-            payload = metadata + frame_raw.tobytes()
+            # Frame size header + metadata; raw frame data is sent from its own buffer
+            header = (len(metadata) + frame_raw.nbytes).to_bytes(4, byteorder='big') + metadata
         except Exception as e:
             print(f"Error creating {stream_name} stereo frame payload: {e}")
             print(f"Frame object type: {type(frame_obj)}")
@@ -340,18 +868,18 @@ class QuadOakStreamerWithIMU:
             return
 
         # Send to all connected clients
-        for client in clients:
-            try:
-                # Send frame size header
-                frame_size_bytes = len(payload).to_bytes(4, byteorder='big')
-                client.sendall(frame_size_bytes)
+        with self.profiler.stage(self.SENDALL_STAGES[stream_name]):
+            for client in clients:
+                try:
+                    # Send frame size header + metadata
+                    client.sendall(header)
 
-                # Send payload
-                client.sendall(payload)
-                stats['frames_sent'] += 1
-            except (socket.error, BrokenPipeError):
-                disconnected.append(client)
-                stats['frames_dropped'] += 1
+                    # Send raw frame data (no intermediate copy)
+                    client.sendall(frame_raw)
+                    stats['frames_sent'] += 1
+                except (socket.error, BrokenPipeError):
+                    disconnected.append(client)
+                    stats['frames_dropped'] += 1
 
         # Clean up disconnected clients
         for client in disconnected:
@@ -396,44 +924,72 @@ class QuadOakStreamerWithIMU:
 
             except Exception as e:
                 print(f"Error sending IMU data: {e}")
-    def run(self):
-        self.running = True
-        self.start_rgb_server()
-        self.start_left_server()
-        self.start_right_server()
-        self.start_depth_server()
-        self.start_imu_server()
-        if self.use_rgb_timestamp_protocol:
-            self.start_rgb_timestamp_server()
 
-        print(f"Setting up OAK-D Pro quad pipeline with depth and IMU:")
-        print(f"  RGB: {self.rgb_width}x{self.rgb_height} @ {self.fps}fps")
-        print(f"  Left: {self.mono_width}x{self.mono_height} @ {self.fps}fps")
-        print(f"  Right: {self.mono_width}x{self.mono_height} @ {self.fps}fps")
-        print(f"  Depth: {self.mono_width}x{self.mono_height} @ {self.fps}fps")
-        print(f"  IMU: Accelerometer + Gyroscope @ 100Hz")
+    def send_imu_preintegration(self, record):
+        """
+        Send one preintegrated IMU record covering a stereo inter-frame interval.
 
-        pipeline = dai.Pipeline()
+        Protocol (246 bytes, big-endian):
+        [4B magic][4B sequence][8B t_start_us][8B t_end_us][2B num_samples]
+        [16B delta_R quat (x, y, z, w)][12B delta_v][12B delta_p][180B covariance]
+
+        t_end_us equals the timestamp_us of the matching stereo frame header.
+        Covariance is the upper triangle (row-major, 45 floats) of the 9x9
+        covariance of [dtheta, dv, dp]. Gravity is not removed from dv/dp.
+        """
+        if self.imu_client_address and self.imu_socket:
+            try:
+                quat = rotation_to_quaternion(record['delta_R'])
+                cov_upper = record['covariance'][np.triu_indices(9)]
+                binary_data = struct.pack(
+                    '>IIQQH4f3f3f45f',
+                    self.IMU_PREINT_MAGIC,
+                    self.imu_preint_sequence,
+                    int(record['t_start'] * 1000000),
+                    int(record['t_end'] * 1000000),
+                    record['num_samples'],
+                    *quat,
+                    *record['delta_v'],
+                    *record['delta_p'],
+                    *cov_upper
+                )
+                self.imu_socket.sendto(binary_data, self.imu_client_address)
+                self.imu_stats['preint_sent'] += 1
+                self.imu_preint_sequence += 1
+            except Exception as e:
+                print(f"Error sending IMU preintegration: {e}")
+
+    def build_pipeline(self):
+        """Build the device pipeline; returns it with the RGB, Left, Right, Depth and IMU output queues."""
+        if self.simulate:
+            pipeline = SimulatedPipeline(self.fps, self.mono_width, self.mono_height)
+            if self.use_demand_driven:
+                self.setup_demand(pipeline.control_queues(), pipeline.queues())
+            return pipeline, pipeline.queues()
+
+        pipeline = dai.Pipeline(self.open_device()) if self.device_id else dai.Pipeline()
 
         # RGB Camera
         camRgb = pipeline.create(dai.node.ColorCamera)
         camRgb.setBoardSocket(dai.CameraBoardSocket.CAM_A)
         camRgb.setResolution(dai.ColorCameraProperties.SensorResolution.THE_1080_P)
         # Use ISP scaling instead of cropping to maintain full FOV (66° HFOV)
-        # 1920×1080 → 1280×720: scale by 2/3 (maintains aspect ratio and FOV)
-        camRgb.setIspScale(2, 3)  # numerator=2, denominator=3 (downscale factor)
-        camRgb.setVideoSize(1280, 720)
+        # e.g. 1920×1080 → 1280×720: scale by 2/3 (maintains aspect ratio and FOV);
+        # other aspect ratios are scaled to cover and center-cropped by the video size
+        camRgb.setIspScale(*self.rgb_isp_scale)
+        camRgb.setVideoSize(self.rgb_width, self.rgb_height)
         camRgb.setFps(self.fps)
 
         # Mono cameras
+        mono_resolution = getattr(dai.MonoCameraProperties.SensorResolution, self.mono_resolution)
         monoLeft = pipeline.create(dai.node.MonoCamera)
         monoLeft.setBoardSocket(dai.CameraBoardSocket.CAM_B)
-        monoLeft.setResolution(dai.MonoCameraProperties.SensorResolution.THE_720_P)
+        monoLeft.setResolution(mono_resolution)
         monoLeft.setFps(self.fps)
 
         monoRight = pipeline.create(dai.node.MonoCamera)
         monoRight.setBoardSocket(dai.CameraBoardSocket.CAM_C)
-        monoRight.setResolution(dai.MonoCameraProperties.SensorResolution.THE_720_P)
+        monoRight.setResolution(mono_resolution)
         monoRight.setFps(self.fps)
 
         # Depth node - manual config for full 720p
@@ -447,7 +1003,7 @@ class QuadOakStreamerWithIMU:
         # This ensures depth matches RGB perspective and intrinsics
         stereoDepth.setDepthAlign(dai.CameraBoardSocket.CAM_A)
         # Explicitly set output to full input resolution
-        stereoDepth.setOutputSize(1280, 720)
+        stereoDepth.setOutputSize(self.mono_width, self.mono_height)
         stereoDepth.setOutputKeepAspectRatio(False)
         monoLeft.out.link(stereoDepth.left)
         monoRight.out.link(stereoDepth.right)
@@ -483,12 +1039,85 @@ class QuadOakStreamerWithIMU:
         depthQueue = stereoDepth.depth.createOutputQueue(maxSize=4, blocking=False)
         imuQueue = imu.out.createOutputQueue(maxSize=50, blocking=False)
 
+        # Camera control inputs for demand-driven start/stop
+        if self.use_demand_driven:
+            self.setup_demand((camRgb.inputControl.createInputQueue(),
+                               monoLeft.inputControl.createInputQueue(),
+                               monoRight.inputControl.createInputQueue()),
+                              (rgbQueue, leftQueue, rightQueue, depthQueue, imuQueue))
+
+        return pipeline, (rgbQueue, leftQueue, rightQueue, depthQueue, imuQueue)
+
+    def setup_demand(self, control_queues, output_queues):
+        """Demand scheduler driving the RGB, Left and Right camera control queues."""
+        rgbControlQueue, leftControlQueue, rightControlQueue = control_queues
+        rgbQueue, leftQueue, rightQueue, depthQueue, _ = output_queues
+        self.camera_control_queues = [rgbControlQueue, leftControlQueue, rightControlQueue]
+
+        def stop_rgb():
+            self._set_streaming([rgbControlQueue], [], False)
+            # Clients joining after the pause must not get the GOP (and timestamps) from before it
+            if self.gop_cache:
+                self.gop_cache.invalidate()
+
+        self.demand = DemandScheduler({
+            'rgb': (lambda: self._set_streaming([rgbControlQueue], [rgbQueue], True), stop_rgb),
+            'stereo': (lambda: self._set_streaming([leftControlQueue, rightControlQueue],
+                                                   [leftQueue, rightQueue, depthQueue], True),
+                       lambda: self._set_streaming([leftControlQueue, rightControlQueue], [], False)),
+        }, linger=self.demand_linger)
+
+    def run(self):
+        self.running = True
+        if self.use_multiprocess:
+            # Fork senders first, before this process starts any threads
+            self.start_sender_processes()
+        else:
+            self.start_rgb_server()
+            self.start_left_server()
+            self.start_right_server()
+            self.start_depth_server()
+            if self.use_local_shm:
+                # The servers above hold the ports, so no other streamer owns these ring names
+                self.local_rings = multiprocess_streamer.StreamRings(
+                    self.rgb_port, self.mono_width, self.mono_height, self.mono_width, self.mono_height,
+                    replace=True)
+        if self.use_local_shm:
+            print("Local shared-memory rings: " + ", ".join((self.local_rings or self.stream_rings).names.values()))
+        self.start_imu_server()
+        # Timestamp port always runs: it also serves the clock sync exchange
+        self.start_rgb_timestamp_server()
+        threading.Thread(target=self.clock_sync_loop, daemon=True).start()
+        self.start_profile_server()
+        if self.use_imu_preintegration:
+            self.imu_preintegrator = ImuPreintegrator()
+
+        print("Setting up OAK-D Pro quad pipeline with depth and IMU:")
+        if self.simulate:
+            print(f"  Device: simulated ({self.device_id or 'default'})")
+        elif self.device_id:
+            print(f"  Device: {self.device_id}")
+        print(f"  RGB: {self.rgb_width}x{self.rgb_height} @ {self.fps}fps")
+        print(f"  Left: {self.mono_width}x{self.mono_height} @ {self.fps}fps")
+        print(f"  Right: {self.mono_width}x{self.mono_height} @ {self.fps}fps")
+        print(f"  Depth: {self.mono_width}x{self.mono_height} @ {self.fps}fps")
+        print("  IMU: Accelerometer + Gyroscope @ 100Hz")
+        if self.imu_preintegrator:
+            print("  IMU preintegration: per left stereo frame")
+
+        pipeline, (rgbQueue, leftQueue, rightQueue, depthQueue, imuQueue) = self.build_pipeline()
+
         print("Starting OAK-D Pro device...")
 
         try:
             pipeline.start()
             with pipeline:
                 print("Quad streaming with IMU started. Press Ctrl+C to stop.")
+                if self.demand:
+                    # Cameras idle until the first client of one of their streams connects
+                    self._set_streaming(self.camera_control_queues, [], False)
+                    print("Demand-driven mode: cameras start when clients connect")
+                    last_demand_time = 0.0
 
                 rgb_frame_count = 0
                 left_frame_count = 0
@@ -498,54 +1127,140 @@ class QuadOakStreamerWithIMU:
                 start_time = time.time()
                 last_stats_time = start_time
 
+                prof = self.profiler
                 while pipeline.isRunning() and self.running:
                     try:
+                        # Drives cProfile captures, which must run in this thread
+                        self.capture_profiler.poll()
+
+                        # Start/stop producers following client demand
+                        if self.demand and time.monotonic() - last_demand_time >= 0.05:
+                            last_demand_time = time.monotonic()
+                            forced = ('stereo',) if self.imu_preintegrator and self.imu_client_address else ()
+                            self.demand.update({name: self.client_count(name) + self.has_local_reader(name)
+                                                for name in ('RGB', 'Left', 'Right', 'Depth')},
+                                               forced, last_demand_time)
+
                         # RGB H.264 stream
                         if rgbQueue.has():
-                            h264Packet = rgbQueue.get()
+                            with prof.stage('rgb.get'):
+                                h264Packet = rgbQueue.get()
+                            dequeue_time = time.monotonic()
+                            timestamp = h264Packet.getTimestamp().total_seconds()
+                            if self.demand:
+                                self.demand.frame_arrived('rgb', self.clock_sync.wire_to_mono(timestamp), dequeue_time)
                             data = h264Packet.getData()
-                            if self.rgb_clients:
+                            # Every packet gets a sequence: cached packets keep theirs for late joiners
+                            current_seq = self.rgb_sequence
+                            self.rgb_sequence += 1
+                            sensor_to_dequeue_us = int((dequeue_time - self.clock_sync.wire_to_mono(timestamp)) * 1000000)
+                            local = self.has_local_reader("RGB")
+                            if self.stream_rings:
+                                # Senders broadcast from the ring with this same sequence; their
+                                # GOP cache needs every packet, readers or not
+                                sent = bool(self.gop_cache_bytes or local or self.client_count("RGB"))
                                 if self.use_rgb_timestamp_protocol:
-                                    # New protocol: send timestamp via UDP, frame with sequence via TCP
-                                    # CRITICAL: Capture sequence BEFORE sending to ensure both use same sequence
-                                    current_seq = self.rgb_sequence
-                                    timestamp = h264Packet.getTimestamp().total_seconds()
-                                    self.send_rgb_timestamp(current_seq, timestamp)
-                                    self.broadcast_frame_with_sequence(data, self.rgb_clients, "RGB", self.rgb_stats, current_seq)
-                                    self.rgb_sequence += 1
-                                else:
-                                    # Legacy protocol: just send frame
-                                    self.broadcast_frame(data, self.rgb_clients, "RGB", self.rgb_stats)
+                                    self.send_rgb_timestamp(current_seq, timestamp, sensor_to_dequeue_us)
+                                if sent:
+                                    with prof.stage('rgb.ring_write'):
+                                        self.stream_rings.write_packet("RGB", data, timestamp, current_seq)
+                            else:
+                                self.send_rgb_packet(data, current_seq, timestamp, sensor_to_dequeue_us)
+                                if local:
+                                    with prof.stage('rgb.local_write'):
+                                        self.local_rings.write_packet("RGB", data, timestamp, current_seq)
+                                sent = bool(local or self.rgb_clients)
+                            self.record_latency("RGB", timestamp, dequeue_time, sent)
                             rgb_frame_count += 1
 
                         # Left raw mono8 stream (for SLAM)
                         if leftQueue.has():
-                            leftFrame = leftQueue.get()
-                            if self.left_clients:
+                            with prof.stage('left.get'):
+                                leftFrame = leftQueue.get()
+                            dequeue_time = time.monotonic()
+                            timestamp = leftFrame.getTimestamp().total_seconds()
+                            if self.demand:
+                                self.demand.frame_arrived('stereo', self.clock_sync.wire_to_mono(timestamp), dequeue_time)
+                            self.clock_sync.observe_frame(leftFrame)
+                            if self.imu_preintegrator:
+                                self.imu_preintegrator.add_frame(timestamp)
+                            local = self.has_local_reader("Left")
+                            sent = bool(local or self.client_count("Left"))
+                            if self.stream_rings:
+                                if sent:
+                                    with prof.stage('left.ring_write'):
+                                        self.stream_rings.write_frame("Left", leftFrame.getFrame(), timestamp)
+                            elif self.left_clients:
                                 self.broadcast_stereo_frame(leftFrame, self.left_clients, "Left", self.left_stats)
+                            if self.local_rings and local:
+                                with prof.stage('left.local_write'):
+                                    self.local_rings.write_frame("Left", leftFrame.getFrame(), timestamp)
+                            self.record_latency("Left", timestamp, dequeue_time, sent)
                             left_frame_count += 1
 
                         # Right raw mono8 stream (for SLAM)
                         if rightQueue.has():
-                            rightFrame = rightQueue.get()
-                            if self.right_clients:
+                            with prof.stage('right.get'):
+                                rightFrame = rightQueue.get()
+                            dequeue_time = time.monotonic()
+                            timestamp = rightFrame.getTimestamp().total_seconds()
+                            if self.demand:
+                                self.demand.frame_arrived('stereo', self.clock_sync.wire_to_mono(timestamp), dequeue_time)
+                            local = self.has_local_reader("Right")
+                            sent = bool(local or self.client_count("Right"))
+                            if self.stream_rings:
+                                if sent:
+                                    with prof.stage('right.ring_write'):
+                                        self.stream_rings.write_frame("Right", rightFrame.getFrame(), timestamp)
+                            elif self.right_clients:
                                 self.broadcast_stereo_frame(rightFrame, self.right_clients, "Right", self.right_stats)
+                            if self.local_rings and local:
+                                with prof.stage('right.local_write'):
+                                    self.local_rings.write_frame("Right", rightFrame.getFrame(), timestamp)
+                            self.record_latency("Right", timestamp, dequeue_time, sent)
                             right_frame_count += 1
 
                         # Depth raw stream (converted to JPEG)
                         if depthQueue.has():
-                            depthFrameObj = depthQueue.get()
-                            if self.depth_clients:
+                            with prof.stage('depth.get'):
+                                depthFrameObj = depthQueue.get()
+                            dequeue_time = time.monotonic()
+                            timestamp = depthFrameObj.getTimestamp().total_seconds()
+                            if self.demand:
+                                self.demand.frame_arrived('stereo', self.clock_sync.wire_to_mono(timestamp), dequeue_time)
+                            local = self.has_local_reader("Depth")
+                            sent = bool(local or self.client_count("Depth"))
+                            if self.stream_rings:
+                                if sent:
+                                    with prof.stage('depth.ring_write'):
+                                        self.stream_rings.write_frame("Depth", depthFrameObj.getFrame(), timestamp)
+                            elif self.depth_clients:
                                 self.broadcast_depth_frame(depthFrameObj, self.depth_clients, self.depth_stats)
+                            if self.local_rings and local:
+                                # Raw uint16: local readers skip the zlib round trip
+                                with prof.stage('depth.local_write'):
+                                    self.local_rings.write_frame("Depth", depthFrameObj.getFrame(), timestamp)
+                            self.record_latency("Depth", timestamp, dequeue_time, sent)
                             depth_frame_count += 1
 
                         # IMU data stream
                         if imuQueue.has():
-                            imuData = imuQueue.get()
-                            imuPackets = imuData.packets
-                            for imuPacket in imuPackets:
-                                self.send_imu_data(imuPacket)
-                                imu_packet_count += 1
+                            with prof.stage('imu.get'):
+                                imuData = imuQueue.get()
+                                imuPackets = imuData.packets
+                            with prof.stage('imu.send'):
+                                for imuPacket in imuPackets:
+                                    self.send_imu_data(imuPacket)
+                                    imu_packet_count += 1
+                            if self.imu_preintegrator:
+                                with prof.stage('imu.preintegrate'):
+                                    self.imu_preintegrator.add_packets(imuPackets)
+
+                        # Preintegrated IMU deltas for every frame interval now covered by IMU data
+                        if self.imu_preintegrator:
+                            with prof.stage('imu.preintegrate'):
+                                for record in self.imu_preintegrator.pop_ready():
+                                    self.send_imu_preintegration(record)
 
                         current_time = time.time()
                         if current_time - last_stats_time >= 2.0:
@@ -562,11 +1277,56 @@ class QuadOakStreamerWithIMU:
                             self.depth_stats['last_fps'] = depth_fps
                             self.imu_stats['last_rate'] = imu_rate
 
-                            print(f"RGB: {rgb_fps:.1f} fps ({len(self.rgb_clients)} clients) | "
-                                  f"Left: {left_fps:.1f} fps ({len(self.left_clients)} clients) | "
-                                  f"Right: {right_fps:.1f} fps ({len(self.right_clients)} clients) | "
-                                  f"Depth: {depth_fps:.1f} fps ({len(self.depth_clients)} clients) | "
-                                  f"IMU: {imu_rate:.1f} Hz")
+                            if self.stream_rings:
+                                # Client counts are reported by the sender processes
+                                print(f"Capture -> rings | RGB: {rgb_fps:.1f} fps | Left: {left_fps:.1f} fps | "
+                                      f"Right: {right_fps:.1f} fps | Depth: {depth_fps:.1f} fps | "
+                                      f"IMU: {imu_rate:.1f} Hz")
+                            else:
+                                print(f"RGB: {rgb_fps:.1f} fps ({len(self.rgb_clients)} clients) | "
+                                      f"Left: {left_fps:.1f} fps ({len(self.left_clients)} clients) | "
+                                      f"Right: {right_fps:.1f} fps ({len(self.right_clients)} clients) | "
+                                      f"Depth: {depth_fps:.1f} fps ({len(self.depth_clients)} clients) | "
+                                      f"IMU: {imu_rate:.1f} Hz")
+
+                            # Per-stage latency (ms, mean/max over the interval)
+                            latency_parts = []
+                            for name, tracker in self.latency_stats.items():
+                                stages = tracker.snapshot()
+                                if 'sensor_to_dequeue' in stages:
+                                    part = f"{name} {stages['sensor_to_dequeue'][0]:.1f}/{stages['sensor_to_dequeue'][1]:.1f}"
+                                    if 'dequeue_to_send' in stages:
+                                        part += f" +{stages['dequeue_to_send'][0]:.1f}/{stages['dequeue_to_send'][1]:.1f}"
+                                    latency_parts.append(part)
+                            if latency_parts:
+                                print(f"  Latency ms (sensor->dequeue +dequeue->send, mean/max): {' | '.join(latency_parts)}")
+
+                            clock = self.clock_sync.stats()
+                            print(f"  Clock: wire->mono {clock['wire_to_monotonic']['offset_s'] * 1000:.3f} ms "
+                                  f"({clock['wire_to_monotonic']['drift_ppm']:.2f} ppm, "
+                                  f"jitter {clock['wire_to_monotonic']['jitter_std_us']:.1f} us) | "
+                                  f"device drift {clock['device_to_wire']['drift_ppm']:.2f} ppm "
+                                  f"(jitter {clock['device_to_wire']['jitter_std_us']:.1f} us)")
+
+                            if self.gop_cache and not self.stream_rings:
+                                join = self.rgb_join_stats
+                                cache = self.gop_cache.stats
+                                print(f"  RGB GOP cache: {len(self.gop_cache.entries)} frames "
+                                      f"{self.gop_cache.size / 1024:.0f} KB (max {cache['max_gop_bytes'] / 1024:.0f} KB, "
+                                      f"{cache['overflows']} overflows) | {join['joins']} late joins, "
+                                      f"time to first decodable frame last {join['last_ttfd_ms']:.0f} ms "
+                                      f"mean {join['total_ttfd_ms'] / join['joins'] if join['joins'] else 0:.0f} ms")
+
+                            if self.demand:
+                                print(f"  Demand: {self.demand.summary()}")
+
+                            # Stage profile (only while enabled over the profile port)
+                            if prof.enabled:
+                                stages = prof.snapshot(1.0 / self.fps)
+                                busiest = sorted(stages.items(), key=lambda item: item[1]['load_pct'], reverse=True)
+                                print("  Profile (mean ms, % of frame budget, % load): " + " | ".join(
+                                    f"{name} {st['mean_ms']:.2f} {st['budget_pct']:.0f}% {st['load_pct']:.0f}%"
+                                    for name, st in busiest[:8]))
                             last_stats_time = current_time
 
                         else:
@@ -587,13 +1347,26 @@ class QuadOakStreamerWithIMU:
     def shutdown(self):
         print("\nShutting down quad streamer with IMU...")
         self.running = False
-        for clients in [self.rgb_clients, self.left_clients, self.right_clients, self.depth_clients]:
+        if self.sender_processes:
+            multiprocess_streamer.stop_sender_processes(self.sender_processes, self.sender_stop_event)
+            self.sender_processes = []
+        if self.sender_control:
+            self.sender_control.close()
+            self.sender_control = None
+        if self.stream_rings:
+            self.stream_rings.close()
+            self.stream_rings = None
+        if self.local_rings:
+            self.local_rings.close()
+            self.local_rings = None
+        for clients in [self.rgb_clients, [client for client, _, _ in self.rgb_pending_clients],
+                        self.left_clients, self.right_clients, self.depth_clients]:
             for client in clients:
                 try:
                     client.close()
                 except:
                     pass
-        for socket_obj in [self.rgb_server_socket, self.left_server_socket, self.right_server_socket, self.depth_server_socket, self.imu_socket, self.rgb_ts_socket]:
+        for socket_obj in [self.rgb_server_socket, self.left_server_socket, self.right_server_socket, self.depth_server_socket, self.imu_socket, self.rgb_ts_socket, self.profile_server_socket]:
             if socket_obj:
                 try:
                     socket_obj.close()
@@ -606,11 +1379,82 @@ if __name__ == "__main__":
     parser.add_argument('--fps', type=int, default=30, help='FPS (default: 30)')
     parser.add_argument('--use-rgb-timestamp-protocol', action='store_true',
                         help='Enable RGB timestamp protocol (UDP timestamps + TCP frames with sequence numbers)')
+    parser.add_argument('--imu-preintegration', action='store_true',
+                        help='Publish per-frame preintegrated IMU deltas (IMUP) alongside the raw IMU stream')
+    parser.add_argument('--profile-port', type=int, default=5006,
+                        help='Local port for runtime profiling commands (default: 5006)')
+    parser.add_argument('--on-demand', action='store_true',
+                        help='Only stream cameras while their streams have clients')
+    parser.add_argument('--demand-linger', type=float, default=2.0,
+                        help='Seconds a producer keeps running after its last client leaves (default: 2.0)')
+    parser.add_argument('--multiprocess', action='store_true',
+                        help='Capture in this process, send from per-group processes via shared-memory rings')
+    parser.add_argument('--sender-groups', nargs='+', default=None, metavar='NAME=STREAM[,STREAM]',
+                        help='Sender process groups (default: rgb=RGB stereo=Left,Right depth=Depth)')
+    parser.add_argument('--cpu-affinity', nargs='+', default=None, metavar='NAME=CPU[,CPU]',
+                        help='Pin processes to cores, e.g. capture=0 rgb=1 stereo=2 depth=3')
+    parser.add_argument('--gop-cache-mb', type=float, default=8.0,
+                        help='Byte bound of the RGB GOP cache sent to late-joining clients; 0 disables (default: 8)')
+    parser.add_argument('--local-shm', action='store_true',
+                        help='Also publish every stream to shared-memory rings for readers on this host')
+    parser.add_argument('--device-id', default=None, help='MxID of the OAK device to open (default: first available)')
+    parser.add_argument('--list-devices', action='store_true', help='Print available devices as JSON and exit')
+    parser.add_argument('--simulate', action='store_true', help='Stream synthetic frames instead of opening a device')
+    parser.add_argument('--simulate-devices', type=int, default=0, metavar='N',
+                        help='With --list-devices: list N simulated devices instead of real ones')
+    parser.add_argument('--rgb-port', type=int, default=5000, help='RGB TCP port (default: 5000)')
+    parser.add_argument('--left-port', type=int, default=5001, help='Left TCP port (default: 5001)')
+    parser.add_argument('--right-port', type=int, default=5002, help='Right TCP port (default: 5002)')
+    parser.add_argument('--depth-port', type=int, default=5003, help='Depth TCP port (default: 5003)')
+    parser.add_argument('--imu-port', type=int, default=5004, help='IMU UDP port (default: 5004)')
+    parser.add_argument('--rgb-timestamp-port', type=int, default=5005, help='RGB timestamp UDP port (default: 5005)')
+    parser.add_argument('--rgb-resolution', default='1280x720', metavar='WxH', help='RGB resolution (default: 1280x720)')
+    parser.add_argument('--mono-resolution', default='1280x720', metavar='WxH', help='Mono/depth resolution (default: 1280x720)')
     args = parser.parse_args()
 
-    streamer = QuadOakStreamerWithIMU(fps=args.fps)
+    if args.list_devices:
+        if args.simulate_devices:
+            devices = list_simulated_devices(args.simulate_devices)
+        else:
+            devices = QuadOakStreamerWithIMU.list_available_devices()
+        print(json.dumps(devices))
+        sys.exit(0)
+
+    try:
+        rgb_width, rgb_height = (int(v) for v in args.rgb_resolution.lower().split('x'))
+        mono_width, mono_height = (int(v) for v in args.mono_resolution.lower().split('x'))
+        QuadOakStreamerWithIMU.rgb_isp_scale_for(rgb_width, rgb_height)
+        QuadOakStreamerWithIMU.mono_resolution_for(mono_width, mono_height)
+    except ValueError as e:
+        parser.error(f"Invalid resolution: {e}")
+    streamer = QuadOakStreamerWithIMU(rgb_port=args.rgb_port, left_port=args.left_port, right_port=args.right_port,
+                                      depth_port=args.depth_port, imu_port=args.imu_port,
+                                      rgb_width=rgb_width, rgb_height=rgb_height,
+                                      mono_width=mono_width, mono_height=mono_height, fps=args.fps,
+                                      rgb_ts_port=args.rgb_timestamp_port, profile_port=args.profile_port,
+                                      device_id=args.device_id, simulate=args.simulate,
+                                      gop_cache_bytes=int(args.gop_cache_mb * 1024 * 1024))
     if args.use_rgb_timestamp_protocol:
         streamer.use_rgb_timestamp_protocol = True
+    if args.imu_preintegration:
+        streamer.use_imu_preintegration = True
+    if args.on_demand:
+        streamer.use_demand_driven = True
+        streamer.demand_linger = args.demand_linger
+    if args.multiprocess:
+        streamer.use_multiprocess = True
+        streamer.sender_groups = multiprocess_streamer.parse_sender_groups(args.sender_groups)
+    if args.local_shm:
+        streamer.use_local_shm = True
+    if args.cpu_affinity:
+        streamer.cpu_affinity = multiprocess_streamer.parse_cpu_affinity(args.cpu_affinity)
+    def handle_sigterm(signum, frame):
+        # The controller stops streamers with SIGTERM: shut down cleanly so shared-memory rings are released.
+        # Further SIGTERMs are ignored so a repeated stop cannot interrupt the shutdown itself.
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, handle_sigterm)
     try:
         streamer.run()
     except KeyboardInterrupt:
@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+"""
+Single-writer, multi-reader frame ring in multiprocessing.shared_memory.
+
+Layout (all fields little-endian uint64 unless noted):
+
+    Ring header (64 bytes)
+        [0] magic/version  [1] slot_count  [2] slot_capacity  [3] write_seq
+        [4] closed (set by the writer before it unlinks the block)
+        [5] instance id (random, tells a re-created ring from the old one)
+        [6] reader heartbeat (float64, time.monotonic() of the latest
+            heartbeat from an attached reader; 0 if none)
+    Slot i (64-byte header + slot_capacity bytes of data)
+        [0] seqlock        [1] sequence    [2] payload_size   [3] width
+        [4] height         [5] itemsize    [6] timestamp (float64, seconds)
+        [7] reserved
+
+Frame n goes to slot n % slot_count. The writer marks the slot seqlock odd
+(2n+1) while it writes and even (2n+2) once the frame is complete, then
+publishes write_seq = n+1. The writer never waits for readers: a reader that
+falls more than slot_count-1 frames behind skips ahead (counted as dropped),
+and a reader can check after using a slot view whether the writer lapped it
+meanwhile (torn). Readers get views straight into shared memory, no copies.
+
+A view is only safe while the reader keeps up; anything that may block for
+longer than a lap (a sendall to a stalled client) must work from a private
+copy instead. RingReader.poll_copy copies the slot into a caller buffer and
+validates the seqlock afterwards, so a copy it returns is never torn.
+
+Python offers no memory fences, so ordering relies on the stores above being
+separate aligned 8-byte writes; readers validate with the seqlock on both
+sides of every access, and rings should have enough slots that a lap takes
+far longer than a reader needs to consume a frame.
+
+There is no cross-process wakeup: readers wait by polling write_seq
+(RingReader.wait), which is one shared-memory load per check.
+
+Readers that announce themselves (RingReader(heartbeat=True)) refresh the
+heartbeat field while they poll, so the writer can tell whether anyone is
+attached (has_readers) and skip writing, or stop producing, when nobody is.
+time.monotonic() is system-wide, so the field compares across processes.
+"""
+import atexit
+import os
+import sys
+import time
+from datetime import timedelta
+from multiprocessing import shared_memory
+
+import numpy as np
+
+RING_MAGIC = 0x52494E4701  # "RING" + version 1
+RING_HEADER_SIZE = 64
+SLOT_HEADER_SIZE = 64
+
+_DTYPES = {1: np.uint8, 2: np.uint16}
+
+READER_HEARTBEAT_INTERVAL = 0.25  # seconds between heartbeats of a polling reader
+READER_TIMEOUT = 1.0  # a reader without a heartbeat for this long counts as gone
+
+# Blocks whose close() hit frame views the caller still holds; closed as soon as they are released
+_deferred_close = []
+
+
+def _align64(n):
+    return (n + 63) & ~63
+
+
+def local_ring_name(rgb_port, stream):
+    """Well-known ring name for same-host readers; streamers are told apart by their RGB port."""
+    return f"oak_{rgb_port}_{stream.lower()}"
+
+
+def _close_deferred():
+    for shm in list(_deferred_close):
+        try:
+            shm.close()
+        except BufferError:
+            continue
+        _deferred_close.remove(shm)
+
+
+atexit.register(_close_deferred)
+
+
+class _RingMemory(shared_memory.SharedMemory):
+    """SharedMemory whose finalizer tolerates frame views a caller still holds at exit."""
+
+    def __del__(self):
+        try:
+            self.close()
+        except (OSError, BufferError):
+            pass
+
+
+class SharedFrameRing:
+    """Ring of fixed-capacity frame slots in a named shared memory block."""
+
+    def __init__(self, shm, owner):
+        self.shm = shm
+        self.owner = owner
+        self.name = shm.name
+        self._header = np.ndarray((8,), dtype=np.uint64, buffer=shm.buf)
+        self._heartbeat = np.ndarray((1,), dtype=np.float64, buffer=shm.buf, offset=48)
+        if int(self._header[0]) != RING_MAGIC:
+            raise ValueError(f"Shared memory block {shm.name} is not a frame ring")
+        self.slot_count = int(self._header[1])
+        self.slot_capacity = int(self._header[2])
+        self._stride = SLOT_HEADER_SIZE + _align64(self.slot_capacity)
+
+        self._meta = []
+        self._timestamps = []
+        self._data = []
+        for i in range(self.slot_count):
+            base = RING_HEADER_SIZE + i * self._stride
+            self._meta.append(np.ndarray((8,), dtype=np.uint64, buffer=shm.buf, offset=base))
+            self._timestamps.append(np.ndarray((1,), dtype=np.float64, buffer=shm.buf, offset=base + 48))
+            self._data.append(shm.buf[base + SLOT_HEADER_SIZE:base + SLOT_HEADER_SIZE + self.slot_capacity])
+
+    @classmethod
+    def create(cls, name, slot_count, slot_capacity, replace=False):
+        """
+        Create a ring. With replace=True a block left behind under the same
+        name (writer crashed) is marked closed for its readers and unlinked.
+        """
+        size = RING_HEADER_SIZE + slot_count * (SLOT_HEADER_SIZE + _align64(slot_capacity))
+        try:
+            shm = _RingMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            if not replace:
+                raise
+            stale = _RingMemory(name=name)
+            if stale.size >= RING_HEADER_SIZE:
+                header = np.ndarray((8,), dtype=np.uint64, buffer=stale.buf)
+                header[4] = 1
+                del header
+            stale.close()
+            stale.unlink()
+            shm = _RingMemory(name=name, create=True, size=size)
+        header = np.ndarray((8,), dtype=np.uint64, buffer=shm.buf)
+        header[:] = 0
+        header[1] = slot_count
+        header[2] = slot_capacity
+        header[5] = int.from_bytes(os.urandom(8), 'little')
+        header[0] = RING_MAGIC
+        del header
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name, untrack=True):
+        """
+        Attach to an existing ring. Processes forked from the creator share
+        its resource tracker and must pass untrack=False.
+        """
+        # Attaching registers the block with this process's resource
+        # tracker, which would unlink it when we exit; only the creator
+        # owns the block.
+        if untrack and sys.version_info >= (3, 13):
+            return cls(_RingMemory(name=name, track=False), owner=False)
+        shm = _RingMemory(name=name)
+        if untrack and os.name == 'posix':
+            try:
+                from multiprocessing import resource_tracker
+                # Registered under the POSIX name, which is the block name with a leading slash
+                resource_tracker.unregister('/' + shm.name, 'shared_memory')
+            except Exception:
+                pass
+        return cls(shm, owner=False)
+
+    @property
+    def write_seq(self):
+        return int(self._header[3])
+
+    @property
+    def instance_id(self):
+        return int(self._header[5])
+
+    @property
+    def closed(self):
+        """True once the writer has shut down; readers should re-attach by name."""
+        return int(self._header[4]) != 0
+
+    def heartbeat(self, now):
+        """Mark a reader as attached (see RingReader(heartbeat=True))."""
+        self._heartbeat[0] = now
+
+    def has_readers(self, now=None, timeout=READER_TIMEOUT):
+        """Whether an announced reader has polled within the last timeout seconds."""
+        if now is None:
+            now = time.monotonic()
+        return now - float(self._heartbeat[0]) < timeout
+
+    def write(self, data, timestamp, width=0, height=0, itemsize=1, sequence=None):
+        """
+        Publish one frame. data is any C-contiguous buffer (bytes, memoryview,
+        numpy array). sequence defaults to the ring frame number.
+        """
+        src = memoryview(data).cast('B')
+        size = src.nbytes
+        if size > self.slot_capacity:
+            raise ValueError(f"Frame of {size} bytes exceeds ring slot capacity {self.slot_capacity}")
+        n = self.write_seq
+        slot = n % self.slot_count
+        meta = self._meta[slot]
+
+        meta[0] = 2 * n + 1
+        self._data[slot][:size] = src
+        meta[1] = n if sequence is None else sequence
+        meta[2] = size
+        meta[3] = width
+        meta[4] = height
+        meta[5] = itemsize
+        self._timestamps[slot][0] = timestamp
+        meta[0] = 2 * n + 2
+        self._header[3] = n + 1
+        return n
+
+    def read_slot(self, n):
+        """View of frame n, or None if it is not (or no longer) in the ring."""
+        slot = n % self.slot_count
+        meta = self._meta[slot]
+        if int(meta[0]) != 2 * n + 2:
+            return None
+        frame = RingFrame(self, n, slot, int(meta[1]), float(self._timestamps[slot][0]),
+                          int(meta[3]), int(meta[4]), int(meta[5]),
+                          self._data[slot][:int(meta[2])])
+        # Re-check: the writer may have started on this slot while we read the header
+        if int(meta[0]) != 2 * n + 2:
+            return None
+        return frame
+
+    def is_valid(self, frame):
+        return int(self._meta[frame.slot][0]) == 2 * frame.n + 2
+
+    def close(self):
+        """
+        Release this ring's views and close the block (and unlink it, for the
+        writer). Frames read from the ring must not be used afterwards; if the
+        caller still holds one, the block stays mapped until it is released.
+        """
+        if self._header is None:
+            return
+        if self.owner:
+            self._header[4] = 1
+        # Every view into shm.buf must be gone before SharedMemory.close() can unmap it
+        self._header = None
+        self._heartbeat = None
+        self._meta = []
+        self._timestamps = []
+        for view in self._data:
+            view.release()
+        self._data = []
+        try:
+            self.shm.close()
+        except BufferError:
+            _deferred_close.append(self.shm)
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+        _close_deferred()
+
+
+class RingFrame:
+    """
+    Zero-copy view of one ring slot.
+
+    Also exposes the DepthAI message methods the broadcast functions use
+    (getFrame, getData, getTimestamp) so ring frames can be sent by the
+    same code as frames coming straight from the device queues.
+    """
+
+    __slots__ = ('ring', 'n', 'slot', 'sequence', 'timestamp', 'width', 'height', 'itemsize', 'data')
+
+    def __init__(self, ring, n, slot, sequence, timestamp, width, height, itemsize, data):
+        self.ring = ring
+        self.n = n
+        self.slot = slot
+        self.sequence = sequence
+        self.timestamp = timestamp
+        self.width = width
+        self.height = height
+        self.itemsize = itemsize
+        self.data = data
+
+    def is_valid(self):
+        # Copies (ring is None) no longer depend on the slot
+        return self.ring is None or self.ring.is_valid(self)
+
+    def copy_to(self, buffer):
+        """
+        Copy the frame into buffer (writable, at least as large) and return a
+        RingFrame over the copy, or None if the writer lapped the slot while
+        it was being copied.
+        """
+        size = self.data.nbytes
+        target = memoryview(buffer).cast('B')[:size]
+        target[:] = self.data
+        if not self.is_valid():
+            return None
+        return RingFrame(None, self.n, self.slot, self.sequence, self.timestamp,
+                         self.width, self.height, self.itemsize, target)
+
+    def getFrame(self):
+        return np.frombuffer(self.data, dtype=_DTYPES[self.itemsize]).reshape(self.height, self.width)
+
+    def getData(self):
+        return self.data
+
+    def getTimestamp(self):
+        return timedelta(seconds=self.timestamp)
+
+
+class RingReader:
+    """
+    Per-reader cursor over a SharedFrameRing; never blocks the writer.
+
+    With heartbeat=True, polling also keeps the ring's reader heartbeat
+    fresh, which tells the writer someone is attached. Same-host consumers
+    set it; the streamer's own sender processes do not.
+    """
+
+    def __init__(self, ring, start_at_latest=True, heartbeat=False):
+        self.ring = ring
+        self.next_seq = ring.write_seq if start_at_latest else 0
+        self.stats = {'frames': 0, 'dropped': 0, 'torn': 0}
+        self.heartbeat = heartbeat
+        self._last_heartbeat = 0.0
+
+    def poll(self):
+        """Next unread frame, or None if nothing new has been published."""
+        if self.heartbeat:
+            now = time.monotonic()
+            if now - self._last_heartbeat >= READER_HEARTBEAT_INTERVAL:
+                self._last_heartbeat = now
+                self.ring.heartbeat(now)
+        while True:
+            write_seq = self.ring.write_seq
+            if self.next_seq >= write_seq:
+                return None
+            # Keep one slot of margin: the writer may already be in write_seq's slot
+            oldest = write_seq - (self.ring.slot_count - 1)
+            if self.next_seq < oldest:
+                self.stats['dropped'] += oldest - self.next_seq
+                self.next_seq = oldest
+            n = self.next_seq
+            self.next_seq += 1
+            frame = self.ring.read_slot(n)
+            if frame is not None:
+                self.stats['frames'] += 1
+                return frame
+            self.stats['dropped'] += 1
+
+    def poll_copy(self, buffer):
+        """Like poll(), but returns a validated copy in buffer (see RingFrame.copy_to); torn copies are skipped."""
+        while True:
+            frame = self.poll()
+            if frame is None:
+                return None
+            copy = frame.copy_to(buffer)
+            if copy is not None:
+                return copy
+            self.stats['torn'] += 1
+
+    def wait(self, timeout=None, poll_interval=0.0005):
+        """Next unread frame, polling until one is published; None on timeout or writer shutdown."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            frame = self.poll()
+            if frame is not None:
+                return frame
+            if self.ring.closed or (deadline is not None and time.monotonic() >= deadline):
+                return None
+            time.sleep(poll_interval)
+
+    def latest(self):
+        """Skip any backlog and return the newest frame (or None)."""
+        write_seq = self.ring.write_seq
+        if write_seq > self.next_seq:
+            self.stats['dropped'] += write_seq - 1 - self.next_seq
+            self.next_seq = write_seq - 1
+        return self.poll()
+
+    def done(self, frame):
+        """Check a frame after use; returns False (and counts it) if it was overwritten."""
+        if frame.is_valid():
+            return True
+        self.stats['torn'] += 1
+        return False
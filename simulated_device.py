@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+Simulated OAK device for running the streamer without a camera.
+
+SimulatedPipeline stands in for the started dai.Pipeline and its output
+queues (has / get / tryGetAll), producing synthetic messages at the
+configured rate with the DepthAI accessors the streamer uses:
+
+    RGB     H.264-shaped Annex B packets (SPS/PPS/IDR every keyframe_interval,
+            non-IDR slices otherwise)
+    Left/Right  mono8 frames, Depth  uint16 frames
+    IMU     200Hz accelerometer / gyroscope / rotation vector packets
+
+Timestamps are on time.monotonic(), the same steady clock dai.Clock uses,
+minus a fixed capture latency. Used with --simulate (streamer) and
+--simulate-devices (controller) to exercise multi-device setups.
+
+control_queues() stands in for the cameras' inputControl queues: stop
+streaming pauses the queues fed by that camera, start streaming resumes
+them after SIMULATED_START_LATENCY, so demand-driven mode (--on-demand)
+runs against the simulator too.
+"""
+import time
+from datetime import timedelta
+
+import numpy as np
+
+SIMULATED_CAPTURE_LATENCY = 0.015
+SIMULATED_DEVICE_CLOCK_OFFSET = 12.5  # device clock runs from its own boot
+SIMULATED_START_LATENCY = 0.1  # start streaming -> first frame captured
+
+
+def list_simulated_devices(count):
+    return [{'device_id': f"SIM{i:012d}", 'name': f"simulated-{i}", 'state': 'SIMULATED'} for i in range(count)]
+
+
+class _Timestamp:
+    __slots__ = ('_value',)
+
+    def __init__(self, seconds):
+        self._value = timedelta(seconds=seconds)
+
+    def get(self):
+        return self._value
+
+
+class _Vector:
+    __slots__ = ('x', 'y', 'z', 'timestamp')
+
+    def __init__(self, values, timestamp):
+        self.x, self.y, self.z = (float(v) for v in values)
+        self.timestamp = timestamp
+
+
+class _RotationVector:
+    __slots__ = ('i', 'j', 'k', 'real', 'accuracy', 'timestamp')
+
+    def __init__(self, quat, timestamp):
+        self.i, self.j, self.k, self.real = (float(v) for v in quat)
+        self.accuracy = 0.02
+        self.timestamp = timestamp
+
+
+class SimulatedImuPacket:
+    __slots__ = ('acceleroMeter', 'gyroscope', 'rotationVector')
+
+    def __init__(self, t):
+        timestamp = _Timestamp(t)
+        self.acceleroMeter = _Vector((0.3 * np.sin(t), 0.2 * np.cos(1.7 * t), 9.81), timestamp)
+        self.gyroscope = _Vector((0.1 * np.sin(0.5 * t), 0.05 * np.cos(0.3 * t), 0.02), timestamp)
+        self.rotationVector = _RotationVector((0.0, 0.0, 0.0, 1.0), timestamp)
+
+
+class SimulatedImuData:
+    __slots__ = ('packets',)
+
+    def __init__(self, packets):
+        self.packets = packets
+
+
+class SimulatedFrame:
+    """ImgFrame / EncodedFrame stand-in."""
+
+    __slots__ = ('_data', '_timestamp')
+
+    def __init__(self, data, timestamp):
+        self._data = data
+        self._timestamp = timestamp
+
+    def getFrame(self):
+        return self._data
+
+    def getData(self):
+        return self._data
+
+    def getTimestamp(self):
+        return timedelta(seconds=self._timestamp)
+
+    def getTimestampDevice(self):
+        return timedelta(seconds=self._timestamp + SIMULATED_DEVICE_CLOCK_OFFSET)
+
+
+class SimulatedQueue:
+    """Non-blocking output queue that produces one message per period."""
+
+    def __init__(self, period, make_message, max_size=4):
+        self.period = period
+        self.make_message = make_message
+        self.max_size = max_size
+        self._next_capture = None
+
+    def start(self, delay=0.0):
+        self._next_capture = time.monotonic() + delay
+
+    def stop(self):
+        """Stop producing; messages not yet captured are never produced."""
+        self._next_capture = None
+
+    def _due(self):
+        if self._next_capture is None:
+            return 0
+        now = time.monotonic() - SIMULATED_CAPTURE_LATENCY
+        if now < self._next_capture:
+            return 0
+        backlog = int((now - self._next_capture) / self.period) + 1
+        if backlog > self.max_size:
+            # Non-blocking queue: oldest messages were overwritten
+            self._next_capture += (backlog - self.max_size) * self.period
+            backlog = self.max_size
+        return backlog
+
+    def has(self):
+        return self._due() > 0
+
+    def get(self):
+        while not self.has():
+            time.sleep(0.0005)
+        capture_time = self._next_capture
+        self._next_capture += self.period
+        return self.make_message(capture_time)
+
+    def tryGetAll(self):
+        return [self.get() for _ in range(self._due())]
+
+
+class SimulatedCameraControl:
+    """dai.CameraControl stand-in for the streaming start/stop commands."""
+
+    __slots__ = ('streaming',)
+
+    def __init__(self):
+        self.streaming = None
+
+    def setStartStreaming(self):
+        self.streaming = True
+
+    def setStopStreaming(self):
+        self.streaming = False
+
+
+class SimulatedControlQueue:
+    """
+    Camera inputControl queue stand-in: starts/stops the output queues fed by
+    that camera. A queue fed by several cameras (depth) runs while any does.
+    """
+
+    control_type = SimulatedCameraControl
+
+    def __init__(self, outputs, streaming_cameras):
+        self.outputs = outputs
+        self._streaming_cameras = streaming_cameras  # shared: output queue -> set of running cameras
+        self.stats = {'start': 0, 'stop': 0}
+
+    def send(self, ctrl):
+        if ctrl.streaming is None:
+            return
+        self.stats['start' if ctrl.streaming else 'stop'] += 1
+        for queue in self.outputs:
+            cameras = self._streaming_cameras.setdefault(queue, set())
+            was_running = bool(cameras)
+            if ctrl.streaming:
+                cameras.add(self)
+                if not was_running:
+                    queue.start(SIMULATED_START_LATENCY)
+            else:
+                cameras.discard(self)
+                if was_running and not cameras:
+                    queue.stop()
+
+
+class SimulatedPipeline:
+    """Started-pipeline stand-in with the streamer's five output queues."""
+
+    def __init__(self, fps, mono_width, mono_height, rgb_bitrate_kbps=20000, keyframe_interval=15, seed=0):
+        rng = np.random.default_rng(seed)
+        self.mono_left = rng.integers(0, 256, (mono_height, mono_width), dtype=np.uint8)
+        self.mono_right = np.roll(self.mono_left, 8, axis=1)
+        yy, xx = np.mgrid[0:mono_height, 0:mono_width]
+        self.depth = (800 + 2 * xx + yy + rng.integers(0, 4, (mono_height, mono_width))).astype(np.uint16)
+
+        # H.264-shaped packets: payload bytes never form a start code
+        frame_bytes = max(256, rgb_bitrate_kbps * 1000 // 8 // fps)
+        start = b'\x00\x00\x00\x01'
+        sps = start + b'\x67' + rng.integers(1, 256, 16, dtype=np.uint8).tobytes()
+        pps = start + b'\x68' + rng.integers(1, 256, 4, dtype=np.uint8).tobytes()
+        self.idr_packet = np.frombuffer(
+            sps + pps + start + b'\x65' + rng.integers(1, 256, frame_bytes * 4, dtype=np.uint8).tobytes(),
+            dtype=np.uint8)
+        self.slice_packet = np.frombuffer(
+            start + b'\x41' + rng.integers(1, 256, frame_bytes, dtype=np.uint8).tobytes(), dtype=np.uint8)
+        self.keyframe_interval = keyframe_interval
+        self._rgb_count = 0
+
+        period = 1.0 / fps
+        imu_period = 1.0 / 200
+        self.rgbQueue = SimulatedQueue(period, self._rgb_packet)
+        self.leftQueue = SimulatedQueue(period, lambda t: SimulatedFrame(self.mono_left, t))
+        self.rightQueue = SimulatedQueue(period, lambda t: SimulatedFrame(self.mono_right, t))
+        self.depthQueue = SimulatedQueue(period, lambda t: SimulatedFrame(self.depth, t))
+        # IMU batches of up to 10 reports, like setMaxBatchReports(10)
+        self.imuQueue = SimulatedQueue(
+            imu_period * 2, lambda t: SimulatedImuData([SimulatedImuPacket(t), SimulatedImuPacket(t + imu_period)]),
+            max_size=50)
+        self._running = False
+
+        self._streaming_cameras = {}
+        self.rgbControl = SimulatedControlQueue([self.rgbQueue], self._streaming_cameras)
+        self.leftControl = SimulatedControlQueue([self.leftQueue, self.depthQueue], self._streaming_cameras)
+        self.rightControl = SimulatedControlQueue([self.rightQueue, self.depthQueue], self._streaming_cameras)
+
+    def _rgb_packet(self, t):
+        keyframe = self._rgb_count % self.keyframe_interval == 0
+        self._rgb_count += 1
+        return SimulatedFrame(self.idr_packet if keyframe else self.slice_packet, t)
+
+    def queues(self):
+        return self.rgbQueue, self.leftQueue, self.rightQueue, self.depthQueue, self.imuQueue
+
+    def control_queues(self):
+        """RGB, Left and Right camera control queues (inputControl stand-ins)."""
+        return self.rgbControl, self.leftControl, self.rightControl
+
+    def start(self):
+        self._running = True
+        for queue in self.queues():
+            queue.start()
+        # Cameras start out streaming, like the device
+        for control in self.control_queues():
+            for queue in control.outputs:
+                self._streaming_cameras.setdefault(queue, set()).add(control)
+
+    def isRunning(self):
+        return self._running
+
+    def stop(self):
+        self._running = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False